@@ -0,0 +1,98 @@
+"""
+audio.py — Parallel audio pipeline, decoupled from the video encode
+Every audio track is extracted and encoded to Opus by its own ffmpeg worker
+while SVT-AV1 runs, then muxed back in the finalize step. Outputs are keyed
+by source fingerprint + audio settings, so a re-run that only changes video
+parameters (CRF, preset, grain...) reuses them instead of re-encoding.
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+import config
+
+
+def _cache_key(fingerprint: str, track: int, audio_args: list[str], seek_args: list[str]) -> str:
+    blob = json.dumps([fingerprint, track, audio_args, seek_args])
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def audio_output_path(fingerprint: str, track: int, audio_args: list[str], seek_args: list[str]) -> str:
+    return os.path.join(
+        config.AUDIO_CACHE_DIR,
+        f"a{track:02d}_{_cache_key(fingerprint, track, audio_args, seek_args)}.mka",
+    )
+
+
+async def encode_audio_tracks(
+    source:      str,
+    track_count: int,
+    audio_args:  list[str],
+    seek_args:   list[str],
+    fingerprint: str,
+    workers:     int,
+) -> list[str] | None:
+    """
+    Encode audio tracks 0..track_count-1 of *source* into Matroska audio
+    files (language/title tags carried over), *workers* at a time.
+    Returns the paths in track order, or None if any track failed.
+    """
+    os.makedirs(config.AUDIO_CACHE_DIR, exist_ok=True)
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def _encode(track: int) -> str | None:
+        out = audio_output_path(fingerprint, track, audio_args, seek_args)
+        if os.path.exists(out) and os.path.getsize(out) > 0:
+            print(f"[audio] a:{track} reused → {out}")
+            return out
+        part = out + ".part"
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", *seek_args, "-i", source,
+                "-map", f"0:a:{track}", "-vn", "-sn", "-dn",
+                *audio_args,
+                "-nostats", "-f", "matroska", "-y", part,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            tail = stderr.decode("utf-8", errors="replace").strip().splitlines()[-3:]
+            print(f"[audio] a:{track} failed rc={proc.returncode}: {' | '.join(tail)}")
+            return None
+        os.replace(part, out)
+        print(f"[audio] a:{track} encoded → {out}")
+        return out
+
+    paths = await asyncio.gather(*(_encode(t) for t in range(track_count)))
+    if any(p is None for p in paths):
+        return None
+    return list(paths)
+
+
+async def mux_audio(video_file: str, audio_files: list[str], output: str, log_file) -> int:
+    """
+    Stream-copy mux: video (+ subs/chapters) from *video_file*, then the
+    pre-encoded audio tracks in order. Audio goes before subtitles so the
+    track layout matches a single-pass encode.
+    """
+    inputs, maps = [], []
+    for i, path in enumerate(audio_files, start=1):
+        inputs += ["-i", path]
+        maps   += ["-map", f"{i}:a:0"]
+    cmd = [
+        "ffmpeg", "-i", video_file, *inputs,
+        "-map", "0:v:0", *maps, "-map", "0:s?",
+        "-c", "copy", "-map_chapters", "0",
+        "-nostats", "-y", output,
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    async for raw_line in proc.stdout:
+        log_file.write(f"[audio-mux] {raw_line.decode('utf-8', errors='replace')}")
+    await proc.wait()
+    return proc.returncode
@@ -0,0 +1,360 @@
+"""
+batch.py — Season batch mode: download / encode / deliver, pipelined
+One encode.yml run per episode repeats setup, auth and analysis, and the CPU
+idles through every download and upload. batch.py takes the whole season and
+overlaps the stages: episode N+1 downloads while N encodes and N-1 gets its
+VMAF + upload.
+
+    python3 batch.py episodes.json
+
+episodes.json:
+    [{"url": "https://t.me/c/123/45", "season": "1", "episode": "1"},
+     {"url": "https://cdn.example/ep02.mkv", "season": "1", "episode": "2",
+      "custom_name": "Show - 02", "env": {"USER_CRF": "30"}}]
+
+"env" holds per-episode settings for main.py / upload.py on top of ours.
+
+Each episode runs in its own workdir under BATCH_DIR with the existing
+phases as subprocesses — main.py with ENCODE_ONLY=true, then upload.py with
+TG_STATUS_MESSAGE=false — so naming still goes through
+rename.resolve_output_name (ANIME_NAME + the episode's SEASON / EPISODE).
+Every stage is bounded by its own semaphore (BATCH_DOWNLOADS /
+BATCH_ENCODES / BATCH_UPLOADS), and at most their sum of episodes hold disk
+at once. A failed episode gives up its slot only after its media is
+deleted; its logs stay in the workdir.
+
+All Telegram traffic goes through one tg_gateway.py client (started here if
+none is running), and the season gets a single status board message.
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sys
+import time
+
+import config
+import tg_connect
+import tg_gateway
+import tg_scheduler
+from ui import format_time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same URL routing as the encode.yml download step
+YTDLP_HOSTS = ("m3u8", "youtube.com", "youtu.be", "bilibili.com", "nicovideo.jp",
+               "vimeo.com", "dailymotion.com", "twitch.tv")
+
+STAGE_ICONS = {
+    "queued":      "⏳",
+    "waiting":     "⏸",
+    "downloading": "📥",
+    "encoding":    "⚙️",
+    "delivering":  "🛰",
+    "done":        "✅",
+    "failed":      "❌",
+}
+
+
+def load_episodes(path: str) -> list[dict]:
+    with open(path) as f:
+        episodes = json.load(f)
+    for i, ep in enumerate(episodes):
+        if not ep.get("url"):
+            raise ValueError(f"Episode #{i + 1} has no url")
+        ep["season"]  = str(ep.get("season") or config.SEASON)
+        ep["episode"] = str(ep.get("episode") or i + 1)
+        ep["label"]   = f"S{int(ep['season']):02d}E{int(ep['episode']):02d}"
+        ep["workdir"] = os.path.abspath(os.path.join(config.BATCH_DIR, ep["label"]))
+        ep["stage"]   = "queued"
+        ep["times"]   = {}
+    return episodes
+
+
+# ---------------------------------------------------------------------------
+# STATUS BOARD
+# ---------------------------------------------------------------------------
+def render_board(episodes: list[dict], started: float, final: bool = False) -> str:
+    done   = sum(ep["stage"] == "done" for ep in episodes)
+    failed = sum(ep["stage"] == "failed" for ep in episodes)
+    title  = "SEASON.COMPLETE" if final else "SEASON.BATCH"
+    lines  = [f"<b>📺 [ {title} ] {done}/{len(episodes)} delivered"
+              + (f" | {failed} failed" if failed else "") + "</b>",
+              f"<i>{config.ANIME_NAME or 'Batch'} · {format_time(time.time() - started)}</i>", ""]
+    for ep in episodes:
+        timing = " ".join(f"{k[0]}:{format_time(v)}" for k, v in ep["times"].items())
+        name   = ep.get("output") or ep.get("source_name") or ""
+        lines.append(f"{STAGE_ICONS[ep['stage']]} <code>{ep['label']}</code> {ep['stage']:<11} "
+                     f"<code>{timing}</code>")
+        if name and ep["stage"] in ("done", "failed"):
+            lines.append(f"   └ <code>{name[:48]}</code>")
+        if ep.get("error"):
+            lines.append(f"   └ <i>{ep['error'][:80]}</i>")
+    return "\n".join(lines)
+
+
+class Board:
+    """The season's single status message, re-rendered on every stage change."""
+
+    def __init__(self, app, episodes, started):
+        self.app      = app
+        self.episodes = episodes
+        self.started  = started
+        self.message  = None
+
+    async def open(self):
+        self.message = await tg_connect.send_status(self.app, render_board(self.episodes, self.started),
+                                                    self.started)
+
+    async def refresh(self, final: bool = False):
+        text = render_board(self.episodes, self.started, final)
+        if not self.message:
+            print(text)
+            return
+        await tg_scheduler.edit_text(
+            self.app, config.CHAT_ID, self.message.id, text,
+            priority=tg_scheduler.PRIORITY_CRITICAL if final else tg_scheduler.PRIORITY_NORMAL,
+            wait=final,
+        )
+
+
+# ---------------------------------------------------------------------------
+# STAGES
+# ---------------------------------------------------------------------------
+PHASE_STOP_GRACE = 10      # seconds between SIGTERM and SIGKILL for a cancelled phase
+
+
+async def run_phase(args: list[str], workdir: str, log_name: str, env: dict,
+                    cpus: list[int] | None = None) -> int:
+    """
+    Run one phase in *workdir*, output to *log_name* there. *cpus* pins it
+    (and everything it spawns) to those cores. Returns the exit code.
+    The phase gets its own process group, so cancelling this coroutine stops
+    it together with its ffmpeg children.
+    """
+    with open(os.path.join(workdir, log_name), "ab") as log:
+        proc = await asyncio.create_subprocess_exec(
+            *args, cwd=workdir, env={**os.environ, **env},
+            stdout=log, stderr=asyncio.subprocess.STDOUT,
+            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+            start_new_session=True,
+        )
+        try:
+            return await proc.wait()
+        except asyncio.CancelledError:
+            await stop_group(proc)
+            raise
+
+
+async def stop_group(proc):
+    """SIGTERM *proc*'s process group, then SIGKILL whatever is left after PHASE_STOP_GRACE."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), PHASE_STOP_GRACE)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)     # children that outlived the leader too
+    except ProcessLookupError:
+        pass
+    await proc.wait()
+
+
+KEEP_ON_FAILURE = (".log", ".json", ".txt")
+
+
+def prune_workdir(workdir: str):
+    """Delete a failed run's media (source, encodes, chunks) and keep its logs."""
+    for entry in os.scandir(workdir):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        elif not entry.name.endswith(KEEP_ON_FAILURE):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _tail(workdir: str, log_name: str, n: int = 1) -> str:
+    try:
+        with open(os.path.join(workdir, log_name), errors="replace") as f:
+            lines = [l.strip() for l in f.readlines() if l.strip()]
+        return " | ".join(lines[-n:])
+    except OSError:
+        return "no log"
+
+
+async def _resolve_name(url: str, custom: str | None, fallback: str) -> str:
+    if custom:
+        return f"{custom}.mkv"
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO_DIR, "resolve_filename.py"), url,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    # Never "source.mkv" — the output would overwrite the source in the workdir
+    name = out.decode(errors="replace").strip() or fallback
+    return name if name.endswith((".mkv", ".mp4", ".webm")) else f"{name}.mkv"
+
+
+async def download(app, ep: dict):
+    source = os.path.join(ep["workdir"], config.SOURCE)
+    url    = ep["url"]
+    if url.startswith("tg_file:") or "t.me/" in url:
+        # Progress goes on the board, not the gateway's status message
+        ep["source_name"] = await app.download(url, path=source, quiet=True)
+        return
+    if url.startswith("magnet:"):
+        raise RuntimeError("Magnet links are disabled.")
+    if os.path.isfile(url):
+        # Local file (self-hosted worker) — link it in, copy across filesystems
+        name = f"{ep['custom_name']}.mkv" if ep.get("custom_name") else os.path.basename(url)
+        ep["source_name"] = name if name != config.SOURCE else f"{ep['label']}.mkv"
+        try:
+            os.link(url, source)
+        except OSError:
+            await asyncio.to_thread(shutil.copyfile, url, source)
+        return
+
+    ep["source_name"] = await _resolve_name(url, ep.get("custom_name"), ep["label"])
+    if any(h in url for h in YTDLP_HOSTS):
+        args = ["yt-dlp", "--downloader", "aria2c",
+                "--downloader-args", "aria2c:-x 16 -s 16 -k 1M --console-log-level=warn",
+                "--merge-output-format", "mkv", "-o", config.SOURCE, url]
+    else:
+        args = ["aria2c", "-x", "16", "-s", "16", "-k", "1M", "--user-agent=Mozilla/5.0",
+                "--console-log-level=warn", "--retry-wait=5", "--max-tries=10",
+                "-o", config.SOURCE, url]
+    if await run_phase(args, ep["workdir"], "download.log", {}) != 0:
+        raise RuntimeError(f"download failed: {_tail(ep['workdir'], 'download.log')}")
+
+
+async def encode(ep: dict, cpus: list[int] | None = None):
+    env = {
+        **ep.get("env", {}),
+        "ENCODE_ONLY": "true",
+        "FILE_NAME":   ep.get("source_name") or f"{ep['label']}.mkv",
+        "VIDEO_URL":   ep["url"],
+        "SEASON":      ep["season"],
+        "EPISODE":     ep["episode"],
+    }
+    code = await run_phase([sys.executable, os.path.join(REPO_DIR, "main.py")],
+                           ep["workdir"], "encode.log", env, cpus)
+    if code != 0:
+        raise RuntimeError(f"encode failed: {_tail(ep['workdir'], 'encode.log')}")
+    with open(os.path.join(ep["workdir"], "output_fname.txt")) as f:
+        ep["output"] = f.read().strip()
+
+
+async def deliver(ep: dict, cpus: list[int] | None = None):
+    env  = {**ep.get("env", {}), "TG_STATUS_MESSAGE": "false",
+            "SEASON": ep["season"], "EPISODE": ep["episode"]}
+    code = await run_phase([sys.executable, os.path.join(REPO_DIR, "upload.py")],
+                           ep["workdir"], "upload.log", env, cpus)
+    if code != 0:
+        raise RuntimeError(f"upload failed: {_tail(ep['workdir'], 'upload.log')}")
+
+
+async def run_episode(app, ep: dict, board: Board, slots: dict):
+    async with slots["inflight"]:
+        os.makedirs(ep["workdir"], exist_ok=True)
+        for stage, sem, step in (("downloading", slots["download"], lambda: download(app, ep)),
+                                 ("encoding",    slots["encode"],   lambda: encode(ep)),
+                                 ("delivering",  slots["upload"],   lambda: deliver(ep))):
+            async with sem:
+                ep["stage"] = stage
+                await board.refresh()
+                t0 = time.time()
+                try:
+                    await step()
+                except Exception as e:
+                    ep["stage"], ep["error"] = "failed", str(e)
+                    print(f"[batch] {ep['label']} {stage} failed: {e} (logs kept in {ep['workdir']})")
+                    # Still inside the inflight slot — the next episode can't start until the disk is freed
+                    prune_workdir(ep["workdir"])
+                    await board.refresh()
+                    return
+                finally:
+                    ep["times"][stage] = time.time() - t0
+                print(f"[batch] {ep['label']} {stage} done in {format_time(ep['times'][stage])}")
+                ep["stage"] = "waiting"     # for the next stage's slot
+        ep["stage"] = "done"
+        shutil.rmtree(ep["workdir"], ignore_errors=True)
+        await board.refresh()
+
+
+# ---------------------------------------------------------------------------
+# GATEWAY
+# ---------------------------------------------------------------------------
+async def ensure_gateway():
+    """(GatewayApp, server process or None). Starts tg_gateway.py when none is running."""
+    # Phases run in per-episode workdirs — they need an absolute socket path
+    config.TG_GATEWAY_SOCKET = os.path.abspath(config.TG_GATEWAY_SOCKET)
+    os.environ["TG_GATEWAY_SOCKET"] = config.TG_GATEWAY_SOCKET
+
+    app = await tg_gateway.connect_client()
+    if app:
+        return app, None
+    os.makedirs(config.BATCH_DIR, exist_ok=True)
+    log  = open(os.path.join(config.BATCH_DIR, "gateway.log"), "ab")
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO_DIR, "tg_gateway.py"), "serve",
+        stdout=log, stderr=asyncio.subprocess.STDOUT,
+    )
+    for _ in range(120):
+        await asyncio.sleep(1)
+        if proc.returncode is not None:
+            break
+        app = await tg_gateway.connect_client()
+        if app:
+            return app, proc
+    raise RuntimeError(f"Gateway did not come up — see {config.BATCH_DIR}/gateway.log")
+
+
+async def main():
+    if len(sys.argv) < 2:
+        print("usage: python3 batch.py episodes.json")
+        sys.exit(2)
+    episodes = load_episodes(sys.argv[1])
+    started  = time.time()
+    print(f"[batch] {len(episodes)} episode(s) | download x{config.BATCH_DOWNLOADS} | "
+          f"encode x{config.BATCH_ENCODES} | upload x{config.BATCH_UPLOADS}")
+
+    app, server = await ensure_gateway()
+    board = Board(app, episodes, started)
+    try:
+        await board.open()
+        slots = {
+            "download": asyncio.Semaphore(max(1, config.BATCH_DOWNLOADS)),
+            "encode":   asyncio.Semaphore(max(1, config.BATCH_ENCODES)),
+            "upload":   asyncio.Semaphore(max(1, config.BATCH_UPLOADS)),
+            # Bounds episodes on disk: one per stage slot
+            "inflight": asyncio.Semaphore(max(1, config.BATCH_DOWNLOADS) + max(1, config.BATCH_ENCODES)
+                                          + max(1, config.BATCH_UPLOADS)),
+        }
+        await asyncio.gather(*(run_episode(app, ep, board, slots) for ep in episodes))
+        await board.refresh(final=True)
+    finally:
+        await tg_scheduler.flush()
+        if server:
+            await app.shutdown()
+        # Close our connection before waiting: on 3.12+ the gateway's
+        # wait_closed() blocks until every client has hung up
+        await app.stop()
+        if server:
+            await server.wait()
+
+    failed = [ep["label"] for ep in episodes if ep["stage"] == "failed"]
+    print(f"[batch] Finished in {format_time(time.time() - started)} — "
+          f"{len(episodes) - len(failed)}/{len(episodes)} delivered"
+          + (f", failed: {', '.join(failed)}" if failed else ""))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+bench_crop.py — Compare the legacy cropdetect path with the NumPy analyzer.
+
+    python3 bench_crop.py [SOURCE] [ROUNDS]
+
+Runs both detectors ROUNDS times (default 3) on SOURCE (default
+config.SOURCE) and prints wall time, the crop each one chose, and how much
+of the timeline each looked at.
+"""
+import sys
+import time
+
+import config
+from cropdetect import analyze_crop
+from media import get_crop_params_cropdetect, get_video_info
+
+
+def _timed(fn, rounds):
+    best, result = float("inf"), None
+    for _ in range(rounds):
+        t0     = time.perf_counter()
+        result = fn()
+        best   = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    if len(sys.argv) > 1:
+        config.SOURCE = sys.argv[1]
+    rounds   = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    duration = get_video_info()[0]
+
+    legacy_t, legacy_crop = _timed(lambda: get_crop_params_cropdetect(duration), rounds)
+    numpy_t, (crop, confidence, frames) = _timed(
+        lambda: analyze_crop(config.SOURCE, duration, config.CROP_SAMPLES), rounds
+    )
+
+    print(f"source:   {config.SOURCE} ({duration:.0f}s), best of {rounds}")
+    print(f"legacy:   {legacy_t:7.2f}s  crop={legacy_crop}  (4 points x 20 frames)")
+    print(f"numpy:    {numpy_t:7.2f}s  crop={crop}  confidence={confidence:.0%}  ({frames} keyframes)")
+    if numpy_t > 0:
+        print(f"speedup:  {legacy_t / numpy_t:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
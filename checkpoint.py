@@ -0,0 +1,110 @@
+"""
+checkpoint.py — Resumable chunked encodes
+Persists every finished chunk plus a small manifest so a re-run of main.py
+(on this runner or, via the uploaded artifact, on another one) continues
+where the last run stopped instead of starting from frame 0.
+
+manifest.json layout:
+    {
+        "version":     1,
+        "fingerprint": "<size>-<sha1>",     # media.file_fingerprint(source)
+        "params":      {...},               # everything that shapes the bitstream
+        "chunks":      [[start, end], ...], # the split plan, reused verbatim
+        "done":        [0, 1, 4, ...],      # indexes whose chunk file is final
+        "updated":     1712345678
+    }
+
+With a deadline (CHECKPOINT_DEADLINE, epoch seconds set by the workflow
+from the job's start time) the chunked encoder stops dispatching and kills
+unfinished chunks once it passes, so the runner still has time to upload
+the checkpoint before the job limit.
+"""
+import json
+import os
+import shutil
+import time
+
+MANIFEST_NAME    = "manifest.json"
+MANIFEST_VERSION = 1
+DEADLINE_RC      = 124       # encode_chunks() stopped at the deadline (same code as timeout(1))
+
+
+def manifest_path(work_dir: str) -> str:
+    return os.path.join(work_dir, MANIFEST_NAME)
+
+
+def load_manifest(work_dir: str) -> dict | None:
+    path = manifest_path(work_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[checkpoint] Unreadable manifest ({e}) — starting fresh.")
+        return None
+    if state.get("version") != MANIFEST_VERSION:
+        return None
+    return state
+
+
+def save_manifest(work_dir: str, state: dict):
+    """Atomic write — a runner killed mid-write never leaves a torn manifest."""
+    state["updated"] = int(time.time())
+    tmp = manifest_path(work_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, manifest_path(work_dir))
+
+
+def prepare(work_dir: str, fingerprint: str, params: dict,
+            chunks: list[tuple[float, float]]) -> dict:
+    """
+    Return the manifest to encode against.
+
+    A previous manifest is resumed only if the source fingerprint and every
+    encode parameter match; its chunk plan then replaces *chunks* so the
+    already-finished files line up. Anything else wipes *work_dir*.
+    """
+    previous = load_manifest(work_dir)
+    if previous and previous.get("fingerprint") == fingerprint and previous.get("params") == params:
+        done = [
+            idx for idx in previous.get("done", [])
+            if os.path.exists(chunk_path(work_dir, idx)) and os.path.getsize(chunk_path(work_dir, idx)) > 0
+        ]
+        previous["done"] = sorted(set(done))
+        print(
+            f"[checkpoint] Resuming: {len(previous['done'])}/{len(previous['chunks'])} "
+            f"chunk(s) already encoded."
+        )
+        save_manifest(work_dir, previous)
+        return previous
+
+    if previous:
+        print("[checkpoint] Manifest does not match this source/params — discarding it.")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+    state = {
+        "version":     MANIFEST_VERSION,
+        "fingerprint": fingerprint,
+        "params":      params,
+        "chunks":      [[start, end] for start, end in chunks],
+        "done":        [],
+    }
+    save_manifest(work_dir, state)
+    return state
+
+
+def mark_done(work_dir: str, state: dict, idx: int):
+    if idx not in state["done"]:
+        state["done"].append(idx)
+        state["done"].sort()
+    save_manifest(work_dir, state)
+
+
+def chunk_path(work_dir: str, idx: int) -> str:
+    return os.path.join(work_dir, f"chunk_{idx:04d}.mkv")
+
+
+def deadline_passed(deadline: float) -> bool:
+    return bool(deadline) and time.time() >= deadline
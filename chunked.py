@@ -0,0 +1,256 @@
+"""
+chunked.py — Scene-cut chunked parallel encoding
+Splits the source at keyframes, encodes every chunk with its own small
+SVT-AV1 instance (several run side by side), then stitches the AV1 bitstream
+back together with a stream copy and muxes audio/subs/chapters from source.
+
+One big SVT-AV1 process stops scaling past a handful of cores at presets
+6–10; N smaller ones with lp=cores/N keep every core busy.
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+
+import config
+from checkpoint import DEADLINE_RC, chunk_path, deadline_passed
+
+CHUNK_DIR = "chunks"
+
+
+# ---------------------------------------------------------------------------
+# SPLIT PLANNING
+# ---------------------------------------------------------------------------
+
+def probe_keyframes(source: str) -> list[float]:
+    """
+    Return the keyframe timestamps (seconds) of the first video stream.
+    Reads packet flags only — nothing is decoded, so this takes seconds even
+    on a 2h source. Release encoders place keyframes on scene cuts, so these
+    double as scene-cut candidates.
+    """
+    cmd = [
+        "ffprobe", "-v", "quiet", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0", source,
+    ]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
+    except Exception as e:
+        print(f"[chunked] Keyframe probe failed: {e}")
+        return []
+
+    keyframes: list[float] = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            keyframes.append(float(pts))
+        except ValueError:
+            continue
+    return sorted(keyframes)
+
+
+def plan_chunks(keyframes: list[float], start: float, end: float,
+                target_len: float) -> list[tuple[float, float]]:
+    """
+    Greedy split of [start, end): cut at the first keyframe that is at least
+    *target_len* past the previous cut. The tail is never left shorter than
+    half a chunk. Falls back to even slices when the source has no usable
+    keyframe index (input-side -ss is frame accurate either way).
+    """
+    min_tail = target_len / 2
+    usable   = [kf for kf in keyframes if start < kf < end]
+
+    if not usable:
+        count = max(1, int((end - start) // target_len))
+        step  = (end - start) / count
+        usable = [start + step * i for i in range(1, count)]
+        min_tail, target_len = 0, 0
+
+    cuts = [start]
+    for kf in usable:
+        if kf - cuts[-1] >= target_len and end - kf >= min_tail:
+            cuts.append(kf)
+    cuts.append(end)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def resolve_workers(cpus: int) -> int:
+    """CHUNK_WORKERS, or one SVT-AV1 instance per 4 cores when left at 0."""
+    if config.CHUNK_WORKERS > 0:
+        return config.CHUNK_WORKERS
+    return max(1, cpus // 4)
+
+
+# ---------------------------------------------------------------------------
+# PARALLEL CHUNK ENCODE
+# ---------------------------------------------------------------------------
+
+async def encode_chunks(
+    chunks:      list[tuple[float, float]],
+    source:      str,
+    video_args:  list[str],
+    svt_params:  str,
+    workers:     int,
+    on_progress,
+    log_file,
+    work_dir:    str = CHUNK_DIR,
+    completed:   set[int] | None = None,
+    on_chunk_done=None,
+    deadline:    float = 0,
+) -> tuple[int, list[str]]:
+    """
+    Encode every (start, end) slice of *source* to its own video-only MKV.
+
+    on_progress:   async callable(done_sec, out_bytes) fed with progress summed
+                   across all chunks, so the caller can drive the normal
+                   encode UI as if a single ffmpeg were running.
+    completed:     chunk indexes already on disk from a previous run; they
+                   are skipped and counted as done.
+    on_chunk_done: optional callable(idx) fired once a chunk file is final.
+    deadline:      epoch seconds; past it no chunk starts and running ones
+                   are killed (their .part files are dropped).
+
+    Each chunk is written to a .part file and renamed when ffmpeg exits
+    cleanly, so a killed run never leaves a truncated chunk behind.
+
+    Returns (returncode, chunk_paths). returncode is 0 only if every chunk
+    finished cleanly, DEADLINE_RC if the deadline cut the encode short.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    completed = completed or set()
+    paths     = [chunk_path(work_dir, i) for i in range(len(chunks))]
+    done_sec  = [(e - s) if i in completed else 0.0 for i, (s, e) in enumerate(chunks)]
+    procs: dict[int, asyncio.subprocess.Process] = {}
+    semaphore = asyncio.Semaphore(workers)
+    failed    = asyncio.Event()
+
+    def _out_bytes() -> int:
+        return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+    async def _encode(idx: int, start: float, end: float) -> int:
+        if idx in completed:
+            return 0
+        part_path = paths[idx] + ".part"
+        async with semaphore:
+            if failed.is_set() or config.CANCELLED:
+                return 1
+            if deadline_passed(deadline):
+                return DEADLINE_RC
+            cmd = [
+                "ffmpeg",
+                "-ss", f"{start:.6f}",
+                "-i", source,
+                "-t", f"{end - start:.6f}",
+                "-map", "0:v:0",
+                *video_args,
+                "-svtav1-params", svt_params,
+                "-an", "-sn", "-dn",
+                "-progress", "pipe:1",
+                "-nostats",
+                "-f", "matroska",
+                "-y", part_path,
+            ]
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            procs[idx] = proc
+
+            async for raw_line in proc.stdout:
+                line = raw_line.decode("utf-8", errors="replace")
+                log_file.write(f"[chunk {idx:04d}] {line}")
+                if config.CANCELLED or failed.is_set() or deadline_passed(deadline):
+                    proc.terminate()
+                    break
+                if "out_time_ms" in line:
+                    try:
+                        curr_sec      = int(line.split("=")[1]) / 1_000_000
+                        done_sec[idx] = min(curr_sec, end - start)
+                        await on_progress(sum(done_sec), _out_bytes())
+                    except Exception:
+                        continue
+
+            await proc.wait()
+            procs.pop(idx, None)
+            if proc.returncode != 0 and deadline_passed(deadline):
+                return DEADLINE_RC
+            if proc.returncode != 0:
+                failed.set()
+                print(f"[chunked] Chunk {idx} ({start:.1f}s–{end:.1f}s) failed rc={proc.returncode}")
+                return proc.returncode or 1
+            os.replace(part_path, paths[idx])
+            done_sec[idx] = end - start
+            if on_chunk_done:
+                on_chunk_done(idx)
+            await on_progress(sum(done_sec), _out_bytes())
+            return 0
+
+    results = await asyncio.gather(*(
+        _encode(i, s, e) for i, (s, e) in enumerate(chunks)
+    ))
+    for proc in procs.values():
+        if proc.returncode is None:
+            proc.terminate()
+
+    rc = next((r for r in results if r != 0), 0)
+    return rc, paths
+
+
+# ---------------------------------------------------------------------------
+# LOSSLESS CONCAT + MUX
+# ---------------------------------------------------------------------------
+
+async def concat_and_mux(
+    chunk_paths: list[str],
+    source:      str,
+    output:      str,
+    seek_args:   list[str],
+    extra_inputs: list[str],
+    stream_maps: list[str],
+    stream_args: list[str],
+    log_file,
+    work_dir:    str = CHUNK_DIR,
+) -> int:
+    """
+    Stream-copy the encoded chunks back into one AV1 track (concat demuxer,
+    no re-encode) and mux audio/subs/chapters from *source* around it.
+
+    stream_maps / stream_args are the same non-video arguments the
+    single-pass command uses; source stays input 0 so their indexes hold.
+    """
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w") as f:
+        for path in chunk_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    video_input = 1 + extra_inputs.count("-i")
+    cmd = [
+        "ffmpeg",
+        *seek_args,
+        "-i", source,
+        *extra_inputs,
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-map", f"{video_input}:v:0",
+        *stream_maps,
+        "-c:v", "copy",
+        *stream_args,
+        "-nostats",
+        "-y", output,
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    async for raw_line in proc.stdout:
+        log_file.write(f"[concat] {raw_line.decode('utf-8', errors='replace')}")
+    await proc.wait()
+    return proc.returncode
+
+
+def cleanup_chunks(work_dir: str = CHUNK_DIR):
+    shutil.rmtree(work_dir, ignore_errors=True)
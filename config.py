@@ -3,6 +3,7 @@ import os
 # ---------- FILE PATHS & CONSTANTS ----------
 SOURCE = "source.mkv"
 SCREENSHOT = "grid_preview.jpg"
+THUMBNAIL = "thumb.jpg"
 LOG_FILE = "encode_log.txt"
 
 # ---------- TELEGRAM CREDENTIALS ----------
@@ -14,7 +15,7 @@ FILE_NAME = os.getenv("FILE_NAME", "output.mkv")
 SESSION_NAME = os.getenv("SESSION_NAME", "enc_session")
 
 # ---------- USER SETTINGS ----------
-USER_RES = os.getenv("USER_RES")
+USER_RES = os.getenv("USER_RES")          # "720", or a ladder "1080,720,480" (one decode, one file per height)
 USER_CRF = os.getenv("USER_CRF")
 USER_PRESET = os.getenv("USER_PRESET")
 USER_GRAIN = os.getenv("USER_GRAIN", "0")
@@ -52,5 +53,190 @@ AUDIO_TRACKS = os.getenv("AUDIO_TRACKS", "")       # e.g. "Japanese, English (Du
 DEMO_START    = os.getenv("DEMO_START",    "0")   # seconds or HH:MM:SS
 DEMO_DURATION = os.getenv("DEMO_DURATION", "")    # seconds; blank = full encode
 
+# ---------- CHUNKED PARALLEL ENCODING ----------
+# When enabled, the source is split at keyframes and encoded by several
+# smaller SVT-AV1 instances at once, then concatenated losslessly.
+# CHUNK_WORKERS = 0 picks one instance per 4 cores.
+CHUNKED_ENCODE = os.getenv("CHUNKED_ENCODE", "false").lower() == "true"
+CHUNK_WORKERS  = int(os.getenv("CHUNK_WORKERS", "0") or 0)
+CHUNK_SECONDS  = float(os.getenv("CHUNK_SECONDS", "90") or 90)   # target chunk length
+
+# ---------- CHECKPOINTED / RESUMABLE ENCODING ----------
+# Uses the chunked engine but keeps finished chunks + a manifest in
+# CHECKPOINT_DIR, so a re-run after a runner timeout resumes instead of
+# starting over. The workflow uploads this directory as an artifact.
+CHECKPOINT_ENCODE = os.getenv("CHECKPOINT_ENCODE", "false").lower() == "true"
+CHECKPOINT_DIR    = os.getenv("CHECKPOINT_DIR", "encode_checkpoint") or "encode_checkpoint"
+# Epoch seconds by which the encode must stop so the checkpoint upload still
+# fits in the job limit. The workflow derives it from the job's start time;
+# 0 = no deadline.
+CHECKPOINT_DEADLINE = float(os.getenv("CHECKPOINT_DEADLINE", "0") or 0)
+
+# ---------- TARGET-QUALITY CRF SEARCH ----------
+# Set TARGET_VMAF (e.g. "93") to pick the CRF per source: short samples are
+# encoded at each candidate CRF, scored with VMAF and the CRF that hits the
+# target is interpolated. Overrides USER_CRF / select_params() when set.
+TARGET_VMAF               = os.getenv("TARGET_VMAF", "")
+CRF_SEARCH_CANDIDATES     = os.getenv("CRF_SEARCH_CANDIDATES", "30,38,46,54") or "30,38,46,54"
+CRF_SEARCH_SAMPLES        = int(os.getenv("CRF_SEARCH_SAMPLES", "4") or 4)
+CRF_SEARCH_SAMPLE_SECONDS = float(os.getenv("CRF_SEARCH_SAMPLE_SECONDS", "5") or 5)
+
+# ---------- SVT-AV1 THREAD / TILE TUNING ----------
+# SVT_AUTOTUNE derives lp and tiles from the effective CPU budget (affinity
+# mask + cgroup quota) and output height instead of the fixed lp=8.
+# SVT_CALIBRATE additionally times a few seconds of encode per candidate.
+SVT_AUTOTUNE          = os.getenv("SVT_AUTOTUNE",  "true").lower() == "true"
+SVT_CALIBRATE         = os.getenv("SVT_CALIBRATE", "false").lower() == "true"
+SVT_CALIBRATE_SECONDS = float(os.getenv("SVT_CALIBRATE_SECONDS", "4") or 4)
+
+# ---------- STREAMED SOURCE ----------
+# When tg_handler.py runs with STREAM_DOWNLOAD=true the encode starts as soon
+# as this much of a streamable (MKV / faststart MP4) source is on disk.
+STREAM_MIN_MB = int(os.getenv("STREAM_MIN_MB", "32") or 32)
+# The encode gives up on a streamed download that adds no bytes for this long
+# (0 = wait forever; a dead download process is detected either way).
+STREAM_STALL_SECONDS = int(os.getenv("STREAM_STALL_SECONDS", "300") or 300)
+
+# ---------- PARALLEL AUDIO PIPELINE ----------
+# Encode every audio track to Opus in its own worker while the video encodes,
+# then mux them in. Outputs in AUDIO_CACHE_DIR are reused by later runs on
+# the same source when only video settings changed.
+AUDIO_PIPELINE  = os.getenv("AUDIO_PIPELINE", "false").lower() == "true"
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache") or "audio_cache"
+
+# ---------- CROP DETECTION ----------
+# Keyframes sampled across the timeline by the NumPy border analyzer, and the
+# share of them that must agree before a crop is applied.
+CROP_SAMPLES        = int(os.getenv("CROP_SAMPLES", "48") or 48)
+CROP_MIN_CONFIDENCE = float(os.getenv("CROP_MIN_CONFIDENCE", "0.6") or 0.6)
+
+# ---------- SEGMENT VMAF ----------
+# VMAF_MODE=segments seeks straight to VMAF_WINDOWS windows of
+# VMAF_WINDOW_SECONDS on both files and scores them in parallel processes
+# (libvmaf n_threads=VMAF_THREADS each); "select" keeps the old single pass
+# that decodes both full-length inputs.
+VMAF_MODE           = os.getenv("VMAF_MODE", "segments").strip().lower() or "segments"
+VMAF_WINDOWS        = int(os.getenv("VMAF_WINDOWS", "6") or 6)
+VMAF_WINDOW_SECONDS = float(os.getenv("VMAF_WINDOW_SECONDS", "5") or 5)
+VMAF_THREADS        = int(os.getenv("VMAF_THREADS", "2") or 2)
+
+# ---------- FRAME-LEVEL VMAF ----------
+# libvmaf per-frame JSON logs land here; metrics.py summarizes them into
+# harmonic mean, 1%/5% lows, min, per-window scores and the worst frames.
+VMAF_LOG_DIR      = os.getenv("VMAF_LOG_DIR", "vmaf_logs") or "vmaf_logs"
+VMAF_WORST_FRAMES = int(os.getenv("VMAF_WORST_FRAMES", "5") or 5)
+
+# ---------- METRIC CACHE ----------
+# get_vmaf() results keyed by fingerprints of the encoded + source files,
+# crop and window layout. The workflow restores this directory through the
+# actions cache, so re-running the finalize/upload phase skips the analysis.
+# Blank disables the cache.
+METRIC_CACHE_DIR = os.getenv("METRIC_CACHE_DIR", "metric_cache")
+
+# ---------- INLINE VMAF ----------
+# Score each chunk against its source window as soon as the chunked engine
+# finishes it, so VMAF/SSIM are ready when the encode ends instead of after a
+# second full decode. Only applies to CHUNKED_ENCODE / CHECKPOINT_ENCODE;
+# single-pass encodes fall back to the post-encode get_vmaf().
+# VMAF_N_SUBSAMPLE scores every Nth frame (libvmaf n_subsample) — used here to
+# keep the scorers light while SVT-AV1 owns the CPU, and by segment VMAF.
+INLINE_VMAF      = os.getenv("INLINE_VMAF", "false").lower() == "true"
+INLINE_VMAF_JOBS = int(os.getenv("INLINE_VMAF_JOBS", "1") or 1)
+VMAF_N_SUBSAMPLE = int(os.getenv("VMAF_N_SUBSAMPLE", "1") or 1)
+
+# ---------- CONTACT SHEET ----------
+# async_generate_grid(): GRID_FRAMES tiles picked from twice as many
+# concurrent keyframe seeks; frames darker than GRID_BLACK_LUMA or closer than
+# GRID_DUP_DIFF (mean 0–255 difference of a 16x9 signature) to a kept frame
+# are dropped. Whatever finished within GRID_TIME_BUDGET seconds is used.
+GRID_FRAMES      = int(os.getenv("GRID_FRAMES", "9") or 9)
+GRID_TILE_WIDTH  = int(os.getenv("GRID_TILE_WIDTH", "480") or 480)
+GRID_TIME_BUDGET = float(os.getenv("GRID_TIME_BUDGET", "20") or 20)
+GRID_BLACK_LUMA  = float(os.getenv("GRID_BLACK_LUMA", "20") or 20)
+GRID_DUP_DIFF    = float(os.getenv("GRID_DUP_DIFF", "6") or 6)
+
+# ---------- CLOUD UPLOAD ----------
+# Gofile / Litterbox uploads stream the file through one pooled aiohttp
+# session in CLOUD_CHUNK_MB reads. The URLs can point at a local stand-in
+# for testing; {server} is filled with the Gofile server name, and the direct
+# link template also gets the file's {id} and URL-encoded {name}.
+CLOUD_CHUNK_MB        = float(os.getenv("CLOUD_CHUNK_MB", "4") or 4)
+CLOUD_CONNECT_TIMEOUT = float(os.getenv("CLOUD_CONNECT_TIMEOUT", "30") or 30)
+CLOUD_READ_TIMEOUT    = float(os.getenv("CLOUD_READ_TIMEOUT", "600") or 600)
+GOFILE_API_URL        = os.getenv("GOFILE_API_URL", "https://api.gofile.io") or "https://api.gofile.io"
+GOFILE_UPLOAD_URL     = os.getenv("GOFILE_UPLOAD_URL", "https://{server}.gofile.io/contents/uploadfile") or "https://{server}.gofile.io/contents/uploadfile"
+GOFILE_DIRECT_URL     = os.getenv("GOFILE_DIRECT_URL", "https://{server}.gofile.io/download/web/{id}/{name}") or "https://{server}.gofile.io/download/web/{id}/{name}"
+LITTERBOX_URL         = os.getenv("LITTERBOX_URL", "https://litterbox.catbox.moe/resources/internals/api.php") or "https://litterbox.catbox.moe/resources/internals/api.php"
+
+# ---------- PROBE CACHE ----------
+# probe.py memoizes ffprobe results in memory; set a directory here to also
+# persist them on disk across phases / re-runs. Blank = memory only.
+PROBE_CACHE_DIR = os.getenv("PROBE_CACHE_DIR", "")
+
+# ---------- TELEGRAM UPLOAD ----------
+# tg_upload.py pushes document parts over several media sessions at once.
+# In-flight parts per session ramp from 2 up to TG_UPLOAD_MAX_INFLIGHT while
+# throughput improves. Files below TG_FAST_UPLOAD_MIN_MB use send_document.
+TG_UPLOAD_CONNECTIONS  = int(os.getenv("TG_UPLOAD_CONNECTIONS", "4") or 4)
+TG_UPLOAD_MAX_INFLIGHT = int(os.getenv("TG_UPLOAD_MAX_INFLIGHT", "4") or 4)
+TG_FAST_UPLOAD_MIN_MB  = float(os.getenv("TG_FAST_UPLOAD_MIN_MB", "10") or 10)
+
+# Outputs over Telegram's 2 GB cap are split with mkvmerge into parts of at
+# most TG_SPLIT_MB and sent as one album (0 = cloud link only, old behaviour).
+# TG_SPLIT_PARALLEL parts upload at once.
+TG_SPLIT_MB       = int(os.getenv("TG_SPLIT_MB") or "1950")
+TG_SPLIT_PARALLEL = int(os.getenv("TG_SPLIT_PARALLEL", "2") or 2)
+
+# ---------- TELEGRAM SCHEDULER ----------
+# tg_scheduler.py paces every API call per chat with a token bucket:
+# TG_SCHED_RATE calls/second on average, bursts of up to TG_SCHED_BURST.
+TG_SCHED_RATE  = float(os.getenv("TG_SCHED_RATE", "0.5") or 0.5)
+TG_SCHED_BURST = int(os.getenv("TG_SCHED_BURST", "3") or 3)
+
+# ---------- TELEGRAM CONNECT ----------
+# tg_connect.py starts this many candidate sessions at once and keeps the
+# first to authenticate. Per-session health (FloodWait expiry, auth latency)
+# persists in tg_session_dir/session_health.json.
+TG_CONNECT_RACE = int(os.getenv("TG_CONNECT_RACE", "3") or 3)
+
+# ---------- TELEGRAM GATEWAY ----------
+# When tg_gateway.py is serving on this socket, tg_handler.py, main.py,
+# upload.py and tg_rename.py reuse its client instead of connecting again.
+TG_GATEWAY_SOCKET = os.getenv("TG_GATEWAY_SOCKET", "tg_gateway.sock")
+# Off: upload.py posts no status message of its own (batch.py keeps one
+# board for the whole season instead)
+TG_STATUS_MESSAGE = os.getenv("TG_STATUS_MESSAGE", "true").lower() == "true"
+
+# ---------- TRACING ----------
+# Every phase appends its timing spans (tracing.py) to this Chrome
+# trace-event file; open it in chrome://tracing or Perfetto. Blank = off
+# (the phase summary in the report still works within one process).
+TRACE_FILE = os.getenv("TRACE_FILE", "trace.json")
+
+# ---------- SEASON BATCH ----------
+# batch.py pipelines a list of episodes: one downloads while the previous
+# encodes and the one before that gets VMAF + upload. Each stage runs at
+# most this many episodes at once; BATCH_DIR holds one workdir per episode.
+# ENCODE_ONLY makes main.py stop after writing encode_results.json and
+# output_fname.txt — no Telegram, delivery is left to upload.py.
+BATCH_DOWNLOADS = int(os.getenv("BATCH_DOWNLOADS", "1") or 1)
+BATCH_ENCODES   = int(os.getenv("BATCH_ENCODES",   "1") or 1)
+BATCH_UPLOADS   = int(os.getenv("BATCH_UPLOADS",   "1") or 1)
+BATCH_DIR       = os.getenv("BATCH_DIR", "batch_work")
+ENCODE_ONLY     = os.getenv("ENCODE_ONLY", "false").lower() == "true"
+
+# ---------- LOCAL WORKER ----------
+# worker.py runs queued jobs (WORKER_DB) side by side on one machine, each in
+# its own directory under WORKER_DIR and pinned to its share of the cores:
+# WORKER_SLOTS concurrent jobs split the daemon's CPU affinity evenly.
+# Shortest estimated job first; WORKER_AGING seconds of estimate are forgiven
+# per second a job has waited, so long jobs still get their turn.
+WORKER_DB          = os.getenv("WORKER_DB", "worker_queue.db")
+WORKER_DIR         = os.getenv("WORKER_DIR", "worker_jobs")
+WORKER_SLOTS       = int(os.getenv("WORKER_SLOTS", "2") or 2)
+WORKER_AGING       = float(os.getenv("WORKER_AGING", "1.0") or 1.0)
+WORKER_DEFAULT_EST = float(os.getenv("WORKER_DEFAULT_EST", "1440") or 1440)   # unprobeable sources (seconds)
+WORKER_STATUS      = os.getenv("WORKER_STATUS", "worker_status.json")
+
 # ---------- GLOBAL STATE ----------
 CANCELLED = False
@@ -0,0 +1,146 @@
+"""
+crf_search.py — Target-VMAF automatic CRF selection
+Encodes a handful of short, evenly spread samples at several candidate CRFs
+in parallel, scores each with the same VMAF graph get_vmaf() uses, and
+interpolates the CRF that lands on TARGET_VMAF. Sample bitrates give a size
+prediction for the full encode.
+
+Replaces the fixed height → CRF table in media.select_params() when
+TARGET_VMAF is set: easy episodes get a higher CRF, grainy ones a lower one.
+"""
+import asyncio
+import math
+import os
+import shutil
+
+import config
+from media import measure_vmaf, vmaf_reference_dims
+from svt_tune import effective_cpus
+
+PROBE_DIR = "crf_probe"
+CRF_MIN, CRF_MAX = 1, 63
+
+
+def sample_windows(start: float, duration: float, count: int, length: float) -> list[tuple[float, float]]:
+    """*count* windows of *length* seconds centred in equal slices of the range."""
+    length = min(length, duration / max(count, 1))
+    step   = duration / count
+    return [(start + step * (i + 0.5) - length / 2, length) for i in range(count)]
+
+
+def interpolate_crf(points: list[dict], target: float) -> float:
+    """
+    Linear interpolation on the (crf, vmaf) curve; VMAF falls as CRF rises.
+    Targets outside the probed range extrapolate from the nearest segment,
+    clamped to the SVT-AV1 CRF range.
+    """
+    pts = sorted(points, key=lambda p: p["crf"])
+    if len(pts) == 1:
+        return pts[0]["crf"]
+
+    lo, hi = pts[0], pts[1]
+    for a, b in zip(pts, pts[1:]):
+        lo, hi = a, b
+        if b["vmaf"] <= target:
+            break
+    if lo["vmaf"] == hi["vmaf"]:
+        return lo["crf"]
+    crf = lo["crf"] + (lo["vmaf"] - target) * (hi["crf"] - lo["crf"]) / (lo["vmaf"] - hi["vmaf"])
+    return max(CRF_MIN, min(CRF_MAX, crf))
+
+
+def predict_kbps(points: list[dict], crf: float) -> float:
+    """Bitrate is close to exponential in CRF — interpolate log(kbps)."""
+    pts = sorted(points, key=lambda p: p["crf"])
+    lo, hi = pts[0], pts[-1]
+    for a, b in zip(pts, pts[1:]):
+        if a["crf"] <= crf <= b["crf"]:
+            lo, hi = a, b
+            break
+    if hi["crf"] == lo["crf"] or lo["kbps"] <= 0 or hi["kbps"] <= 0:
+        return lo["kbps"]
+    t = (crf - lo["crf"]) / (hi["crf"] - lo["crf"])
+    return math.exp(math.log(lo["kbps"]) + t * (math.log(hi["kbps"]) - math.log(lo["kbps"])))
+
+
+async def search_crf(
+    source:      str,
+    start:       float,
+    duration:    float,
+    video_args:  list[str],
+    svt_params:  str,
+    crop_val,
+    width:       int,
+    height:      int,
+    target:      float,
+) -> dict | None:
+    """
+    Run the probe and return:
+        {
+            "target":       93.0,
+            "crf":          38,
+            "predicted_mb": 412.7,
+            "probes":       [{"crf": 30, "vmaf": 95.4, "kbps": 1840.2}, ...]
+        }
+    video_args must not contain -crf; it is appended per candidate.
+    Returns None when no candidate could be scored.
+    """
+    candidates = [int(c) for c in config.CRF_SEARCH_CANDIDATES.split(",") if c.strip()]
+    windows    = sample_windows(start, duration, config.CRF_SEARCH_SAMPLES, config.CRF_SEARCH_SAMPLE_SECONDS)
+    ref_w, ref_h = vmaf_reference_dims(crop_val, width, height)
+    workers    = max(1, effective_cpus() // 2)
+    semaphore  = asyncio.Semaphore(workers)
+    os.makedirs(PROBE_DIR, exist_ok=True)
+
+    async def _probe(w_idx: int, ts: float, length: float, crf: int) -> dict | None:
+        out = os.path.join(PROBE_DIR, f"s{w_idx}_crf{crf}.mkv")
+        seek = ["-ss", f"{ts:.3f}", "-t", f"{length:.3f}"]
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", *seek, "-i", source,
+                "-map", "0:v:0", *video_args, "-crf", str(crf),
+                "-svtav1-params", svt_params,
+                "-an", "-sn", "-dn", "-nostats", "-y", out,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            await proc.wait()
+            if proc.returncode != 0 or not os.path.exists(out):
+                return None
+            vmaf, _ = await measure_vmaf(out, source, crop_val, ref_w, ref_h, ref_seek_args=seek, threads=2)
+        try:
+            return {"crf": crf, "vmaf": float(vmaf), "kbps": os.path.getsize(out) * 8 / 1000 / length}
+        except ValueError:
+            return None
+
+    results = await asyncio.gather(*(
+        _probe(w_idx, ts, length, crf)
+        for w_idx, (ts, length) in enumerate(windows)
+        for crf in candidates
+    ))
+    shutil.rmtree(PROBE_DIR, ignore_errors=True)
+
+    # Average every candidate across the samples that scored
+    probes = []
+    for crf in candidates:
+        scored = [r for r in results if r and r["crf"] == crf]
+        if not scored:
+            continue
+        probes.append({
+            "crf":  crf,
+            "vmaf": round(sum(r["vmaf"] for r in scored) / len(scored), 2),
+            "kbps": round(sum(r["kbps"] for r in scored) / len(scored), 1),
+        })
+    if not probes:
+        print("[crf-search] No candidate could be scored — keeping default CRF.")
+        return None
+
+    crf       = interpolate_crf(probes, target)
+    chosen    = int(round(crf))
+    predicted = predict_kbps(probes, chosen) * 1000 / 8 * duration / (1024 * 1024)
+    print(
+        f"[crf-search] Target VMAF {target} → CRF {chosen} (interp {crf:.2f}) | "
+        f"predicted {predicted:.1f} MB | "
+        + " ".join(f"crf{p['crf']}={p['vmaf']}" for p in probes)
+    )
+    return {"target": target, "crf": chosen, "predicted_mb": round(predicted, 1), "probes": probes}
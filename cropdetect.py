@@ -0,0 +1,122 @@
+"""
+cropdetect.py — NumPy black-border analyzer
+One ffmpeg process decodes keyframes only, picks one roughly every
+span/samples seconds and pipes them as half-resolution 8-bit luma. NumPy then
+finds the content extents of every frame in a single vectorised pass and
+takes a robust consensus across the batch.
+
+Compared with media.get_crop_params' legacy path (four sequential cropdetect
+runs, 20 frames each, majority vote on stderr strings) this samples the
+whole timeline and returns a confidence alongside the crop.
+See bench_crop.py for a side-by-side timing.
+"""
+import subprocess
+
+import numpy as np
+
+import probe
+
+# Luma above this (8-bit) counts as picture, same limit cropdetect used
+LUMA_LIMIT      = 24
+# A row/column is picture when more than this share of its pixels is bright
+CONTENT_SHARE   = 0.01
+# Edges within this many full-res pixels of the consensus count as agreeing
+AGREE_TOLERANCE = 4
+SCALE           = 2
+
+
+def _probe_dims(source: str) -> tuple[int, int]:
+    stream = probe.video_stream(source)
+    return int(stream["width"]), int(stream["height"])
+
+
+def decode_luma_frames(source: str, width: int, height: int, span: float,
+                       samples: int, timeout: int = 180) -> np.ndarray:
+    """
+    Return an (n, h/2, w/2) uint8 array of luma planes from keyframes spread
+    across [5% .. span]. Keyframe-only decoding keeps this to a few hundred
+    decoded frames even on long sources.
+    """
+    w, h     = (width // SCALE) & ~1, (height // SCALE) & ~1
+    start    = span * 0.05
+    interval = max(1.0, (span - start) / samples)
+    vf = (
+        f"select='gte(t,{start:.3f})*(isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f}))',"
+        f"scale={w}:{h}:flags=area,format=gray"
+    )
+    cmd = [
+        "ffmpeg", "-v", "error", "-skip_frame", "nokey",
+        "-t", f"{span:.3f}", "-i", source,
+        "-map", "0:v:0", "-vf", vf, "-fps_mode", "passthrough",
+        "-frames:v", str(samples),
+        "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1",
+    ]
+    raw    = subprocess.run(cmd, capture_output=True, timeout=timeout).stdout
+    frames = np.frombuffer(raw, dtype=np.uint8)
+    count  = frames.size // (w * h)
+    return frames[:count * w * h].reshape(count, h, w)
+
+
+def border_extents(frames: np.ndarray) -> np.ndarray:
+    """
+    Per-frame (top, bottom, left, right) border thickness, in the frames'
+    own pixels, as an (n, 4) array. All-black frames (fades, title cards)
+    come back as -1 rows so they can be dropped.
+    """
+    bright = frames > LUMA_LIMIT
+    rows   = bright.mean(axis=2) > CONTENT_SHARE        # (n, h)
+    cols   = bright.mean(axis=1) > CONTENT_SHARE        # (n, w)
+    n, h, w = frames.shape
+
+    has_rows = rows.any(axis=1)
+    has_cols = cols.any(axis=1)
+    top      = rows.argmax(axis=1)
+    bottom   = rows[:, ::-1].argmax(axis=1)
+    left     = cols.argmax(axis=1)
+    right    = cols[:, ::-1].argmax(axis=1)
+
+    ext = np.stack([top, bottom, left, right], axis=1)
+    ext[~(has_rows & has_cols)] = -1
+    return ext
+
+
+def consensus_crop(ext: np.ndarray, width: int, height: int) -> tuple[str | None, float]:
+    """
+    Robust crop from per-frame extents: the 10th percentile of each border
+    (dark scenes over-report borders, so the low end is the true bar; the
+    percentile shrugs off the odd bright artefact inside a bar).
+    Confidence = share of frames whose every edge sits within
+    AGREE_TOLERANCE of the consensus.
+    """
+    valid = ext[(ext >= 0).all(axis=1)]
+    if len(valid) == 0:
+        return None, 0.0
+
+    edges = np.percentile(valid, 10, axis=0).astype(int) * SCALE
+    top, bottom, left, right = (int(e) & ~1 for e in edges)   # round=2, like cropdetect
+
+    agree      = (np.abs(valid * SCALE - edges) <= AGREE_TOLERANCE).all(axis=1)
+    confidence = float(agree.mean())
+
+    if top == bottom == left == right == 0:
+        return None, confidence
+    crop_w = width - left - right
+    crop_h = height - top - bottom
+    if crop_w <= 0 or crop_h <= 0:
+        return None, 0.0
+    return f"{crop_w}:{crop_h}:{left}:{top}", confidence
+
+
+def analyze_crop(source: str, duration: float, samples: int = 48,
+                 max_ts: float | None = None) -> tuple[str | None, float, int]:
+    """
+    Returns (crop, confidence, frames_used). crop is an ffmpeg crop=
+    argument ("w:h:x:y") or None when no border was found.
+    """
+    span = duration if max_ts is None else min(duration, max_ts)
+    width, height = _probe_dims(source)
+    frames = decode_luma_frames(source, width, height, span, samples)
+    if len(frames) == 0:
+        return None, 0.0, 0
+    crop, confidence = consensus_crop(border_extents(frames), width, height)
+    return crop, confidence, len(frames)
@@ -0,0 +1,83 @@
+"""
+inline_vmaf.py — Quality metrics computed while the chunked encode runs
+Every chunk the chunked engine finishes is scored straight away against the
+matching window of the source (input-side -ss/-t, same VMAF + SSIM graph as
+get_vmaf). Scores are pooled weighted by frame count, so by the time the
+last chunk lands the whole-file VMAF/SSIM is one short scoring run away
+instead of a second full decode of both files.
+
+    scorer = new_scorer(config.SOURCE, crop_val, width, height, fps_val)
+    ... encode_chunks(..., on_chunk_done=lambda i: submit(scorer, i, path, s, e))
+    vmaf, ssim, summary = await finish(scorer, len(chunks))
+"""
+import asyncio
+
+import config
+import metrics
+from media import measure_vmaf, pool_scores, vmaf_reference_dims
+
+
+def new_scorer(source: str, crop_val, width: int, height: int, fps: float,
+               offset: float = 0.0, jobs: int | None = None) -> dict:
+    """offset: source time of the encode's first frame (demo slices)."""
+    ref_w, ref_h = vmaf_reference_dims(crop_val, width, height)
+    opts = f"n_subsample={config.VMAF_N_SUBSAMPLE}" if config.VMAF_N_SUBSAMPLE > 1 else ""
+    return {
+        "source":    source,
+        "crop":      crop_val,
+        "ref_dims":  (ref_w, ref_h),
+        "fps":       fps,
+        "offset":    offset,
+        "vmaf_opts": opts,
+        "semaphore": asyncio.Semaphore(max(1, jobs or config.INLINE_VMAF_JOBS)),
+        "tasks":     {},     # chunk idx → asyncio.Task
+        "scores":    {},     # chunk idx → {"frames", "vmaf", "ssim"}
+    }
+
+
+async def _score(scorer: dict, idx: int, chunk_file: str, start: float, end: float):
+    ref_w, ref_h = scorer["ref_dims"]
+    log_file     = metrics.log_path(f"c{idx:04d}")
+    vmaf_opts    = ":".join(filter(None, [scorer["vmaf_opts"], f"log_fmt=json:log_path={log_file}"]))
+    async with scorer["semaphore"]:
+        vmaf, ssim = await measure_vmaf(
+            chunk_file, scorer["source"], scorer["crop"], ref_w, ref_h,
+            ref_seek_args=["-ss", f"{start:.6f}", "-t", f"{end - start:.6f}"],
+            threads=2, vmaf_opts=vmaf_opts,
+        )
+    try:
+        scorer["scores"][idx] = {
+            "frames": max(1, round((end - start) * scorer["fps"])),
+            "vmaf":   float(vmaf),
+            "ssim":   float(ssim) if ssim != "N/A" else None,
+            "window": {
+                "start":    start - scorer["offset"],
+                "duration": end - start,
+                "frames":   metrics.window_frames(log_file, start - scorer["offset"], scorer["fps"]),
+            },
+        }
+        print(f"[inline-vmaf] chunk {idx:04d} VMAF {float(vmaf):.2f}")
+    except ValueError:
+        print(f"[inline-vmaf] chunk {idx:04d} could not be scored")
+
+
+def submit(scorer: dict, idx: int, chunk_file: str, start: float, end: float):
+    """Queue a finished chunk for scoring. Safe to call from a sync callback."""
+    if idx not in scorer["tasks"]:
+        scorer["tasks"][idx] = asyncio.create_task(_score(scorer, idx, chunk_file, start, end))
+
+
+async def finish(scorer: dict, expected: int) -> tuple[str, str, dict | None] | None:
+    """
+    Wait for outstanding chunk scores. Returns (vmaf, ssim, summary) like
+    get_vmaf(), or None when some of the *expected* chunks were never
+    scored — the caller then falls back to the post-encode get_vmaf().
+    """
+    if scorer["tasks"]:
+        await asyncio.gather(*scorer["tasks"].values(), return_exceptions=True)
+    if len(scorer["scores"]) < expected:
+        print(f"[inline-vmaf] {len(scorer['scores'])}/{expected} chunks scored — falling back to full pass.")
+        return None
+    scores  = [scorer["scores"][i] for i in sorted(scorer["scores"])]
+    summary = metrics.summarize([s["window"] for s in scores])
+    return (*pool_scores(scores), summary)
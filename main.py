@@ -1,18 +1,31 @@
 import asyncio
+import json
 import os
 import subprocess
 import time
 import shutil
 import psutil
-from pyrogram import Client, enums
-from pyrogram.errors import FloodWait
+from pyrogram import enums
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 import config
-from media import get_video_info, get_crop_params, select_params, async_generate_thumbnail, get_vmaf, upload_to_cloud
+from media import get_video_info, get_crop_params, select_params, async_generate_grid, get_vmaf, upload_to_cloud, close_http_session, file_fingerprint, split_for_telegram
 from rename import lang_code_to_name
-from ui import get_encode_ui, format_time, upload_progress, get_failure_ui, get_cancelled_ui, get_vmaf_ui
-from rename import resolve_output_name, format_track_report
+from chunked import probe_keyframes, plan_chunks, resolve_workers, encode_chunks, concat_and_mux, cleanup_chunks, CHUNK_DIR
+import checkpoint
+import inline_vmaf
+import metrics
+import tg_scheduler
+import tg_connect
+import tracing
+import tg_gateway
+import stream_source
+from tg_upload import send_document_fast, send_document_group
+from audio import encode_audio_tracks, mux_audio
+from ui import get_encode_ui, format_time, upload_progress, get_failure_ui, get_cancelled_ui, get_vmaf_ui, get_crf_search_report, get_vmaf_report, with_phase_report
+from crf_search import search_crf
+from svt_tune import autotune, effective_cpus, heuristic_config, params_string, tune_label
+from rename import resolve_output_name, format_track_report, detect_quality
 
 
 # ---------------------------------------------------------------------------
@@ -66,85 +79,24 @@ def _resolve_session_names() -> list[str]:
 
 async def connect_telegram(tg_state: dict, tg_ready: asyncio.Event, label: str):
     """
-    Connect to Telegram trying each session in priority order.
-    If a session gets a FloodWait we skip to the next one immediately —
-    the flooded session is noted so it won't be retried.
-    Falls back to sleeping out the shortest FloodWait only if every session
-    is flooded.
+    Connect to Telegram through a running tg_gateway.py, else by racing the
+    candidate sessions (tg_connect.py), and post the status message.
+    Sessions known to be flooded from earlier runs are skipped; if every
+    session is flooded the shortest wait is slept out.
     tg_state keys set on success: 'app', 'status'
     """
-    session_names = _resolve_session_names()
-    flood_waits: dict[str, int] = {}   # session_name → seconds to wait
-
-    app = None
-    for session_name in session_names:
-        try:
-            candidate = Client(
-                session_name,
-                api_id=config.API_ID,
-                api_hash=config.API_HASH,
-                bot_token=config.BOT_TOKEN,
-            )
-            await candidate.start()
-            app = candidate
-            print(f"TG auth OK with session: {session_name}")
-            break
-        except FloodWait as e:
-            flood_waits[session_name] = e.value
-            print(f"FloodWait {e.value}s on session '{session_name}' — trying next session...")
-            continue
-        except Exception as e:
-            print(f"TG auth error on session '{session_name}': {e} — trying next session...")
-            continue
-
-    # All sessions flooded — sleep out the shortest wait then keep retrying
-    # with the same sleep-and-retry loop until auth succeeds (original fallback
-    # behaviour: Telegram tells us exactly how long to wait, so we always obey).
-    if app is None and flood_waits:
-        best_session = min(flood_waits, key=flood_waits.get)
-        wait_secs    = flood_waits[best_session]
-        attempt = 0
-        while True:
-            attempt += 1
-            print(f"All sessions flooded. Sleeping {wait_secs}s for '{best_session}' (attempt {attempt})...")
-            await asyncio.sleep(wait_secs + 5)
-            try:
-                candidate = Client(
-                    best_session,
-                    api_id=config.API_ID,
-                    api_hash=config.API_HASH,
-                    bot_token=config.BOT_TOKEN,
-                )
-                await candidate.start()
-                app = candidate
-                print(f"TG auth OK (post-flood attempt {attempt}) with session: {best_session}")
-                break
-            except FloodWait as e:
-                # Telegram issued a fresh FloodWait — obey it and loop again
-                wait_secs = e.value
-                print(f"Another FloodWait: {wait_secs}s — will keep waiting...")
-                continue
-            except Exception as e:
-                print(f"TG auth failed on post-flood attempt {attempt}: {e}")
-                return
-
+    started = time.time()
+    # A running tg_gateway.py already holds an authenticated client
+    async with tracing.span("tg_connect") as sp:
+        app = await tg_gateway.connect_client()
+        sp.set(via="gateway" if app else "direct")
+        if app is None:
+            app, _ = await tg_connect.connect(_resolve_session_names())
     if app is None:
         print("TG auth failed: no usable session found.")
         return
 
-    try:
-        status = await app.send_message(
-            config.CHAT_ID,
-            f"<b>[ SYSTEM ONLINE ] Encoding: {label}</b>",
-            parse_mode=enums.ParseMode.HTML,
-        )
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        status = await app.send_message(
-            config.CHAT_ID,
-            f"<b>[ SYSTEM ONLINE ] Encoding: {label}</b>",
-            parse_mode=enums.ParseMode.HTML,
-        )
+    status = await tg_connect.send_status(app, f"<b>[ SYSTEM ONLINE ] Encoding: {label}</b>", started)
 
     tg_state["app"] = app
     tg_state["status"] = status
@@ -162,17 +114,39 @@ async def tg_edit(tg_state: dict, tg_ready: asyncio.Event, text: str, reply_mark
     status = tg_state.get("status")
     if not app or not status:
         return
-    try:
-        kwargs = dict(parse_mode=enums.ParseMode.HTML)
-        if reply_markup:
-            kwargs["reply_markup"] = reply_markup
-        await app.edit_message_text(config.CHAT_ID, status.id, text, **kwargs)
-    except FloodWait as e:
-        await asyncio.sleep(e.value + 1)
-    except Exception:
-        pass
+    # Queued and coalesced per message — never blocks the caller on FloodWait
+    await tg_scheduler.edit_text(app, config.CHAT_ID, status.id, text, reply_markup=reply_markup)
 
 
+# ---------------------------------------------------------------------------
+# CAPTION EDIT — fills in the report + buttons on an already-sent document
+# ---------------------------------------------------------------------------
+async def tg_edit_caption(app, message, caption: str, reply_markup=None):
+    try:
+        await tg_scheduler.submit(
+            config.CHAT_ID,
+            lambda: app.edit_message_caption(
+                config.CHAT_ID, message.id, caption,
+                parse_mode=enums.ParseMode.HTML, reply_markup=reply_markup,
+            ),
+            priority=tg_scheduler.PRIORITY_CRITICAL, key=("caption", config.CHAT_ID, message.id), wait=True,
+        )
+    except Exception as e:
+        # Don't leave the placeholder caption as the only result — post the
+        # report and links as a reply instead
+        print(f"[TG] Could not edit caption ({e}) — sending the report as a reply")
+        try:
+            await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.send_message(
+                    config.CHAT_ID, caption, parse_mode=enums.ParseMode.HTML,
+                    reply_markup=reply_markup, reply_to_message_id=message.id,
+                ),
+                priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+            )
+        except Exception as e:
+            print(f"[TG] Could not send the report: {e}")
+
 
 # ---------------------------------------------------------------------------
 # FAILURE NOTIFIER — sends failure message + log to TG (best-effort)
@@ -183,30 +157,60 @@ async def tg_notify_failure(tg_state: dict, tg_ready: asyncio.Event,
     Edit the status message to show the failure UI and, if a log file exists,
     attach it as a document.  Safe to call even if TG never fully connected.
     """
+    # Phase timings so far go to the console and the end of the log
+    table = tracing.format_table()
+    if table:
+        print(f"[trace] Phase timings:\n{table}")
+        if os.path.exists(config.LOG_FILE):
+            with open(config.LOG_FILE, "a") as f:
+                f.write(f"\n\n=== PHASE TIMINGS ===\n{table}\n")
     app    = tg_state.get("app")
     status = tg_state.get("status")
     if not app or not status:
         print(f"[TG-FAIL] TG unavailable — failure reason: {reason}")
         return
-    try:
-        await app.edit_message_text(
-            config.CHAT_ID, status.id,
-            get_failure_ui(file_name, reason),
-            parse_mode=enums.ParseMode.HTML,
-        )
-    except Exception as e:
-        print(f"[TG-FAIL] Could not edit status message: {e}")
+    await tg_scheduler.edit_text(
+        app, config.CHAT_ID, status.id,
+        get_failure_ui(file_name, reason),
+        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+    )
     if os.path.exists(config.LOG_FILE):
         try:
-            await app.send_document(
-                config.CHAT_ID, config.LOG_FILE,
-                caption="<b>FULL MISSION LOG</b>",
-                parse_mode=enums.ParseMode.HTML,
+            await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.send_document(
+                    config.CHAT_ID, config.LOG_FILE,
+                    caption="<b>FULL MISSION LOG</b>",
+                    parse_mode=enums.ParseMode.HTML,
+                ),
+                priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
             )
         except Exception as e:
             print(f"[TG-FAIL] Could not send log document: {e}")
 
 
+# ---------------------------------------------------------------------------
+# ENCODE RESULTS — the fields upload.py (phase 3) reads, plus the quality
+# summary, so tooling can query a run without parsing the TG report.
+# ---------------------------------------------------------------------------
+RESULTS_FILE = "encode_results.json"
+
+def write_encode_results(results: dict):
+    tmp = RESULTS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, RESULTS_FILE)
+
+
+PROGRESS_FILE = "encode_progress.json"
+
+def write_progress(progress: dict):
+    tmp = PROGRESS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp, PROGRESS_FILE)
+
+
 # ---------------------------------------------------------------------------
 # RESOURCE MONITOR — logs CPU + RAM every 5s during encoding
 # ---------------------------------------------------------------------------
@@ -241,10 +245,30 @@ async def main():
             print(f"DISK WARNING: {source_size/(1024**3):.2f}GB source might exceed {free/(1024**3):.2f}GB free space.")
 
     # 2. METADATA EXTRACTION
+    # A streamed Telegram download (tg_handler STREAM_DOWNLOAD) may still be
+    # running: wait for the header + first clusters, or for the whole file
+    # when a mode needs random access (chunks, CRF samples, calibration).
+    streaming = stream_source.is_streaming(config.SOURCE)
+    probe_span = tracing.start("probe", streaming=streaming)
     try:
+        if streaming:
+            needs_full = (config.CHUNKED_ENCODE or config.CHECKPOINT_ENCODE or config.AUDIO_PIPELINE
+                          or bool(config.TARGET_VMAF.strip()) or config.SVT_CALIBRATE)
+            if needs_full:
+                print("[stream] Mode needs random access — waiting for the full download.")
+                state = await stream_source.wait_until_done(config.SOURCE)
+            else:
+                state = await stream_source.wait_until_ready(config.SOURCE, config.STREAM_MIN_MB * 1024 * 1024)
+            streaming = not state.get("done")
+            if streaming:
+                print(f"[stream] Starting encode with {state['written']/(1024**2):.0f} MB on disk.")
         duration, width, height, is_hdr, total_frames, channels, fps_val = get_video_info()
+        probe_span.end(duration=duration, frames=total_frames, height=height)
     except Exception as e:
+        probe_span.end(error=str(e)[:200])
         print(f"Metadata error: {e}")
+        if config.ENCODE_ONLY:
+            raise SystemExit(1)
         # TG not up yet — spin up a minimal client just to fire the alert
         _tg_s: dict = {}
         _tg_r = asyncio.Event()
@@ -256,6 +280,19 @@ async def main():
             await _a.stop()
         return
 
+    # -- RENDITION LADDER --
+    # USER_RES may list several target heights ("1080,720,480"). All of them
+    # come out of one decode + denoise + crop through a split filter graph,
+    # one libsvtav1 output per height.
+    ladder = sorted({int(r) for r in (config.USER_RES or "").split(",") if r.strip().isdigit()}, reverse=True)
+    if len(ladder) < 2:
+        ladder = []
+    if ladder and config.ENCODE_ONLY:
+        # upload.py delivers one file per episode
+        print(f"[ladder] ENCODE_ONLY encodes a single rendition — using {ladder[0]}p")
+        config.USER_RES = str(ladder[0])
+        ladder = []
+
     # 3. RENAME — build structured output filename if ANIME_NAME is set.
     # If ANIME_NAME is blank, attempt to auto-parse it from the source URL's
     # filename= query param (or path) using anitopy as a fallback.
@@ -298,17 +335,21 @@ async def main():
                     config.EPISODE = str(parsed["episode"])
 
     if anime_name:
-        rename_height = int(config.USER_RES) if (config.USER_RES and config.USER_RES.strip().isdigit()) else height
-        resolved_name, audio_type_label, audio_tracks, sub_tracks = resolve_output_name(
-            source               = config.SOURCE,
-            anime_name           = anime_name,
-            season               = config.SEASON,
-            episode              = config.EPISODE,
-            height               = rename_height,
-            audio_type_override  = config.AUDIO_TYPE,
-            content_type         = config.CONTENT_TYPE,
-            is_special           = is_special,
-        )
+        if ladder:
+            rename_height = ladder[0]
+        else:
+            rename_height = int(config.USER_RES) if (config.USER_RES and config.USER_RES.strip().isdigit()) else height
+        with tracing.span("rename"):
+            resolved_name, audio_type_label, audio_tracks, sub_tracks = resolve_output_name(
+                source               = config.SOURCE,
+                anime_name           = anime_name,
+                season               = config.SEASON,
+                episode              = config.EPISODE,
+                height               = rename_height,
+                audio_type_override  = config.AUDIO_TYPE,
+                content_type         = config.CONTENT_TYPE,
+                is_special           = is_special,
+            )
         config.FILE_NAME = resolved_name
         print(f"[rename] Output → {resolved_name}  |  Audio: {audio_type_label}")
     else:
@@ -322,19 +363,62 @@ async def main():
     final_crf    = config.USER_CRF if (config.USER_CRF and config.USER_CRF.strip()) else def_crf
     final_preset = config.USER_PRESET if (config.USER_PRESET and config.USER_PRESET.strip()) else def_preset
 
-    res_label = config.USER_RES if (config.USER_RES and config.USER_RES.strip()) else None
-    crop_val  = get_crop_params(duration)
+    res_label = config.USER_RES if (config.USER_RES and config.USER_RES.strip() and not ladder) else None
+    # While streaming, only sample the part of the timeline already on disk
+    crop_max_ts = duration * stream_source.available_fraction(config.SOURCE) * 0.9 if streaming else None
+    with tracing.span("crop") as sp:
+        crop_val = get_crop_params(duration, max_ts=crop_max_ts)
+        sp.set(crop=crop_val)
 
     # -- VIDEO FILTERS --
     vf_filters = ["hqdn3d=1.5:1.2:3:3"]
     if crop_val: vf_filters.append(f"crop={crop_val}")
     if res_label: vf_filters.append(f"scale=-1:{res_label}")  # skip when ORIGINAL
-    video_filters = ["-vf", ",".join(vf_filters)]
+    video_filters = ["-vf", ",".join(vf_filters)] if not ladder else []
 
     # Display label — show actual source height when no downscale requested
-    from rename import detect_quality
     res_label = res_label or f"Original({detect_quality(height)})"
 
+    # -- RENDITIONS --
+    # One entry per output file. A plain run is a ladder of one.
+    # Ladder rungs above the (cropped) source height are dropped — no upscaling.
+    # CRF/preset come from select_params() per height; USER_CRF only applies
+    # to a ladder when it lists one value per rung ("30,34,38").
+    renditions = [{
+        "file": config.FILE_NAME, "height": int(res_label) if res_label.isdigit() else height,
+        "crf": final_crf, "preset": final_preset, "res_label": res_label,
+    }]
+    if ladder:
+        source_h = int(crop_val.split(":")[1]) if crop_val else height
+        dropped  = [h for h in ladder if h > source_h]
+        ladder   = [h for h in ladder if h <= source_h] or [source_h]
+        if dropped:
+            print(f"[ladder] Skipping {', '.join(f'{h}p' for h in dropped)} — source is {source_h}p")
+        user_crfs = [c.strip() for c in (config.USER_CRF or "").split(",") if c.strip()]
+        renditions = []
+        for i, h in enumerate(ladder):
+            r_crf, r_preset = select_params(h)
+            if len(user_crfs) == len(ladder):
+                r_crf = user_crfs[i]
+            if config.USER_PRESET and config.USER_PRESET.strip():
+                r_preset = config.USER_PRESET.strip()
+            if anime_name:
+                r_file = resolve_output_name(
+                    source=config.SOURCE, anime_name=anime_name, season=config.SEASON,
+                    episode=config.EPISODE, height=h, audio_type_override=config.AUDIO_TYPE,
+                    content_type=config.CONTENT_TYPE, is_special=is_special,
+                )[0]
+            else:
+                stem, ext = os.path.splitext(config.FILE_NAME)
+                r_file = f"{stem} [{detect_quality(h)}]{ext or '.mkv'}"
+            renditions.append({"file": r_file, "height": h, "crf": r_crf, "preset": r_preset, "res_label": f"{h}p"})
+        config.FILE_NAME = renditions[0]["file"]
+        final_crf    = "/".join(str(r["crf"]) for r in renditions)
+        final_preset = "/".join(str(r["preset"]) for r in renditions)
+        res_label    = "/".join(r["res_label"] for r in renditions)
+        for r in renditions:
+            print(f"[ladder] {r['res_label']:>6} | CRF {r['crf']} | preset {r['preset']} → {r['file']}")
+
     # -- AUDIO CONFIGURATION --
     final_audio_bitrate = config.AUDIO_BITRATE if (config.AUDIO_BITRATE and config.AUDIO_BITRATE.strip()) else "32k"
     audio_cmd           = ["-af", "aformat=channel_layouts=stereo", "-c:a", "libopus", "-b:a", final_audio_bitrate, "-vbr", "on"]
@@ -347,7 +431,8 @@ async def main():
         grain_val = max(0, min(50, int(config.USER_GRAIN or 0)))
     except (ValueError, TypeError):
         grain_val = 0
-    svtav1_tune = f"tune=0:film-grain={grain_val}:enable-overlays=1:aq-mode=1:pin=0:lp=8:tile-columns=2:tile-rows=1:la-depth=60"
+    svtav1_base = f"tune=0:film-grain={grain_val}:enable-overlays=1:aq-mode=1:pin=0"
+    svtav1_tune = f"{svtav1_base}:lp=8:tile-columns=2:tile-rows=1:la-depth=60"
 
     # UI Labels
     hdr_label      = "HDR10" if is_hdr else "SDR"
@@ -382,12 +467,12 @@ async def main():
     # 4. LAUNCH TG AUTH AS A BACKGROUND TASK — encoding starts immediately.
     # If FloodWait fires, connect_telegram sleeps it out on its own while
     # FFmpeg keeps running. Progress messages are sent the instant TG is ready.
+    # ENCODE_ONLY runs headless — tg_edit() no-ops while tg_ready stays unset.
     tg_state = {}
     tg_ready = asyncio.Event()
-    tg_task  = asyncio.create_task(
+    tg_task  = None if config.ENCODE_ONLY else asyncio.create_task(
         connect_telegram(tg_state, tg_ready, config.FILE_NAME)
     )
-    tg_connect_start = time.time()   # record when we started waiting for TG
 
     # 5. ENCODING EXECUTION (starts immediately, does not wait for TG)
 
@@ -425,40 +510,84 @@ async def main():
         print(f"[encode] Subtitle #s:{out_sub_idx} title set to '{lang_name}' (lang: {st['lang']})")
         out_sub_idx += 1
 
-    cmd = [
-        "ffmpeg",
-        # Input-side seeking (fast; placed BEFORE -i)
-        *([ "-ss", demo_start, "-t", demo_duration ] if demo_mode else []),
-        "-i", config.SOURCE,
-        *ocr_inputs,              # -i pgs_track_N.srt for each OCR'd PGS track
-        "-map", "0:v:0",
-        "-map", "0:a?",
+    seek_args  = ["-ss", demo_start, "-t", demo_duration] if demo_mode else []
+    range_from = demo_start_sec if demo_mode else 0.0
+
+    # Non-video arguments — shared by the single-pass command and the
+    # chunked engine's final mux so both produce the same track layout.
+    # With AUDIO_PIPELINE the video encode carries no audio at all; the
+    # tracks are encoded by separate workers and muxed in afterwards.
+    stream_maps = [
+        *([] if config.AUDIO_PIPELINE else ["-map", "0:a?"]),
         "-map", "0:s?",
         *pgs_exclusions,          # exclude original PGS streams
         *ocr_maps,                # map OCR'd SRT inputs as subtitle streams
-        *video_filters,
-        "-c:v", "libsvtav1",
-        "-pix_fmt", "yuv420p10le",
-        "-crf", str(final_crf),
-        "-preset", str(final_preset),
-        "-svtav1-params", svtav1_tune,
-        "-threads", "0",
-        *audio_cmd,
+    ]
+    stream_args = [
+        *(["-an"] if config.AUDIO_PIPELINE else audio_cmd),
         *sub_title_meta,          # rename native subtitle titles
         *ocr_meta,                # rename OCR'd subtitle titles (e.g. "Japanese (Signs)")
         "-c:s", "copy",           # OCR SRT tracks are already text — copy is fine
         "-map_chapters", "0",
-        "-progress", "pipe:1",
-        "-nostats",
-        "-y", config.FILE_NAME
+    ]
+    codec_args = [
+        *video_filters,
+        "-c:v", "libsvtav1",
+        "-pix_fmt", "yuv420p10le",
+        "-preset", str(final_preset),
     ]
 
-    # asyncio subprocess so TG auth task can make progress on the same loop
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT,
-    )
+    # -- TARGET-VMAF CRF SEARCH --
+    # Sample encodes at several CRFs → VMAF → interpolated CRF for the target.
+    crf_search = None
+    if ladder and config.TARGET_VMAF and config.TARGET_VMAF.strip():
+        print("[crf-search] Skipped in ladder mode — each rung uses its select_params() CRF.")
+    elif config.TARGET_VMAF and config.TARGET_VMAF.strip():
+        await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.ANALYSIS ] Searching CRF for target VMAF...</b>")
+        async with tracing.span("crf_search", target=float(config.TARGET_VMAF)):
+            crf_search = await search_crf(
+                config.SOURCE, range_from, duration, codec_args,
+                f"{svtav1_base}:lp=2:tile-columns=0:tile-rows=0",
+                crop_val, width, height, float(config.TARGET_VMAF),
+            )
+        if crf_search:
+            final_crf = crf_search["crf"]
+            renditions[0]["crf"] = final_crf
+
+    video_args = [*codec_args, "-crf", str(final_crf)]
+
+    # -- SVT-AV1 THREAD/TILE TUNING --
+    # lp and tiles from the real CPU budget (affinity + cgroup quota) and the
+    # output height, optionally confirmed by a short calibration encode.
+    tune_text = ""
+    if ladder:
+        # All rungs encode at once — split the CPU budget between them
+        per_rung = max(1, effective_cpus() // len(renditions))
+        for r in renditions:
+            cfg = {**heuristic_config(per_rung, r["height"]), "cpus": per_rung}
+            r["svtav1"] = f"{svtav1_base}:{params_string(cfg)}:la-depth=60"
+        tune_text = f"{len(renditions)} rungs x lp={per_rung} @ {effective_cpus()} CPU"
+    elif config.SVT_AUTOTUNE:
+        if config.USER_RES and config.USER_RES.strip().isdigit():
+            tune_height = int(config.USER_RES)
+        elif crop_val:
+            tune_height = int(crop_val.split(":")[1])
+        else:
+            tune_height = height
+        async with tracing.span("autotune", calibrate=config.SVT_CALIBRATE):
+            svt_tuning  = await autotune(config.SOURCE, range_from, duration, tune_height, video_args, svtav1_base)
+        svtav1_tune = f"{svtav1_base}:{params_string(svt_tuning)}:la-depth=60"
+        tune_text   = tune_label(svt_tuning)
+
+    # -- PARALLEL AUDIO PIPELINE --
+    # One ffmpeg per audio track, running next to the video encode. Outputs
+    # are keyed by source fingerprint + audio settings and reused on re-runs.
+    audio_task = None
+    if config.AUDIO_PIPELINE and audio_tracks:
+        audio_task = asyncio.create_task(encode_audio_tracks(
+            config.SOURCE, len(audio_tracks), audio_cmd, seek_args,
+            file_fingerprint(config.SOURCE), workers=len(audio_tracks),
+        ))
 
     # Start resource monitor alongside encoding
     monitor_stop  = asyncio.Event()
@@ -470,60 +599,305 @@ async def main():
     last_update_time  = 0
     last_ui_text      = None   # latest snapshot; pushed to TG when it connects mid-encode
 
-    with open(config.LOG_FILE, "w") as f_log:
-        async for raw_line in process.stdout:
-            line = raw_line.decode("utf-8", errors="replace")
-            f_log.write(line)
+    async def report_progress(curr_sec: float, size_bytes: int):
+        nonlocal last_progress_pct, last_update_time, last_ui_text
+        percent  = (curr_sec / duration) * 100
+        elapsed  = time.time() - start_time
+        speed    = curr_sec / elapsed if elapsed > 0 else 0
+        fps      = (percent / 100 * total_frames) / elapsed if elapsed > 0 else 0
+        eta      = (elapsed / percent) * (100 - percent) if percent > 0 else 0
+        size_mb  = size_bytes / (1024 * 1024)
+
+        milestone   = int(percent // 1) * 1
+        now         = time.time()
+        pct_crossed = milestone > last_progress_pct
+        time_due    = now - last_update_time >= 20
+
+        scifi_ui     = get_encode_ui(
+            config.FILE_NAME, speed, fps, elapsed, eta,
+            curr_sec, duration, percent,
+            final_crf, final_preset, res_label,
+            crop_label_txt, hdr_label, grain_label,
+            config.AUDIO_MODE, final_audio_bitrate, size_mb,
+            cpu=monitor_stats.get("sys_cpu"),
+            ram=monitor_stats.get("sys_ram"),
+            demo_label=demo_label,
+            tune_label=tune_text,
+        )
+        last_ui_text = scifi_ui   # always keep the freshest snapshot
+        if config.ENCODE_ONLY and (pct_crossed or time_due):
+            # No Telegram in this mode — batch.py / worker.py poll this instead
+            write_progress({"percent": round(percent, 1), "speed": round(speed, 2),
+                            "fps": round(fps, 1), "eta": round(eta), "elapsed": round(elapsed),
+                            "size_mb": round(size_mb, 1)})
+
+        if pct_crossed or time_due:
+            last_progress_pct = milestone
+            last_update_time  = now
+            # Only sends if TG is already ready; otherwise silently buffered
+            await tg_edit(tg_state, tg_ready, scifi_ui)
+
+    if ladder and (config.CHUNKED_ENCODE or config.CHECKPOINT_ENCODE):
+        print("[ladder] Chunked/checkpoint encoding is single-output only — running one split-graph pass.")
+
+    scorer        = None
+    inline_scores = None
+    if config.INLINE_VMAF and config.RUN_VMAF and (ladder or not (config.CHUNKED_ENCODE or config.CHECKPOINT_ENCODE)):
+        print("[inline-vmaf] Needs the chunked engine — VMAF runs after the encode instead.")
+
+    encode_mode = ("ladder" if ladder else
+                   "chunked" if (config.CHUNKED_ENCODE or config.CHECKPOINT_ENCODE) else "single")
+    encode_span = tracing.start("encode", mode=encode_mode, renditions=len(renditions), streaming=streaming)
+    if (config.CHUNKED_ENCODE or config.CHECKPOINT_ENCODE) and not ladder:
+        # -- CHUNKED PARALLEL ENCODE --
+        # Several small SVT-AV1 instances over keyframe-aligned slices,
+        # then a lossless concat + audio/sub mux into config.FILE_NAME.
+        cpus       = effective_cpus()
+        workers    = resolve_workers(cpus)
+        chunk_lp   = max(1, cpus // workers)
+        chunks     = plan_chunks(probe_keyframes(config.SOURCE), range_from,
+                                 range_from + duration, config.CHUNK_SECONDS)
+        chunk_tune = f"{svtav1_base}:lp={chunk_lp}:tile-columns=1:tile-rows=0:la-depth=60"
+
+        # -- CHECKPOINT --
+        # Resume against a matching manifest (same source bytes, same params);
+        # its chunk plan wins so finished chunk files line up by index.
+        # lp is excluded from params: it changes the speed, not the bitstream
+        # semantics, and a resumed runner may have a different core count.
+        work_dir   = CHUNK_DIR
+        completed  = set()
+        on_done    = None
+        if config.CHECKPOINT_ENCODE:
+            work_dir  = config.CHECKPOINT_DIR
+            params    = {
+                "video_args": video_args,
+                "svtav1":     svtav1_base,
+                "range":      [range_from, range_from + duration],
+                "chunk_len":  config.CHUNK_SECONDS,
+            }
+            state     = checkpoint.prepare(work_dir, file_fingerprint(config.SOURCE), params, chunks)
+            chunks    = [tuple(c) for c in state["chunks"]]
+            completed = set(state["done"])
+            on_done   = lambda idx: checkpoint.mark_done(work_dir, state, idx)
+
+        print(f"[chunked] {len(chunks)} chunk(s) | {workers} worker(s) x lp={chunk_lp}"
+              + (f" | {len(completed)} resumed" if completed else ""))
+
+        # -- INLINE VMAF --
+        # Score each chunk against its source window the moment it lands;
+        # resumed chunks are already final, so they are queued right away.
+        if config.INLINE_VMAF and config.RUN_VMAF:
+            scorer = inline_vmaf.new_scorer(config.SOURCE, crop_val, width, height, fps_val, offset=range_from)
+            _mark  = on_done
+
+            def on_done(idx):
+                if _mark:
+                    _mark(idx)
+                inline_vmaf.submit(scorer, idx, checkpoint.chunk_path(work_dir, idx), *chunks[idx])
+
+            for idx in completed:
+                inline_vmaf.submit(scorer, idx, checkpoint.chunk_path(work_dir, idx), *chunks[idx])
+
+        with open(config.LOG_FILE, "a" if completed else "w") as f_log:
+            returncode, chunk_paths = await encode_chunks(
+                chunks, config.SOURCE, video_args, chunk_tune, workers,
+                report_progress, f_log,
+                work_dir=work_dir, completed=completed, on_chunk_done=on_done,
+                deadline=config.CHECKPOINT_DEADLINE if config.CHECKPOINT_ENCODE else 0,
+            )
+            if returncode == checkpoint.DEADLINE_RC:
+                # Exit non-zero so the workflow's failure() checkpoint upload runs
+                done_count = len(state["done"])
+                print(f"[checkpoint] Job deadline reached — stopping with {done_count}/{len(chunks)} "
+                      f"chunk(s) saved in {work_dir}.")
+                await tg_edit(
+                    tg_state, tg_ready,
+                    f"<b>[ SYSTEM.CHECKPOINT ] Job time limit reached</b>\n"
+                    f"<code>{done_count}/{len(chunks)}</code> chunks saved — re-run with "
+                    f"<code>resume_run_id={os.environ.get('GITHUB_RUN_ID', '?')}</code>",
+                )
+                encode_span.end(returncode=returncode, checkpointed=done_count)
+                if tg_state.get("app"):
+                    await tg_scheduler.flush()
+                    await tg_state["app"].stop()
+                raise SystemExit(checkpoint.DEADLINE_RC)
             if config.CANCELLED:
-                process.terminate()
-                elapsed_so_far = time.time() - start_time
                 await tg_edit(
                     tg_state, tg_ready,
-                    get_cancelled_ui(config.FILE_NAME, format_time(elapsed_so_far)),
+                    get_cancelled_ui(config.FILE_NAME, format_time(time.time() - start_time)),
                 )
-                break
-
-            if "out_time_ms" in line:
-                try:
-                    curr_sec = int(line.split("=")[1]) / 1_000_000
-                    percent  = (curr_sec / duration) * 100
-                    elapsed  = time.time() - start_time
-                    speed    = curr_sec / elapsed if elapsed > 0 else 0
-                    fps      = (percent / 100 * total_frames) / elapsed if elapsed > 0 else 0
-                    eta      = (elapsed / percent) * (100 - percent) if percent > 0 else 0
-                    size_mb  = os.path.getsize(config.FILE_NAME) / (1024 * 1024) if os.path.exists(config.FILE_NAME) else 0
-
-                    milestone   = int(percent // 1) * 1
-                    now         = time.time()
-                    pct_crossed = milestone > last_progress_pct
-                    time_due    = now - last_update_time >= 20
-
-                    scifi_ui     = get_encode_ui(
-                        config.FILE_NAME, speed, fps, elapsed, eta,
-                        curr_sec, duration, percent,
-                        final_crf, final_preset, res_label,
-                        crop_label_txt, hdr_label, grain_label,
-                        config.AUDIO_MODE, final_audio_bitrate, size_mb,
-                        cpu=monitor_stats.get("sys_cpu"),
-                        ram=monitor_stats.get("sys_ram"),
-                        demo_label=demo_label,
-                    )
-                    last_ui_text = scifi_ui   # always keep the freshest snapshot
+            elif returncode == 0:
+                returncode = await concat_and_mux(
+                    chunk_paths, config.SOURCE, config.FILE_NAME,
+                    seek_args, ocr_inputs, stream_maps, stream_args, f_log,
+                    work_dir=work_dir,
+                )
+        if scorer:
+            # Chunk files must outlive their scorers
+            inline_scores = await inline_vmaf.finish(scorer, len(chunks)) if returncode == 0 else None
+        if returncode == 0:
+            cleanup_chunks(work_dir)
+    else:
+        if ladder:
+            # -- LADDER: one decode → denoise/crop → split → scale per rung --
+            split_labels = "".join(f"[s{i}]" for i in range(len(renditions)))
+            graph = [f"[0:v:0]{','.join(vf_filters)},split={len(renditions)}{split_labels}"]
+            graph += [f"[s{i}]scale=-2:{r['height']}[v{i}]" for i, r in enumerate(renditions)]
+            outputs = []
+            for i, r in enumerate(renditions):
+                outputs += [
+                    "-map", f"[v{i}]",
+                    *stream_maps,
+                    "-c:v", "libsvtav1",
+                    "-pix_fmt", "yuv420p10le",
+                    "-preset", str(r["preset"]),
+                    "-crf", str(r["crf"]),
+                    "-svtav1-params", r["svtav1"],
+                    "-threads", "0",
+                    *stream_args,
+                    "-y", r["file"],
+                ]
+            encode_args = ["-filter_complex", ";".join(graph),
+                           "-progress", "pipe:1", "-nostats", *outputs]
+        else:
+            encode_args = [
+                "-map", "0:v:0",
+                *stream_maps,
+                *video_args,
+                "-svtav1-params", svtav1_tune,
+                "-threads", "0",
+                *stream_args,
+                "-progress", "pipe:1",
+                "-nostats",
+                "-y", config.FILE_NAME
+            ]
+        cmd = [
+            "ffmpeg",
+            # Input-side seeking (fast; placed BEFORE -i)
+            *seek_args,
+            # Streamed source: read the growing file through stdin
+            "-i", "pipe:0" if streaming else config.SOURCE,
+            *ocr_inputs,              # -i pgs_track_N.srt for each OCR'd PGS track
+            *encode_args,
+        ]
+
+        # asyncio subprocess so TG auth task can make progress on the same loop
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if streaming else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        feed_task = (
+            asyncio.create_task(stream_source.feed_growing_file(config.SOURCE, process.stdin))
+            if streaming else None
+        )
 
-                    if pct_crossed or time_due:
-                        last_progress_pct = milestone
-                        last_update_time  = now
-                        # Only sends if TG is already ready; otherwise silently buffered
-                        await tg_edit(tg_state, tg_ready, scifi_ui)
+        with open(config.LOG_FILE, "w") as f_log:
+            async for raw_line in process.stdout:
+                line = raw_line.decode("utf-8", errors="replace")
+                f_log.write(line)
+                if config.CANCELLED:
+                    process.terminate()
+                    elapsed_so_far = time.time() - start_time
+                    await tg_edit(
+                        tg_state, tg_ready,
+                        get_cancelled_ui(config.FILE_NAME, format_time(elapsed_so_far)),
+                    )
+                    break
+
+                if "out_time_ms" in line:
+                    try:
+                        curr_sec = int(line.split("=")[1]) / 1_000_000
+                        size     = sum(os.path.getsize(r["file"]) for r in renditions if os.path.exists(r["file"]))
+                        await report_progress(curr_sec, size)
+                    except Exception:
+                        continue
+
+        await process.wait()
+        returncode = process.returncode
+
+        if feed_task:
+            if not feed_task.done():
+                feed_task.cancel()   # ffmpeg stopped early (demo slice / cancel / crash)
+            try:
+                await feed_task
+            except asyncio.CancelledError:
+                pass
+            except RuntimeError as e:
+                print(f"[stream] {e}")
+                returncode = returncode or 1
+            # Remux and VMAF read the complete source
+            try:
+                await stream_source.wait_until_done(config.SOURCE)
+            except RuntimeError as e:
+                print(f"[stream] {e}")
+                returncode = returncode or 1
+
+    encode_secs   = time.time() - start_time
+    encode_frames = int(duration * fps_val) if fps_val else total_frames
+    encode_span.end(
+        returncode=returncode, frames=encode_frames,
+        fps=round(encode_frames / encode_secs, 2) if encode_secs > 0 else None,
+        bytes=sum(os.path.getsize(r["file"]) for r in renditions if os.path.exists(r["file"])),
+    )
 
-                except Exception:
-                    continue
+    if audio_task:
+        async with tracing.span("audio", tracks=len(audio_tracks)):
+            audio_files = await audio_task
+            if returncode == 0 and audio_files is None:
+                print("[audio] Audio pipeline failed.")
+                returncode = 1
+            elif returncode == 0:
+                for r in renditions:
+                    muxed = f"AUDIO_{r['file']}"
+                    with open(config.LOG_FILE, "a") as f_log:
+                        returncode = await mux_audio(r["file"], audio_files, muxed, f_log)
+                    if returncode != 0:
+                        break
+                    os.replace(muxed, r["file"])
 
-    await process.wait()
     monitor_stop.set()
     await monitor_task
     total_mission_time = time.time() - start_time
 
+    encode_results = {
+        "file_name":           config.FILE_NAME,
+        "duration":            duration,
+        "width":               width,
+        "height":              height,
+        "fps_val":             fps_val,
+        "crop_val":            crop_val,
+        "range_from":          range_from,
+        "total_mission_time":  total_mission_time,
+        "res_label":           renditions[0]["res_label"],
+        "final_crf":           renditions[0]["crf"],
+        "final_preset":        renditions[0]["preset"],
+        "hdr_label":           hdr_label,
+        "grain_label":         grain_label,
+        "final_audio_bitrate": final_audio_bitrate,
+        "audio_type_label":    audio_type_label,
+        "demo_mode":           demo_mode,
+        "demo_duration":       demo_duration,
+        "demo_start":          demo_start,
+        "audio_tracks":        audio_tracks,
+        "sub_tracks":          sub_tracks,
+        "crf_search":          crf_search,
+        "renditions":          [],
+    }
+
+    # ENCODE_ONLY: hand off to upload.py (remux, VMAF, delivery)
+    if config.ENCODE_ONLY:
+        if returncode != 0:
+            print(f"[encode-only] Encoder exited with {returncode} — see {config.LOG_FILE}")
+            print(tracing.format_table())
+            raise SystemExit(1)
+        write_encode_results(encode_results)
+        with open("output_fname.txt", "w", encoding="utf-8") as f:
+            f.write(config.FILE_NAME)
+        print(f"[encode-only] {config.FILE_NAME} ready in {format_time(total_mission_time)}")
+        return
+
     # If TG is still waiting out a FloodWait, block here until it connects.
     # Encoding is done so we have all the time we need.
     if not tg_ready.is_set():
@@ -543,6 +917,7 @@ async def main():
     if not app or not status:
         print("TG connected but no status message — cannot send results.")
         if app:
+            await tg_scheduler.flush()
             await app.stop()
         return
 
@@ -552,7 +927,7 @@ async def main():
             await tg_edit(tg_state, tg_ready, last_ui_text)
 
         # 6. ERROR HANDLING
-        if process.returncode != 0:
+        if returncode != 0:
             error_snippet = (
                 "".join(open(config.LOG_FILE).readlines()[-10:])
                 if os.path.exists(config.LOG_FILE)
@@ -561,122 +936,218 @@ async def main():
             await tg_notify_failure(tg_state, tg_ready, config.FILE_NAME, error_snippet)
             return
 
-        # 7. POST-PROCESSING (Remux)
-        await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.OPTIMIZE ] Finalizing Metadata...</b>")
-        fixed_file = f"FIXED_{config.FILE_NAME}"
-        mkvmerge_title_args = ["--title", config.ENCODER_TITLE] if config.ENCODER_TITLE.strip() else []
-        subprocess.run([
-            "mkvmerge", "-o", fixed_file,
-            *mkvmerge_title_args,
-            config.FILE_NAME,
-            "--no-video", "--no-audio", "--no-subtitles", "--no-attachments", config.SOURCE
-        ])
-        if os.path.exists(fixed_file):
-            os.remove(config.FILE_NAME)
-            os.rename(fixed_file, config.FILE_NAME)
-
-        # 8. METRICS + CLOUD UPLOAD (concurrent)
-        final_size = os.path.getsize(config.FILE_NAME) / (1024 * 1024)
-
-        grid_task = asyncio.create_task(async_generate_thumbnail(duration, config.FILE_NAME))
-
-        if config.RUN_UPLOAD:
-            await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.CLOUD ] Uploading to Gofile...</b>")
-            cloud_task = asyncio.create_task(upload_to_cloud(config.FILE_NAME, app, config.CHAT_ID, status))
-        else:
-            cloud_task = None
-
-        if config.RUN_VMAF:
-            async def vmaf_tg_writer(payload):
-                ui = get_vmaf_ui(payload["vmaf_percent"], payload["fps"], payload["eta"])
-                await tg_edit(tg_state, tg_ready, ui)
-
-            vmaf_val, ssim_val = await get_vmaf(config.FILE_NAME, crop_val, width, height, duration, fps_val, kv_writer=vmaf_tg_writer)
-        else:
-            vmaf_val, ssim_val = "N/A", "N/A"
-
-        await grid_task
-        cloud = await cloud_task if cloud_task else {"direct": None, "page": None, "source": "disabled"}
-
-        # 9. Build inline buttons from cloud result
-        btn_row = []
-        if cloud["source"] == "gofile":
-            if cloud.get("page"):
-                btn_row.append(InlineKeyboardButton("Gofile", url=cloud["page"]))
-            if cloud.get("direct"):
-                btn_row.append(InlineKeyboardButton("Direct", url=cloud["direct"]))
-        elif cloud["source"] == "litterbox" and cloud.get("direct"):
-            btn_row.append(InlineKeyboardButton("Litterbox", url=cloud["direct"]))
-        buttons = InlineKeyboardMarkup([btn_row]) if btn_row else None
-
-        # 10. FINAL UPLINK
-        if final_size > 2000:
-            await tg_edit(
-                tg_state, tg_ready,
-                "<b>[ SIZE OVERFLOW ]</b> File too large for Telegram. Cloud link below.",
-                reply_markup=buttons,
-            )
-            return
-
-        thumb = config.SCREENSHOT if os.path.exists(config.SCREENSHOT) else None
-
-        crop_label_report = " | Cropped" if crop_val else ""
-        track_report = format_track_report(audio_tracks, sub_tracks)
-
-        # Append user-supplied track label notes if provided
-        user_track_notes = ""
-        if config.SUB_TRACKS and config.SUB_TRACKS.strip():
-            user_track_notes += f"\n🔤 <b>SUB LABELS:</b>  <code>{config.SUB_TRACKS}</code>"
-        if config.AUDIO_TRACKS and config.AUDIO_TRACKS.strip():
-            user_track_notes += f"\n🔊 <b>AUDIO LABELS:</b> <code>{config.AUDIO_TRACKS}</code>"
+        # 7–10 run once per rendition (a plain encode is a ladder of one)
+        keep_status = False
+        for r in renditions:
+            out_file = r["file"]
+
+            # 7. POST-PROCESSING (Remux)
+            await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.OPTIMIZE ] Finalizing Metadata...</b>")
+            fixed_file = f"FIXED_{out_file}"
+            mkvmerge_title_args = ["--title", config.ENCODER_TITLE] if config.ENCODER_TITLE.strip() else []
+            with tracing.span("remux", file=out_file):
+                subprocess.run([
+                    "mkvmerge", "-o", fixed_file,
+                    *mkvmerge_title_args,
+                    out_file,
+                    "--no-video", "--no-audio", "--no-subtitles", "--no-attachments", config.SOURCE
+                ])
+            if os.path.exists(fixed_file):
+                os.remove(out_file)
+                os.rename(fixed_file, out_file)
+
+            # 8. TG UPLOAD + METRICS + CLOUD UPLOAD (concurrent)
+            # The Telegram upload starts right after the remux with a placeholder
+            # caption; report and link buttons are edited in once VMAF and the
+            # cloud upload are done, so delivery takes max(upload, VMAF).
+            final_size = os.path.getsize(out_file) / (1024 * 1024)
+
+            if config.RUN_UPLOAD:
+                await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.CLOUD ] Uploading to Gofile...</b>")
+                cloud_task = asyncio.create_task(tracing.traced(
+                    "gofile", upload_to_cloud(out_file, app, config.CHAT_ID, status),
+                    bytes=os.path.getsize(out_file),
+                ))
+            else:
+                cloud_task = None
+
+            vmaf_task = None
+            if inline_scores:
+                vmaf_val, ssim_val, vmaf_summary = inline_scores
+                print(f"[inline-vmaf] Pooled over {len(chunks)} chunks: VMAF {vmaf_val} | SSIM {ssim_val}")
+            elif config.RUN_VMAF:
+                async def vmaf_tg_writer(payload):
+                    ui = get_vmaf_ui(payload["vmaf_percent"], payload["fps"], payload["eta"])
+                    await tg_edit(tg_state, tg_ready, ui)
+
+                vmaf_task = asyncio.create_task(tracing.traced("vmaf", get_vmaf(
+                    out_file, crop_val, width, height, duration, fps_val,
+                    kv_writer=vmaf_tg_writer, ref_offset=range_from,
+                ), mode=config.VMAF_MODE))
+            else:
+                vmaf_val, ssim_val, vmaf_summary = "N/A", "N/A", None
+
+            # Thumbnail has to exist before the upload starts (bounded by GRID_TIME_BUDGET)
+            async with tracing.span("thumbnail"):
+                await async_generate_grid(duration, out_file)
+            thumb = config.THUMBNAIL if os.path.exists(config.THUMBNAIL) else None
+
+            # Over Telegram's cap: split into self-contained parts sent as one album
+            split_parts = []
+            if final_size > 2000 and config.TG_SPLIT_MB > 0:
+                async with tracing.span("split"):
+                    split_parts = await split_for_telegram(out_file)
+
+            doc_task = None
+            if final_size <= 2000 or split_parts:
+                import ui as _ui; _ui.last_up_pct = -1; _ui.last_up_update = 0; _ui.up_start_time = 0
+                await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.UPLINK ] Transmitting Final Video...</b>")
+                placeholder = f"📄 <code>{out_file}</code>\n<i>⏳ Quality report and links follow...</i>"
+                if split_parts:
+                    doc_task = asyncio.create_task(tracing.traced("tg_upload", send_document_group(
+                        app, config.CHAT_ID, split_parts,
+                        thumb=thumb,
+                        caption=placeholder,
+                        parse_mode=enums.ParseMode.HTML,
+                        progress=upload_progress,
+                        progress_args=(app, config.CHAT_ID, status, out_file),
+                    ), bytes=os.path.getsize(out_file), parts=len(split_parts)))
+                else:
+                    doc_task = asyncio.create_task(tracing.traced("tg_upload", send_document_fast(
+                        app, config.CHAT_ID,
+                        out_file,
+                        thumb=thumb,
+                        caption=placeholder,
+                        parse_mode=enums.ParseMode.HTML,
+                        progress=upload_progress,
+                        progress_args=(app, config.CHAT_ID, status, out_file),
+                    ), bytes=os.path.getsize(out_file)))
+
+            if vmaf_task:
+                vmaf_val, ssim_val, vmaf_summary = await vmaf_task
+
+            encode_results["renditions"].append({
+                "file_name":    out_file,
+                "res_label":    r["res_label"],
+                "final_crf":    r["crf"],
+                "final_preset": r["preset"],
+                "vmaf":         vmaf_val,
+                "ssim":         ssim_val,
+                "vmaf_report":  vmaf_summary,
+            })
+            if r is renditions[0]:
+                encode_results.update(vmaf=vmaf_val, ssim=ssim_val, vmaf_report=vmaf_summary)
+            write_encode_results(encode_results)
+
+            cloud = await cloud_task if cloud_task else {"direct": None, "page": None, "source": "disabled"}
+
+            # 9. Build inline buttons from cloud result
+            btn_row = []
+            if cloud["source"] == "gofile":
+                if cloud.get("page"):
+                    btn_row.append(InlineKeyboardButton("Gofile", url=cloud["page"]))
+                if cloud.get("direct"):
+                    btn_row.append(InlineKeyboardButton("Direct", url=cloud["direct"]))
+            elif cloud["source"] == "litterbox" and cloud.get("direct"):
+                btn_row.append(InlineKeyboardButton("Litterbox", url=cloud["direct"]))
+            buttons = InlineKeyboardMarkup([btn_row]) if btn_row else None
+
+            # 10. FINAL UPLINK
+            if doc_task is None:
+                overflow_text = "<b>[ SIZE OVERFLOW ]</b> File too large for Telegram. Cloud link below."
+                if ladder:
+                    # Status message keeps moving on to the next rung — post the link separately
+                    await tg_scheduler.submit(
+                        config.CHAT_ID,
+                        lambda: app.send_message(
+                            config.CHAT_ID, f"{overflow_text}\n<code>{out_file}</code>",
+                            parse_mode=enums.ParseMode.HTML, reply_markup=buttons,
+                        ),
+                        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+                    )
+                else:
+                    await tg_edit(tg_state, tg_ready, overflow_text, reply_markup=buttons)
+                    keep_status = True
+                continue
 
-        audio_mode_line = (
-            f"{audio_type_label.upper()} ({config.AUDIO_MODE.upper()} @ {final_audio_bitrate})"
-            if audio_type_label
-            else f"{config.AUDIO_MODE.upper()} @ {final_audio_bitrate}"
-        )
-        content_line = f"└ Type: {config.CONTENT_TYPE}\n" if config.CONTENT_TYPE else ""
-        demo_report_line = (
-            f"⚡ <b>DEMO MODE:</b> <code>{demo_duration}s from {demo_start}</code>\n"
-            if demo_mode else ""
-        )
-        report = (
-            f"✅ <b>MISSION ACCOMPLISHED</b>\n\n"
-            f"📄 <b>FILE:</b> <code>{config.FILE_NAME}</code>\n"
-            f"⏱ <b>TIME:</b> <code>{format_time(total_mission_time)}</code>\n"
-            f"⏳<b>DURATION:</b> <code>{format_time(duration)}</code>\n"
-            f"📦 <b>SIZE:</b> <code>{final_size:.2f} MB</code>\n"
-            f"📊 <b>QUALITY:</b> VMAF: <code>{vmaf_val}</code> | SSIM: <code>{ssim_val}</code>\n\n"
-            f"🛠 <b>SPECS:</b>\n"
-            f"└ Preset: {final_preset} | CRF: {final_crf}\n"
-            f"└ Video: {res_label}{crop_label_report} | {hdr_label}{grain_label}\n"
-            f"└ Audio: {audio_mode_line}\n"
-            f"{content_line}"
-            f"{demo_report_line}"
-            f"\n{track_report}"
-            f"{user_track_notes}"
-        )
+            crop_label_report = " | Cropped" if crop_val else ""
+            track_report = format_track_report(audio_tracks, sub_tracks)
 
-        import ui as _ui; _ui.last_up_pct = -1; _ui.last_up_update = 0; _ui.up_start_time = 0
+            # Append user-supplied track label notes if provided
+            user_track_notes = ""
+            if config.SUB_TRACKS and config.SUB_TRACKS.strip():
+                user_track_notes += f"\n🔤 <b>SUB LABELS:</b>  <code>{config.SUB_TRACKS}</code>"
+            if config.AUDIO_TRACKS and config.AUDIO_TRACKS.strip():
+                user_track_notes += f"\n🔊 <b>AUDIO LABELS:</b> <code>{config.AUDIO_TRACKS}</code>"
 
-        await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.UPLINK ] Transmitting Final Video...</b>")
+            audio_mode_line = (
+                f"{audio_type_label.upper()} ({config.AUDIO_MODE.upper()} @ {final_audio_bitrate})"
+                if audio_type_label
+                else f"{config.AUDIO_MODE.upper()} @ {final_audio_bitrate}"
+            )
+            content_line = f"└ Type: {config.CONTENT_TYPE}\n" if config.CONTENT_TYPE else ""
+            tune_report_line = f"└ Threads: {tune_text}\n" if tune_text else ""
+            demo_report_line = (
+                f"⚡ <b>DEMO MODE:</b> <code>{demo_duration}s from {demo_start}</code>\n"
+                if demo_mode else ""
+            )
+            split_report_line = (
+                f"🧩 <b>PARTS:</b> <code>{len(split_parts)} × ≤{config.TG_SPLIT_MB} MB</code> (play in order)\n"
+                if split_parts else ""
+            )
+            report = (
+                f"✅ <b>MISSION ACCOMPLISHED</b>\n\n"
+                f"📄 <b>FILE:</b> <code>{out_file}</code>\n"
+                f"⏱ <b>TIME:</b> <code>{format_time(total_mission_time)}</code>\n"
+                f"⏳<b>DURATION:</b> <code>{format_time(duration)}</code>\n"
+                f"📦 <b>SIZE:</b> <code>{final_size:.2f} MB</code>\n"
+                f"{split_report_line}"
+                f"📊 <b>QUALITY:</b> VMAF: <code>{vmaf_val}</code> | SSIM: <code>{ssim_val}</code>\n"
+                f"{get_vmaf_report(vmaf_summary)}\n"
+                f"🛠 <b>SPECS:</b>\n"
+                f"└ Preset: {r['preset']} | CRF: {r['crf']}\n"
+                f"└ Video: {r['res_label']}{crop_label_report} | {hdr_label}{grain_label}\n"
+                f"{tune_report_line}"
+                f"└ Audio: {audio_mode_line}\n"
+                f"{content_line}"
+                f"{demo_report_line}"
+                f"{get_crf_search_report(crf_search)}"
+                f"\n{track_report}"
+                f"{user_track_notes}"
+            )
 
-        await app.send_document(
-            chat_id=config.CHAT_ID,
-            document=config.FILE_NAME,
-            thumb=thumb,
-            caption=report,
-            parse_mode=enums.ParseMode.HTML,
-            reply_markup=buttons,
-            progress=upload_progress,
-            progress_args=(app, config.CHAT_ID, status, config.FILE_NAME),
-        )
+            document = await doc_task
+            # Upload is done — the phase table now covers the whole job
+            report = with_phase_report(report, tracing.summary())
+            if split_parts:
+                # Albums can't carry inline buttons — links go in a reply
+                if document:
+                    await tg_edit_caption(app, document[0], report)
+                    if buttons:
+                        await tg_scheduler.submit(
+                            config.CHAT_ID,
+                            lambda: app.send_message(
+                                config.CHAT_ID, "🔗 <b>Cloud links</b>", parse_mode=enums.ParseMode.HTML,
+                                reply_markup=buttons, reply_to_message_id=document[0].id,
+                            ),
+                            priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+                        )
+                for p in split_parts:
+                    if os.path.exists(p): os.remove(p)
+            else:
+                await tg_edit_caption(app, document, report, reply_markup=buttons)
+
+            if os.path.exists(out_file): os.remove(out_file)
 
         # CLEANUP
+        if keep_status:
+            return
         try: await status.delete()
         except: pass
-        for f in [config.SOURCE, config.FILE_NAME, config.LOG_FILE, config.SCREENSHOT, *ocr_srt_files]:
+        for f in [config.SOURCE, config.LOG_FILE, config.SCREENSHOT, config.THUMBNAIL, tg_connect.STATUS_FILE,
+                  *ocr_srt_files]:
             if os.path.exists(f): os.remove(f)
+        metrics.cleanup_logs()
 
     except Exception as exc:
         import traceback
@@ -690,9 +1161,14 @@ async def main():
         )
         await tg_notify_failure(tg_state, tg_ready, config.FILE_NAME, reason)
     finally:
+        await close_http_session()
         if app:
+            await tg_scheduler.flush()
             await app.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        tracing.save("encode")
\ No newline at end of file
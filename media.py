@@ -1,4 +1,5 @@
 import asyncio
+import hashlib
 import os
 import subprocess
 import json
@@ -7,16 +8,19 @@ import time
 from collections import Counter
 
 import config
+import metrics
+import probe
+from svt_tune import effective_cpus
 
 
 def get_video_info():
-    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", "-show_format", config.SOURCE]
-    res = json.loads(subprocess.check_output(cmd).decode())
-    video_stream = next(s for s in res['streams'] if s['codec_type'] == 'video')
-    audio_stream = next((s for s in res['streams'] if s['codec_type'] == 'audio'), {})
+    video_stream = probe.video_stream(config.SOURCE)
+    if not video_stream:
+        raise ValueError(f"No video stream in {config.SOURCE}")
+    audio_stream = next(iter(probe.audio_streams(config.SOURCE)), {})
 
     channels     = int(audio_stream.get('channels', 0))
-    duration     = float(res['format'].get('duration', 0))
+    duration     = probe.duration(config.SOURCE)
     width        = int(video_stream.get('width', 0))
     height       = int(video_stream.get('height', 0))
 
@@ -36,22 +40,162 @@ def get_video_info():
     return duration, width, height, is_hdr, total_frames, channels, fps_val
 
 
-async def async_generate_thumbnail(duration, target_file):
-    loop = asyncio.get_event_loop()
-    def sync_thumbnail():
-        ts  = duration * 0.25
-        cmd = [
-            "ffmpeg", "-ss", str(ts), "-i", target_file,
-            "-vf", "scale=480:-1",
-            "-frames:v", "1", "-q:v", "3", config.SCREENSHOT, "-y"
+def file_fingerprint(path, sample_bytes=1024 * 1024):
+    """
+    Fast content fingerprint: file size plus SHA-1 of the first, middle and
+    last *sample_bytes*. Reads ~3 MB regardless of file size, so it is safe
+    to call on multi-GB sources. Identical downloads on different runners
+    produce the same value.
+    """
+    size   = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - sample_bytes // 2), max(0, size - sample_bytes)):
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+    return f"{size}-{digest.hexdigest()}"
+
+
+# ---------------------------------------------------------------------------
+# CONTACT SHEET + THUMBNAIL
+# ---------------------------------------------------------------------------
+
+def _frame_stats(raw, width, height):
+    """(mean luma, 16x9 gray signature) of an rgb24 frame."""
+    try:
+        import numpy as np
+        rgb  = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 3)
+        gray = rgb.mean(axis=2)
+        sig  = gray[np.linspace(0, height - 1, 9).astype(int)][:, np.linspace(0, width - 1, 16).astype(int)]
+        return float(gray.mean()), sig.flatten().tolist()
+    except ImportError:
+        px   = [raw[i] for i in range(0, len(raw), 3 * 97)]
+        sig  = [
+            raw[(int(y * (height - 1) / 8) * width + int(x * (width - 1) / 15)) * 3]
+            for y in range(9) for x in range(16)
         ]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    await loop.run_in_executor(None, sync_thumbnail)
+        return sum(px) / max(1, len(px)), sig
+
+
+async def _grab_keyframe(target_file, ts, width, height):
+    """One keyframe at/after *ts*, scaled to width x height, as raw rgb24 bytes."""
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-skip_frame", "nokey", "-ss", f"{ts:.3f}", "-i", target_file,
+        "-map", "0:v:0", "-frames:v", "1", "-vf", f"scale={width}:{height}:flags=bilinear",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    try:
+        raw, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    return raw if len(raw) == width * height * 3 else None
+
+
+async def async_generate_grid(duration, target_file):
+    """
+    Contact sheet of GRID_FRAMES representative frames → config.SCREENSHOT,
+    plus the Telegram thumbnail → config.THUMBNAIL, within GRID_TIME_BUDGET.
+
+    Twice as many keyframe seeks as tiles run concurrently across 5–95% of
+    the timeline; black frames (fades, title cards) and near-duplicates of an
+    already chosen frame are dropped. Whatever finished inside the budget is
+    tiled, and the brightest kept frame becomes the thumbnail — both from
+    the same decoded frames in one ffmpeg encode.
+    Returns True when the sheet was written.
+    """
+    started = time.time()
+    try:
+        stream = probe.video_stream(target_file)
+        src_w, src_h = int(stream["width"]), int(stream["height"])
+    except Exception as e:
+        print(f"[grid] probe failed: {e}")
+        return False
+    tile_w = config.GRID_TILE_WIDTH
+    tile_h = max(2, round(tile_w * src_h / src_w / 2) * 2)
+    count  = max(1, config.GRID_FRAMES)
+    stamps = [duration * (0.05 + 0.90 * i / max(1, count * 2 - 1)) for i in range(count * 2)]
+
+    tasks = [asyncio.create_task(_grab_keyframe(target_file, ts, tile_w, tile_h)) for ts in stamps]
+    done, pending = await asyncio.wait(tasks, timeout=config.GRID_TIME_BUDGET * 0.8)
+    for t in pending:
+        t.cancel()
+
+    picked = []   # (ts, raw, luma)
+    for ts, task in zip(stamps, tasks):
+        if task not in done or task.exception() or not task.result():
+            continue
+        raw = task.result()
+        luma, sig = _frame_stats(raw, tile_w, tile_h)
+        if luma < config.GRID_BLACK_LUMA:
+            continue
+        if any(sum(abs(a - b) for a, b in zip(sig, s)) / len(sig) < config.GRID_DUP_DIFF for *_, s in picked):
+            continue
+        picked.append((ts, raw, luma, sig))
+
+    if not picked:
+        print(f"[grid] No usable frames within {config.GRID_TIME_BUDGET}s ({len(done)}/{len(tasks)} seeks done)")
+        return False
+
+    # Spread the keepers over the timeline rather than taking the first N
+    if len(picked) > count:
+        step   = len(picked) / count
+        picked = [picked[int(i * step)] for i in range(count)]
+    thumb_idx = max(range(len(picked)), key=lambda i: picked[i][2])
+    cols      = min(3, len(picked))
+    rows      = -(-len(picked) // cols)
+
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{tile_w}x{tile_h}", "-r", "1", "-i", "pipe:0",
+        "-filter_complex",
+        f"[0:v]split=2[a][b];"
+        f"[a]tile={cols}x{rows}:padding=4:margin=4[grid];"
+        # Telegram drops thumbnails that don't fit 320x320 — bound the long side
+        f"[b]select='eq(n,{thumb_idx})',"
+        f"scale='if(gt(iw,ih),320,-2)':'if(gt(iw,ih),-2,320)'[thumb]",
+        "-map", "[grid]", "-frames:v", "1", "-q:v", "3", "-y", config.SCREENSHOT,
+        "-map", "[thumb]", "-frames:v", "1", "-q:v", "4", "-y", config.THUMBNAIL,
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    _, err = await proc.communicate(b"".join(raw for _, raw, *_ in picked))
+    if proc.returncode != 0:
+        print(f"[grid] tile encode failed: {err.decode(errors='ignore').strip()[-200:]}")
+        return False
+    print(f"[grid] {len(picked)} frames ({cols}x{rows}) from {len(done)}/{len(tasks)} seeks "
+          f"in {time.time() - started:.1f}s → {config.SCREENSHOT}, "
+          f"thumb @ {time.strftime('%H:%M:%S', time.gmtime(picked[thumb_idx][0]))}")
+    return True
+
+
+def get_crop_params(duration, max_ts=None):
+    """
+    Detect black borders. Uses the NumPy analyzer (cropdetect.py) — one
+    keyframe-only decode across the whole timeline — and falls back to the
+    serial cropdetect runs when NumPy is unavailable or the analyzer fails.
+    max_ts limits sampling to [0, max_ts] — e.g. the downloaded part of a streamed source.
+    """
+    span = duration if max_ts is None else min(duration, max_ts)
+    if span < 10: return None
+    try:
+        from cropdetect import analyze_crop
+        crop, confidence, frames = analyze_crop(config.SOURCE, duration, config.CROP_SAMPLES, max_ts)
+        print(f"[crop] {crop or 'none'} | confidence {confidence:.0%} over {frames} frames")
+        if frames:
+            return crop if confidence >= config.CROP_MIN_CONFIDENCE else None
+    except Exception as e:
+        print(f"[crop] NumPy analyzer unavailable ({e}) — using cropdetect.")
+    return get_crop_params_cropdetect(duration, max_ts)
 
 
-def get_crop_params(duration):
-    if duration < 10: return None
-    test_points    = [duration * 0.15, duration * 0.35, duration * 0.55, duration * 0.75]
+def get_crop_params_cropdetect(duration, max_ts=None):
+    """Legacy path: four sequential cropdetect runs, majority vote."""
+    span = duration if max_ts is None else min(duration, max_ts)
+    if span < 10: return None
+    test_points    = [span * 0.15, span * 0.35, span * 0.55, span * 0.75]
     detected_crops = []
     for ts in test_points:
         time_str = time.strftime('%H:%M:%S', time.gmtime(ts))
@@ -74,7 +218,75 @@ def get_crop_params(duration):
     return None
 
 
-async def get_vmaf(output_file, crop_val, width, height, duration, fps, kv_writer=None):
+def vmaf_reference_dims(crop_val, width, height):
+    """Reference frame size after crop — the distorted side is scaled to it."""
+    if crop_val:
+        try:
+            parts = crop_val.split(':')
+            return parts[0], parts[1]
+        except: pass
+    return width, height
+
+
+def vmaf_filter_graph(crop_val, ref_w, ref_h, select_filter=None, vmaf_opts=""):
+    """
+    The VMAF + SSIM graph shared by every quality measurement:
+    input 0 = distorted (scaled to the reference size), input 1 = reference
+    (cropped the same way the encode was).
+    vmaf_opts: extra libvmaf options, e.g. "n_subsample=4:n_threads=2".
+    """
+    ref_chain  = [f"crop={crop_val}"] if crop_val else []
+    dist_chain = []
+    if select_filter:
+        ref_chain.append(select_filter)
+        dist_chain.append(select_filter)
+    dist_chain.append(f"scale={ref_w}:{ref_h}:flags=bicubic")
+    return (
+        f"[1:v]{','.join(ref_chain) or 'null'}[r];"
+        f"[0:v]{','.join(dist_chain)}[d];"
+        f"[d]split=2[d1][d2];"
+        f"[r]split=2[r1][r2];"
+        f"[d1][r1]libvmaf{'=' + vmaf_opts if vmaf_opts else ''};"
+        f"[d2][r2]ssim"
+    )
+
+
+def parse_vmaf_stderr(text):
+    """Pull (vmaf, ssim) strings out of ffmpeg's libvmaf/ssim summary lines."""
+    vmaf_score, ssim_score = "N/A", "N/A"
+    for line_str in text.splitlines():
+        if "VMAF score:" in line_str:
+            vmaf_score = line_str.split("VMAF score:")[1].strip()
+        if "SSIM Y:" in line_str and "All:" in line_str:
+            try:
+                ssim_score = line_str.split("All:")[1].split(" ")[0]
+            except: pass
+    return vmaf_score, ssim_score
+
+
+async def measure_vmaf(dist_file, ref_file, crop_val, ref_w, ref_h, ref_seek_args=(), threads=0, vmaf_opts=""):
+    """
+    Score a short distorted clip against the matching slice of *ref_file*
+    (selected with input-side -ss/-t in *ref_seek_args*).
+    Returns (vmaf, ssim) as strings, "N/A" when the run fails.
+    """
+    cmd = [
+        "ffmpeg", "-threads", str(threads),
+        "-i", dist_file, *ref_seek_args, "-i", ref_file,
+        "-filter_complex", vmaf_filter_graph(crop_val, ref_w, ref_h, vmaf_opts=vmaf_opts),
+        "-nostats", "-f", "null", "-"
+    ]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        _, stderr = await proc.communicate()
+        return parse_vmaf_stderr(stderr.decode('utf-8', errors='ignore'))
+    except Exception:
+        return "N/A", "N/A"
+
+
+async def get_vmaf(output_file, crop_val, width, height, duration, fps, kv_writer=None, ref_offset=0.0):
     """
     Runs VMAF + SSIM analysis.
 
@@ -82,13 +294,157 @@ async def get_vmaf(output_file, crop_val, width, height, duration, fps, kv_write
                Receives the same progress_ key format used during encoding,
                but with phase="vmaf" so /p can render the correct box.
                If None, progress updates are silently skipped (no TG edits).
+    ref_offset: where output_file starts in config.SOURCE (demo slices).
+
+    Returns (vmaf, ssim, summary): pooled scores as strings ("N/A" on
+    failure) and the frame-level metrics.summarize() dict (or None).
     """
-    ref_w, ref_h = width, height
-    if crop_val:
+    # Same bytes on both sides + same crop/window layout → same numbers
+    try:
+        key = metrics.cache_key(
+            file_fingerprint(output_file), file_fingerprint(config.SOURCE), crop_val,
+            config.VMAF_MODE, config.VMAF_WINDOWS, config.VMAF_WINDOW_SECONDS,
+            config.VMAF_N_SUBSAMPLE, round(duration, 3), round(ref_offset, 3),
+        )
+    except OSError:
+        key = None
+    cached = metrics.cache_load(key) if key else None
+    if cached:
+        return cached["vmaf"], cached["ssim"], cached.get("summary")
+
+    if config.VMAF_MODE == "select":
+        result = await _get_vmaf_select(output_file, crop_val, width, height, duration, fps, kv_writer)
+    else:
+        result = await get_vmaf_segments(output_file, crop_val, width, height, duration, fps, kv_writer, ref_offset)
+    if key and result[0] != "N/A":
+        metrics.cache_store(key, {"vmaf": result[0], "ssim": result[1], "summary": result[2]})
+    return result
+
+
+def vmaf_windows(duration, count, length):
+    """*count* windows of *length* seconds, each centred in an equal slice."""
+    interval = duration / count
+    length   = min(length, interval)
+    return [(max(0.0, i * interval + interval / 2 - length / 2), length) for i in range(count)]
+
+
+def pool_scores(scores):
+    """
+    Frame-weighted mean of per-window/per-chunk scores
+    ([{"frames", "vmaf", "ssim"}]), formatted like libvmaf's summary.
+    """
+    scores = [s for s in scores if s.get("vmaf") is not None]
+    if not scores:
+        return "N/A", "N/A"
+    frames = sum(s["frames"] for s in scores)
+    vmaf   = sum(s["vmaf"] * s["frames"] for s in scores) / frames
+    ssim_s = [s for s in scores if s.get("ssim") is not None]
+    if not ssim_s:
+        return f"{vmaf:.6f}", "N/A"
+    ssim = sum(s["ssim"] * s["frames"] for s in ssim_s) / sum(s["frames"] for s in ssim_s)
+    return f"{vmaf:.6f}", f"{ssim:.6f}"
+
+
+async def get_vmaf_segments(output_file, crop_val, width, height, duration, fps, kv_writer=None, ref_offset=0.0):
+    """
+    VMAF_MODE=segments: seek straight to each window with input-side -ss/-t
+    on both files, so only ~VMAF_WINDOWS x VMAF_WINDOW_SECONDS of video is
+    decoded. Windows are scored by parallel ffmpeg processes and pooled
+    weighted by frame count.
+    """
+    ref_w, ref_h = vmaf_reference_dims(crop_val, width, height)
+    windows      = vmaf_windows(duration, max(1, config.VMAF_WINDOWS), config.VMAF_WINDOW_SECONDS)
+    threads      = max(1, config.VMAF_THREADS)
+    jobs         = max(1, min(len(windows), effective_cpus() // threads))
+    vmaf_opts    = f"n_threads={threads}" + (
+        f":n_subsample={config.VMAF_N_SUBSAMPLE}" if config.VMAF_N_SUBSAMPLE > 1 else ""
+    )
+    log_paths    = [metrics.log_path(f"w{i:02d}") for i in range(len(windows))]
+    semaphore    = asyncio.Semaphore(jobs)
+    total_frames = max(1, int(sum(length for _, length in windows) * fps))
+    done_frames  = [0] * len(windows)
+    start_time   = time.time()
+    last_write   = 0
+
+    async def _report():
+        nonlocal last_write
+        now = time.time()
+        if not kv_writer or now - last_write <= 5:
+            return
+        curr_frame = sum(done_frames)
+        elapsed    = now - start_time
+        speed      = curr_frame / elapsed if elapsed > 0 else 0
+        eta        = (total_frames - curr_frame) / speed if speed > 0 else 0
+        await kv_writer({
+            "phase":        "vmaf",
+            "file":         output_file,
+            "run_id":       config.GITHUB_RUN_ID,
+            "vmaf_percent": round(min(100.0, curr_frame / total_frames * 100), 1),
+            "fps":          int(speed),
+            "elapsed":      int(elapsed),
+            "eta":          int(eta),
+            "ts":           int(now),
+        })
+        last_write = now
+
+    async def _score(idx, start, length):
+        cmd = [
+            "ffmpeg", "-threads", str(threads),
+            "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", output_file,
+            "-ss", f"{start + ref_offset:.3f}", "-t", f"{length:.3f}", "-i", config.SOURCE,
+            "-filter_complex", vmaf_filter_graph(
+                crop_val, ref_w, ref_h,
+                vmaf_opts=f"{vmaf_opts}:log_fmt=json:log_path={log_paths[idx]}",
+            ),
+            "-progress", "pipe:1", "-nostats", "-f", "null", "-"
+        ]
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            stderr_task = asyncio.create_task(proc.stderr.read())
+            async for line in proc.stdout:
+                line_str = line.decode().strip()
+                if line_str.startswith("frame="):
+                    try:
+                        done_frames[idx] = int(line_str.split("=")[1].strip())
+                        await _report()
+                    except ValueError:
+                        pass
+            await proc.wait()
+            stderr = (await stderr_task).decode('utf-8', errors='ignore')
+
+        vmaf, ssim = parse_vmaf_stderr(stderr)
         try:
-            parts        = crop_val.split(':')
-            ref_w, ref_h = parts[0], parts[1]
-        except: pass
+            return {
+                "frames": done_frames[idx] or max(1, int(length * fps)),
+                "vmaf":   float(vmaf),
+                "ssim":   float(ssim) if ssim != "N/A" else None,
+            }
+        except ValueError:
+            print(f"[vmaf] Window {idx} @ {start:.0f}s failed (rc={proc.returncode})")
+            return {"frames": 0, "vmaf": None, "ssim": None}
+
+    try:
+        scores = await asyncio.gather(*(_score(i, s, l) for i, (s, l) in enumerate(windows)))
+    except Exception as e:
+        print(f"[vmaf] Segment scoring failed: {e}")
+        return "N/A", "N/A", None
+    print(f"[vmaf] {sum(1 for s in scores if s['vmaf'] is not None)}/{len(windows)} windows "
+          f"| {jobs} job(s) x n_threads={threads} | {time.time() - start_time:.1f}s")
+    summary = metrics.summarize([
+        {"start": start, "duration": length, "frames": metrics.window_frames(path, start, fps)}
+        for (start, length), path in zip(windows, log_paths)
+    ])
+    return (*pool_scores(scores), summary)
+
+
+async def _get_vmaf_select(output_file, crop_val, width, height, duration, fps, kv_writer=None):
+    """
+    VMAF_MODE=select: one ffmpeg over both full-length inputs, a select=
+    filter keeps six 5 s windows. Every frame is still decoded.
+    """
+    ref_w, ref_h = vmaf_reference_dims(crop_val, width, height)
 
     interval       = duration / 6
     select_parts   = [
@@ -97,20 +453,12 @@ async def get_vmaf(output_file, crop_val, width, height, duration, fps, kv_write
     ]
     select_filter   = f"select='{'+'.join(select_parts)}',setpts=N/FRAME_RATE/TB"
     total_vmaf_frames = int(30 * fps)
-    ref_filters     = f"crop={crop_val},{select_filter}" if crop_val else select_filter
-    dist_filters    = f"{select_filter},scale={ref_w}:{ref_h}:flags=bicubic"
-
-    filter_graph = (
-        f"[1:v]{ref_filters}[r];"
-        f"[0:v]{dist_filters}[d];"
-        f"[d]split=2[d1][d2];"
-        f"[r]split=2[r1][r2];"
-        f"[d1][r1]libvmaf;"
-        f"[d2][r2]ssim"
-    )
+    log_file        = metrics.log_path("select")
+    filter_graph    = vmaf_filter_graph(crop_val, ref_w, ref_h, select_filter,
+                                        vmaf_opts=f"log_fmt=json:log_path={log_file}")
 
     cmd = [
-        "ffmpeg", "-threads", "0",
+        "ffmpeg", "-threads", str(effective_cpus()),
         "-i", output_file, "-i", config.SOURCE,
         "-filter_complex", filter_graph,
         "-progress", "pipe:1", "-nostats", "-f", "null", "-"
@@ -169,10 +517,26 @@ async def get_vmaf(output_file, crop_val, width, height, duration, fps, kv_write
 
         await asyncio.gather(read_progress(), read_stderr())
         await proc.wait()
-        return vmaf_score, ssim_score
+
+        # select= renumbers frames back to back: window k holds frames
+        # [k*per_window, (k+1)*per_window) of the log
+        per_window = max(1, int(5 * fps))
+        frames     = metrics.load_frame_scores(log_file)
+        summary    = metrics.summarize([
+            {
+                "start":    (k * interval) + (interval / 2) - 2.5,
+                "duration": 5.0,
+                "frames":   [
+                    ((k * interval) + (interval / 2) - 2.5 + (num - k * per_window) / fps, v)
+                    for num, v in frames if num // per_window == k
+                ],
+            }
+            for k in range(6)
+        ])
+        return vmaf_score, ssim_score, summary
 
     except:
-        return "N/A", "N/A"
+        return "N/A", "N/A", None
 
 
 def select_params(height):
@@ -182,6 +546,130 @@ def select_params(height):
     return 24, 4
 
 
+# ---------------------------------------------------------------------------
+# TELEGRAM SPLIT — cut an oversize MKV into sub-2 GB, self-contained parts
+# ---------------------------------------------------------------------------
+async def split_for_telegram(filepath, part_mb=None):
+    """
+    mkvmerge --split size: starts every part on a keyframe and writes full
+    headers, so each part plays on its own. Returns the part paths in order,
+    or [] when mkvmerge fails.
+    """
+    part_mb   = part_mb or config.TG_SPLIT_MB
+    stem, ext = os.path.splitext(filepath)
+    ext       = ext or ".mkv"
+    part_name = lambda n: f"{stem}.part{n}{ext}"
+    # mkvmerge fills %d with the part number; a literal % in the name is %%
+    pattern   = f"{stem.replace('%', '%%')}.part%d{ext.replace('%', '%%')}"
+    started   = time.time()
+    proc = await asyncio.create_subprocess_exec(
+        "mkvmerge", "-q", "-o", pattern, "--split", f"size:{part_mb}M", filepath,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    out, err = await proc.communicate()
+    parts, n = [], 1
+    while os.path.exists(part_name(n)):
+        parts.append(part_name(n))
+        n += 1
+    # mkvmerge exits 1 on warnings — only a missing output counts as failure
+    if proc.returncode not in (0, 1) or not parts:
+        print(f"[split] mkvmerge failed: {(out + err).decode(errors='ignore').strip()[-200:]}")
+        for p in parts:
+            os.remove(p)
+        return []
+    print(f"[split] {os.path.basename(filepath)} → {len(parts)} parts ≤ {part_mb} MB "
+          f"in {time.time() - started:.1f}s")
+    return parts
+
+
+# ---------------------------------------------------------------------------
+# CLOUD UPLOAD — in-process aiohttp, one pooled session per run
+# ---------------------------------------------------------------------------
+_http_session = None
+
+
+async def http_session():
+    """Shared aiohttp session (connection reuse across server lookup + uploads)."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        import aiohttp
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=8, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=config.CLOUD_CONNECT_TIMEOUT,
+                sock_read=config.CLOUD_READ_TIMEOUT,
+            ),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def _multipart_parts(boundary, fields, file_field, filepath):
+    """(head bytes, tail bytes) around the raw file content."""
+    head = b""
+    for name, value in fields:
+        head += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    filename = os.path.basename(filepath).replace('"', "'")
+    head += (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head, tail
+
+
+async def _multipart_body(head, tail, filepath, on_bytes):
+    """Stream head → file in CLOUD_CHUNK_MB reads → tail, reporting file bytes sent."""
+    chunk = max(64 * 1024, int(config.CLOUD_CHUNK_MB * 1024 * 1024))
+    yield head
+    sent = 0
+    with open(filepath, "rb") as f:
+        while True:
+            data = await asyncio.to_thread(f.read, chunk)
+            if not data:
+                break
+            yield data
+            sent += len(data)
+            if on_bytes:
+                await on_bytes(sent)
+    yield tail
+
+
+async def post_file(url, filepath, file_field="file", fields=(), on_bytes=None):
+    """
+    multipart/form-data POST of *filepath* with an exact Content-Length (no
+    chunked transfer encoding). on_bytes: async callable(file_bytes_sent).
+    Returns the response body as text; raises on HTTP errors.
+    """
+    boundary   = f"----av1enc{os.urandom(12).hex()}"
+    head, tail = _multipart_parts(boundary, fields, file_field, filepath)
+    length     = len(head) + os.path.getsize(filepath) + len(tail)
+    session    = await http_session()
+    async with session.post(
+        url,
+        data=_multipart_body(head, tail, filepath, on_bytes),
+        headers={
+            "Content-Type":   f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(length),
+        },
+    ) as resp:
+        text = await resp.text()
+        if resp.status >= 400:
+            raise ValueError(f"HTTP {resp.status}: {text[:200]}")
+        return text
+
 
 async def upload_to_cloud(filepath, app=None, chat_id=None, status_msg=None):
     """
@@ -195,12 +683,9 @@ async def upload_to_cloud(filepath, app=None, chat_id=None, status_msg=None):
 
     # ── Step 1: Get best upload server ──────────────────────────────────────
     try:
-        server_proc = await asyncio.create_subprocess_exec(
-            "curl", "-s", "https://api.gofile.io/servers",
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        server_out, _ = await server_proc.communicate()
-        server_data   = json.loads(server_out.decode())
+        session = await http_session()
+        async with session.get(f"{config.GOFILE_API_URL}/servers") as resp:
+            server_data = await resp.json(content_type=None)
 
         if server_data.get("status") != "ok":
             raise ValueError(f"Gofile server API error: {server_data}")
@@ -213,66 +698,47 @@ async def upload_to_cloud(filepath, app=None, chat_id=None, status_msg=None):
 
     # ── Step 2: Upload file with progress ───────────────────────────────────
     try:
-        file_size     = os.path.getsize(filepath)
-        last_edit     = 0
-        last_pct      = -1
-        upload_proc   = await asyncio.create_subprocess_exec(
-            "curl", "-s",
-            "--progress-bar",
-            "-F", f"file=@{filepath}",
-            f"https://{server}.gofile.io/contents/uploadfile",
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        file_size = os.path.getsize(filepath)
+        last_edit = 0
+        last_pct  = -1
+        start_up  = time.time()
+
+        async def _on_bytes(uploaded_bytes):
+            nonlocal last_edit, last_pct
+            pct         = uploaded_bytes / file_size * 100 if file_size else 100.0
+            now         = time.time()
+            pct_crossed = int(pct // 5) * 5 > last_pct
+            time_due    = now - last_edit >= 30
+            if not (app and status_msg and (pct_crossed or time_due)):
+                return
+            last_pct  = int(pct // 5) * 5
+            last_edit = now
+            elapsed   = now - start_up
+            speed_mbs = (uploaded_bytes / elapsed) / (1024*1024) if elapsed > 0 else 0
+            eta       = ((file_size - uploaded_bytes) / (uploaded_bytes / elapsed)) if uploaded_bytes > 0 and elapsed > 0 else 0
+            from ui import generate_progress_bar, format_time
+            bar = generate_progress_bar(pct)
+            ui  = (
+                f"<code>┌─── ☁️ [ GOFILE.UPLINK ] ───────────┐\n"
+                f"│                                    \n"
+                f"│ 📂 FILE: {filename}\n"
+                f"│ 📊 PROG: {bar} {pct:.1f}%\n"
+                f"│ 📦 SIZE: {uploaded_bytes/(1024*1024):.1f} / {file_size/(1024*1024):.1f} MB\n"
+                f"│ ⚡ SPEED: {speed_mbs:.2f} MB/s\n"
+                f"│ ⏳ ETA: {format_time(eta)}\n"
+                f"│                                    \n"
+                f"└────────────────────────────────────┘</code>"
+            )
+            import tg_scheduler
+            await tg_scheduler.edit_text(app, chat_id, status_msg.id, ui,
+                                         priority=tg_scheduler.PRIORITY_PROGRESS)
+
+        upload_out  = await post_file(
+            config.GOFILE_UPLOAD_URL.format(server=server), filepath,
+            file_field="file", on_bytes=_on_bytes,
         )
-
-        # Read stderr for curl progress while stdout accumulates JSON response
-        uploaded_bytes = 0
-        start_up       = time.time()
-
-        async def _read_progress():
-            nonlocal uploaded_bytes, last_edit, last_pct
-            async for line in upload_proc.stderr:
-                # curl --progress-bar writes lines like: "##  3.1%  ..."
-                text = line.decode("utf-8", errors="ignore").strip()
-                # parse percentage from curl progress output
-                parts = text.split()
-                for part in parts:
-                    if part.endswith("%"):
-                        try:
-                            pct = float(part.rstrip("%"))
-                            uploaded_bytes = int(file_size * pct / 100)
-                            now         = time.time()
-                            pct_crossed = int(pct // 5) * 5 > last_pct
-                            time_due    = now - last_edit >= 30
-                            if app and status_msg and (pct_crossed or time_due):
-                                last_pct  = int(pct // 5) * 5
-                                elapsed   = now - start_up
-                                speed_mbs = (uploaded_bytes / elapsed) / (1024*1024) if elapsed > 0 else 0
-                                eta       = ((file_size - uploaded_bytes) / (uploaded_bytes / elapsed)) if uploaded_bytes > 0 else 0
-                                from ui import generate_progress_bar, format_time
-                                bar = generate_progress_bar(pct)
-                                ui  = (
-                                    f"<code>┌─── ☁️ [ GOFILE.UPLINK ] ───────────┐\n"
-                                    f"│                                    \n"
-                                    f"│ 📂 FILE: {os.path.basename(filepath)}\n"
-                                    f"│ 📊 PROG: {bar} {pct:.1f}%\n"
-                                    f"│ 📦 SIZE: {uploaded_bytes/(1024*1024):.1f} / {file_size/(1024*1024):.1f} MB\n"
-                                    f"│ ⚡ SPEED: {speed_mbs:.2f} MB/s\n"
-                                    f"│ ⏳ ETA: {format_time(eta)}\n"
-                                    f"│                                    \n"
-                                    f"└────────────────────────────────────┘</code>"
-                                )
-                                try:
-                                    from pyrogram import enums as _enums
-                                    await app.edit_message_text(chat_id, status_msg.id, ui, parse_mode=_enums.ParseMode.HTML)
-                                    last_edit = now
-                                except Exception:
-                                    pass
-                        except ValueError:
-                            pass
-
-        await asyncio.gather(_read_progress(), asyncio.shield(upload_proc.wait()))
-        upload_out = await upload_proc.stdout.read()
-        upload_data   = json.loads(upload_out.decode())
+        upload_data = json.loads(upload_out)
+        print(f"[Gofile] {file_size/(1024*1024):.1f} MB in {time.time() - start_up:.1f}s")
 
         if upload_data.get("status") != "ok":
             raise ValueError(f"Gofile upload error: {upload_data}")
@@ -280,9 +746,9 @@ async def upload_to_cloud(filepath, app=None, chat_id=None, status_msg=None):
         file_id    = upload_data["data"]["id"]
         page_url   = upload_data["data"]["downloadPage"]
 
-        # Direct link: https://{server}.gofile.io/download/web/{fileId}/{fileName}
-        encoded_name = quote(filename, safe="")
-        direct_url   = f"https://{server}.gofile.io/download/web/{file_id}/{encoded_name}"
+        # Direct link from GOFILE_DIRECT_URL, so a local stand-in gets its own host
+        direct_url = config.GOFILE_DIRECT_URL.format(server=server, id=file_id,
+                                                     name=quote(filename, safe=""))
 
         return {
             "direct": direct_url,
@@ -298,16 +764,10 @@ async def upload_to_cloud(filepath, app=None, chat_id=None, status_msg=None):
 async def _litterbox_fallback(filepath):
     """Fallback uploader: litterbox.catbox.moe — stable, no size cap under 1 GB."""
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "curl", "-s",
-            "-F", "reqtype=fileupload",
-            "-F", "time=72h",
-            "-F", f"fileToUpload=@{filepath}",
-            "https://litterbox.catbox.moe/resources/internals/api.php",
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        url       = stdout.decode().strip()
+        url = (await post_file(
+            config.LITTERBOX_URL, filepath, file_field="fileToUpload",
+            fields=[("reqtype", "fileupload"), ("time", "72h")],
+        )).strip()
         if url.startswith("https://"):
             return {"direct": url, "page": url, "source": "litterbox"}
     except Exception as e:
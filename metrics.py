@@ -0,0 +1,140 @@
+"""
+metrics.py — Frame-level VMAF summary
+libvmaf writes one JSON log per scoring run (log_fmt=json). This module turns
+those per-frame scores into the numbers a single mean hides:
+
+    {
+        "frames":        1440,
+        "mean":          94.21,
+        "harmonic_mean": 93.87,
+        "low_1":         78.40,     # 1st-percentile frame score
+        "low_5":         86.95,     # 5th-percentile frame score
+        "min":           61.02,
+        "windows": [{"start": 97.5, "duration": 5.0, "vmaf": 95.3}, ...],
+        "worst":   [{"ts": 731.4, "vmaf": 61.02}, ...],
+    }
+
+Timestamps are seconds into the encoded file.
+
+Finished analyses are also cached on disk (METRIC_CACHE_DIR) keyed by the
+content fingerprints of both files plus the crop and window layout, so a
+re-run on the same encode returns instantly.
+"""
+import hashlib
+import json
+import os
+
+import config
+
+
+def log_path(tag: str) -> str:
+    """Where a scoring run named *tag* writes its libvmaf JSON log."""
+    os.makedirs(config.VMAF_LOG_DIR, exist_ok=True)
+    return os.path.join(config.VMAF_LOG_DIR, f"vmaf_{tag}.json")
+
+
+def load_frame_scores(path: str) -> list[tuple[int, float]]:
+    """[(frameNum, vmaf)] from a libvmaf JSON log; [] if missing/unreadable."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    scores = []
+    for frame in data.get("frames", []):
+        vmaf = frame.get("metrics", {}).get("vmaf")
+        if vmaf is not None:
+            scores.append((int(frame.get("frameNum", len(scores))), float(vmaf)))
+    return scores
+
+
+def window_frames(path: str, start: float, fps: float) -> list[tuple[float, float]]:
+    """Per-frame (timestamp, vmaf) for a window whose first frame sits at *start*."""
+    return [(start + num / fps, vmaf) for num, vmaf in load_frame_scores(path)]
+
+
+def harmonic_mean(values: list[float]) -> float:
+    """libvmaf's harmonic mean: shifted by 1 so a zero-score frame stays finite."""
+    return len(values) / sum(1.0 / (v + 1.0) for v in values) - 1.0
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[idx]
+
+
+def summarize(windows: list[dict], worst: int | None = None) -> dict | None:
+    """
+    windows: [{"start", "duration", "frames": [(ts, vmaf), ...]}] — one per
+    scored window / chunk. Returns the summary dict above, or None when no
+    frame scores were logged.
+    """
+    worst  = config.VMAF_WORST_FRAMES if worst is None else worst
+    frames = [f for w in windows for f in w["frames"]]
+    if not frames:
+        return None
+    values = sorted(v for _, v in frames)
+    return {
+        "frames":        len(values),
+        "mean":          round(sum(values) / len(values), 2),
+        "harmonic_mean": round(harmonic_mean(values), 2),
+        "low_1":         round(percentile(values, 1), 2),
+        "low_5":         round(percentile(values, 5), 2),
+        "min":           round(values[0], 2),
+        "windows": [
+            {
+                "start":    round(w["start"], 2),
+                "duration": round(w["duration"], 2),
+                "vmaf":     round(sum(v for _, v in w["frames"]) / len(w["frames"]), 2),
+            }
+            for w in windows if w["frames"]
+        ],
+        "worst": [
+            {"ts": round(ts, 2), "vmaf": round(v, 2)}
+            for ts, v in sorted(frames, key=lambda f: f[1])[:worst]
+        ],
+    }
+
+
+def cleanup_logs():
+    if not os.path.isdir(config.VMAF_LOG_DIR):
+        return
+    for name in os.listdir(config.VMAF_LOG_DIR):
+        if name.startswith("vmaf_") and name.endswith(".json"):
+            os.remove(os.path.join(config.VMAF_LOG_DIR, name))
+
+
+# ---------------------------------------------------------------------------
+# METRIC CACHE
+# ---------------------------------------------------------------------------
+
+def cache_key(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def cache_load(key: str) -> dict | None:
+    if not config.METRIC_CACHE_DIR:
+        return None
+    path = os.path.join(config.METRIC_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        print(f"[metric-cache] miss {key[:12]}")
+        return None
+    print(f"[metric-cache] hit {key[:12]} → VMAF {entry.get('vmaf')}")
+    return entry
+
+
+def cache_store(key: str, entry: dict):
+    if not config.METRIC_CACHE_DIR:
+        return
+    try:
+        os.makedirs(config.METRIC_CACHE_DIR, exist_ok=True)
+        tmp = os.path.join(config.METRIC_CACHE_DIR, f"{key}.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, os.path.join(config.METRIC_CACHE_DIR, f"{key}.json"))
+        print(f"[metric-cache] stored {key[:12]}")
+    except OSError as e:
+        print(f"[metric-cache] Could not write: {e}")
@@ -0,0 +1,98 @@
+"""
+probe.py — Memoized ffprobe shared by every module
+One ffprobe per file per run: the parsed JSON (streams, format, chapters)
+is cached in memory keyed by (path, size, mtime), and optionally on disk in
+PROBE_CACHE_DIR so a later phase or re-run on the same file skips it too.
+A file that changes (e.g. a streamed source still growing) gets a new key
+and is probed again.
+"""
+import hashlib
+import json
+import os
+import subprocess
+
+import config
+
+_MEMO: dict[tuple, dict] = {}
+
+
+def _key(path: str) -> tuple[str, int, int]:
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _disk_path(key: tuple) -> str:
+    name = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+    return os.path.join(config.PROBE_CACHE_DIR, f"{name}.json")
+
+
+def probe(path: str) -> dict:
+    """
+    Full ffprobe result for *path*: {"streams": [...], "format": {...},
+    "chapters": [...]}. Raises like subprocess.check_output on failure.
+    """
+    key = _key(path)
+    if key in _MEMO:
+        return _MEMO[key]
+
+    if config.PROBE_CACHE_DIR and os.path.exists(_disk_path(key)):
+        try:
+            with open(_disk_path(key)) as f:
+                _MEMO[key] = json.load(f)
+            return _MEMO[key]
+        except (OSError, ValueError):
+            pass
+
+    cmd = [
+        "ffprobe", "-v", "quiet", "-print_format", "json",
+        "-show_streams", "-show_format", "-show_chapters",
+        os.path.abspath(path),
+    ]
+    data = json.loads(subprocess.check_output(cmd, stderr=subprocess.PIPE).decode())
+    data.setdefault("streams", [])
+    data.setdefault("format", {})
+    data.setdefault("chapters", [])
+    _MEMO[key] = data
+
+    if config.PROBE_CACHE_DIR:
+        try:
+            os.makedirs(config.PROBE_CACHE_DIR, exist_ok=True)
+            with open(_disk_path(key), "w") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"[probe] Could not write disk cache: {e}")
+    return data
+
+
+# ---------------------------------------------------------------------------
+# ACCESSORS
+# ---------------------------------------------------------------------------
+
+def _streams(path: str, codec_type: str) -> list[dict]:
+    return [s for s in probe(path)["streams"] if s.get("codec_type") == codec_type]
+
+
+def video_stream(path: str) -> dict:
+    """First video stream, or {} when there is none."""
+    streams = _streams(path, "video")
+    return streams[0] if streams else {}
+
+
+def audio_streams(path: str) -> list[dict]:
+    return _streams(path, "audio")
+
+
+def subtitle_streams(path: str) -> list[dict]:
+    return _streams(path, "subtitle")
+
+
+def format_info(path: str) -> dict:
+    return probe(path)["format"]
+
+
+def duration(path: str) -> float:
+    return float(format_info(path).get("duration", 0) or 0)
+
+
+def chapters(path: str) -> list[dict]:
+    return probe(path)["chapters"]
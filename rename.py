@@ -6,9 +6,9 @@ Generates structured filenames like:
 Also provides rich track info for the final Telegram report.
 """
 
-import json
 import re
-import subprocess
+
+import probe
 
 
 # ---------------------------------------------------------------------------
@@ -25,15 +25,8 @@ def get_track_info(source: str) -> tuple[list[dict], list[dict]]:
     Each subtitle track dict:
         index, lang, title, codec, forced, default
     """
-    cmd = [
-        "ffprobe", "-v", "quiet",
-        "-print_format", "json",
-        "-show_streams",
-        source
-    ]
     try:
-        raw = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
-        data = json.loads(raw)
+        data = probe.probe(source)
     except Exception as e:
         print(f"[rename] ffprobe failed: {e}")
         return [], []
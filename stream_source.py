@@ -0,0 +1,201 @@
+"""
+stream_source.py — Overlap the Telegram download with the encode
+tg_handler.py (STREAM_DOWNLOAD=true) writes the source sequentially into a
+growing file and keeps a small sidecar state file next to it:
+
+    source.mkv.stream.json
+        {"total": 4187562101, "written": 73400320,
+         "streamable": true, "done": false, "failed": false,
+         "pid": 4242, "updated": 1712345678.5}
+
+main.py sees the sidecar, waits until the container header and first
+clusters are on disk, then feeds the growing file into ffmpeg's stdin while
+the rest arrives. Containers that need the tail before playback can start
+(MP4 with the moov atom at the end) are flagged non-streamable and main.py
+falls back to waiting for the full download.
+
+The consumer never waits on a producer that is gone: a dead "pid" or no
+new bytes for STREAM_STALL_SECONDS raises RuntimeError, so a killed or
+hung download fails the encode instead of polling until the step timeout.
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+
+import config
+
+STATE_SUFFIX = ".stream.json"
+READ_CHUNK   = 4 * 1024 * 1024
+
+
+# ---------------------------------------------------------------------------
+# STATE SIDECAR
+# ---------------------------------------------------------------------------
+
+def state_path(path: str) -> str:
+    return path + STATE_SUFFIX
+
+
+def is_streaming(path: str) -> bool:
+    return os.path.exists(state_path(path))
+
+
+def write_state(path: str, **state):
+    """Atomic replace so a reader never sees half-written JSON."""
+    state.update(pid=os.getpid(), updated=time.time())
+    tmp = state_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path(path))
+
+
+def read_state(path: str) -> dict:
+    try:
+        with open(state_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ---------------------------------------------------------------------------
+# CONTAINER SNIFFING
+# ---------------------------------------------------------------------------
+
+def sniff_streamable(head: bytes) -> bool:
+    """
+    True when decoding can start from the first bytes alone.
+
+    Matroska/WebM: always (EBML header + Tracks precede the clusters).
+    MP4/MOV:       only when the top-level 'moov' box comes before 'mdat'.
+    Anything else: False — play safe and wait for the full file.
+    """
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return True
+
+    pos = 0
+    while pos + 8 <= len(head):
+        size, box = struct.unpack(">I4s", head[pos:pos + 8])
+        if size == 1 and pos + 16 <= len(head):
+            size = struct.unpack(">Q", head[pos + 8:pos + 16])[0]
+        if box == b"moov":
+            return True
+        if box == b"mdat" or size < 8:
+            return False
+        pos += size
+    return False
+
+
+# ---------------------------------------------------------------------------
+# CONSUMER SIDE (main.py)
+# ---------------------------------------------------------------------------
+
+def _producer_alive(pid: int | None) -> bool:
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass                 # exists, owned by someone else
+    return True
+
+
+class _Watchdog:
+    """Raises RuntimeError once the producer failed, died or stopped making progress."""
+
+    def __init__(self, path: str):
+        self.path    = path
+        self.written = -1
+        self.since   = time.monotonic()
+
+    def check(self, state: dict) -> dict:
+        if state.get("failed"):
+            raise RuntimeError("Telegram stream download failed.")
+        if state.get("done"):
+            return state
+        if not _producer_alive(state.get("pid")):
+            # It may have finished between our read and its exit
+            state = read_state(self.path)
+            if state.get("done"):
+                return state
+            raise RuntimeError(f"Telegram stream download (pid {state.get('pid')}) exited without finishing.")
+        now = time.monotonic()
+        if state.get("written", 0) != self.written:
+            self.written, self.since = state.get("written", 0), now
+        elif config.STREAM_STALL_SECONDS and now - self.since > config.STREAM_STALL_SECONDS:
+            raise RuntimeError(f"Telegram stream download stalled: no new data for "
+                               f"{config.STREAM_STALL_SECONDS}s at {self.written / 2**20:.0f} MB.")
+        return state
+
+
+async def wait_until_ready(path: str, min_bytes: int, poll: float = 1.0) -> dict:
+    """
+    Block until the encoder can start: a streamable container with at least
+    *min_bytes* on disk, or the download finished. Raises RuntimeError if
+    the producer failed, died or stalled.
+    """
+    announced = False
+    watchdog  = _Watchdog(path)
+    while True:
+        state = watchdog.check(read_state(path))
+        if state.get("done"):
+            return state
+        if state.get("streamable") and state.get("written", 0) >= min_bytes:
+            return state
+        if state.get("streamable") is False and not announced:
+            print("[stream] Container needs its tail (e.g. MP4 moov at end) — waiting for full download.")
+            announced = True
+        await asyncio.sleep(poll)
+
+
+async def wait_until_done(path: str, poll: float = 2.0) -> dict:
+    watchdog = _Watchdog(path)
+    while True:
+        state = watchdog.check(read_state(path))
+        if state.get("done"):
+            return state
+        await asyncio.sleep(poll)
+
+
+def available_fraction(path: str) -> float:
+    """Share of the file already on disk (1.0 when done or size unknown)."""
+    state = read_state(path)
+    if not state or state.get("done"):
+        return 1.0
+    total = state.get("total") or 0
+    return min(1.0, state.get("written", 0) / total) if total > 0 else 0.0
+
+
+async def feed_growing_file(path: str, writer: asyncio.StreamWriter, poll: float = 0.5):
+    """
+    Pipe *path* into *writer* (ffmpeg stdin) as it grows, never reading past
+    the producer's 'written' watermark, and close the pipe once the download
+    is done and fully forwarded.
+    """
+    sent     = 0
+    watchdog = _Watchdog(path)
+    try:
+        with open(path, "rb") as f:
+            while True:
+                state     = watchdog.check(read_state(path))
+                available = state.get("written", 0)
+                if sent < available:
+                    data = f.read(min(READ_CHUNK, available - sent))
+                    if data:
+                        writer.write(data)
+                        await writer.drain()
+                        sent += len(data)
+                        continue
+                if state.get("done") and sent >= available:
+                    break
+                await asyncio.sleep(poll)
+    except (BrokenPipeError, ConnectionResetError):
+        pass   # ffmpeg exited (cancel/crash) — its return code tells the story
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
@@ -0,0 +1,156 @@
+"""
+svt_tune.py — Core- and cgroup-aware SVT-AV1 thread/tile tuning
+Replaces the pinned lp=8:tile-columns=2:tile-rows=1 with settings derived
+from the CPU budget this process actually has (affinity mask and cgroup
+quota, not the host's core count) and the output resolution. Optionally
+runs a few seconds of calibration encode per candidate and keeps the
+fastest one.
+"""
+import asyncio
+import math
+import os
+import time
+
+import config
+
+
+# ---------------------------------------------------------------------------
+# CPU BUDGET
+# ---------------------------------------------------------------------------
+
+def _cgroup_quota_cpus() -> float | None:
+    """CPU quota from cgroup v2 cpu.max or v1 cfs_quota/cfs_period, if any."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read().strip())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read().strip())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def effective_cpus() -> int:
+    """Usable cores: affinity mask, further capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota_cpus()
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+# ---------------------------------------------------------------------------
+# CANDIDATES
+# ---------------------------------------------------------------------------
+
+def _base_tiles(height: int) -> tuple[int, int]:
+    """(tile-columns, tile-rows) as log2 values, scaled with resolution."""
+    if height >= 2000: return 2, 1
+    if height >= 1000: return 1, 0
+    return 0, 0
+
+
+def heuristic_config(cpus: int, height: int) -> dict:
+    cols, rows = _base_tiles(height)
+    if cpus >= 16 and height >= 1000:
+        cols += 1
+    return {"lp": cpus, "tile_columns": cols, "tile_rows": rows}
+
+
+def candidate_configs(cpus: int, height: int) -> list[dict]:
+    """A short list around the heuristic — calibration cost grows per entry."""
+    base  = heuristic_config(cpus, height)
+    cands = [base]
+    if cpus > 2:
+        cands.append({**base, "lp": max(1, cpus // 2)})
+    cands.append({**base, "tile_columns": base["tile_columns"] + 1})
+    if base["tile_columns"] > 0:
+        cands.append({**base, "tile_columns": base["tile_columns"] - 1})
+    return cands
+
+
+def params_string(cfg: dict) -> str:
+    return f"lp={cfg['lp']}:tile-columns={cfg['tile_columns']}:tile-rows={cfg['tile_rows']}"
+
+
+def tune_label(cfg: dict) -> str:
+    """Short human-readable summary for the encode UI and report."""
+    tiles = f"{2 ** cfg['tile_columns']}x{2 ** cfg['tile_rows']}"
+    label = f"lp={cfg['lp']} tiles={tiles} @ {cfg['cpus']} CPU"
+    if cfg.get("calibrated_fps"):
+        label += f" ({cfg['calibrated_fps']:.1f} fps cal)"
+    return label
+
+
+# ---------------------------------------------------------------------------
+# CALIBRATION
+# ---------------------------------------------------------------------------
+
+async def _calibrate_one(source: str, start: float, seconds: float,
+                         video_args: list[str], svt_params: str) -> float:
+    """Encode *seconds* of source to null and return frames per second."""
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", source,
+        "-map", "0:v:0", *video_args, "-svtav1-params", svt_params,
+        "-an", "-sn", "-progress", "pipe:1", "-nostats", "-f", "null", "-",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    t0     = time.time()
+    frames = 0
+    async for raw_line in proc.stdout:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if line.startswith("frame="):
+            try: frames = int(line.split("=")[1])
+            except ValueError: pass
+    await proc.wait()
+    elapsed = time.time() - t0
+    if proc.returncode != 0 or elapsed <= 0:
+        return 0.0
+    return frames / elapsed
+
+
+async def autotune(source: str, start: float, duration: float, height: int,
+                   video_args: list[str], svt_base: str) -> dict:
+    """
+    Pick lp / tile settings for this machine and resolution.
+
+    Returns {"lp", "tile_columns", "tile_rows", "cpus", "calibrated_fps"};
+    calibrated_fps is None unless SVT_CALIBRATE ran. Candidates are timed
+    one after another (never in parallel) so each sees the full CPU budget,
+    from a point 1/3 into the range to skip black intros.
+    """
+    cpus   = effective_cpus()
+    chosen = heuristic_config(cpus, height)
+
+    if config.SVT_CALIBRATE and duration > config.SVT_CALIBRATE_SECONDS * 2:
+        probe_at = start + duration / 3
+        results  = []
+        for cand in candidate_configs(cpus, height):
+            fps = await _calibrate_one(
+                source, probe_at, config.SVT_CALIBRATE_SECONDS, video_args,
+                f"{svt_base}:{params_string(cand)}",
+            )
+            print(f"[svt-tune] calibrate {params_string(cand)} → {fps:.1f} fps")
+            results.append((fps, cand))
+        best_fps, best = max(results, key=lambda r: r[0])
+        if best_fps > 0:
+            chosen = {**best, "calibrated_fps": best_fps}
+
+    chosen = {"calibrated_fps": None, **chosen, "cpus": cpus}
+    print(f"[svt-tune] {params_string(chosen)} | CPU budget {cpus} | height {height}"
+          + (f" | {chosen['calibrated_fps']:.1f} fps" if chosen["calibrated_fps"] else ""))
+    return chosen
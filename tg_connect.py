@@ -0,0 +1,238 @@
+"""
+tg_connect.py — Racing Telegram session connector
+connect_telegram() used to start the candidate sessions one after another,
+paying a full Client.start() handshake for each, and forgot every FloodWait
+once the run ended. connect() starts TG_CONNECT_RACE candidates at once,
+keeps the first that authenticates and stops the rest.
+
+A health record per session is kept in HEALTH_FILE, inside the cached
+tg_session_dir:
+
+    {"tg_session_dir/enc_session_C": {"last_ok": 1760000000.0, "auth_s": 1.42,
+                                      "flood_until": 0.0, "last_error": null}}
+
+Sessions still inside a recorded FloodWait are skipped up front; the rest
+race in the caller's lane-priority order. Only when every candidate is
+flooded does connect() sleep out the shortest wait, as before.
+"""
+import asyncio
+import json
+import os
+import time
+
+from pyrogram import Client, enums
+from pyrogram.errors import FloodWait
+
+import config
+import tg_scheduler
+
+HEALTH_FILE = os.path.join("tg_session_dir", "session_health.json")
+# The job's status message, so each phase edits it instead of posting a new one
+STATUS_FILE = "tg_status.json"
+
+
+def load_health() -> dict:
+    try:
+        with open(HEALTH_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_health(health: dict):
+    try:
+        os.makedirs(os.path.dirname(HEALTH_FILE), exist_ok=True)
+        tmp = HEALTH_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(health, f, indent=1)
+        os.replace(tmp, HEALTH_FILE)
+    except OSError as e:
+        print(f"[tg-connect] Could not write session health: {e}")
+
+
+def _order(session_names: list[str], health: dict) -> tuple[list[str], dict]:
+    """(usable names, {flooded name: seconds left})."""
+    now     = time.time()
+    flooded = {}
+    usable  = []
+    for name in session_names:
+        until = health.get(name, {}).get("flood_until", 0)
+        if until > now:
+            flooded[name] = until - now
+        else:
+            usable.append(name)
+    return usable, flooded
+
+
+def _client(session_name: str, client_kwargs: dict) -> Client:
+    return Client(session_name, api_id=config.API_ID, api_hash=config.API_HASH,
+                  bot_token=config.BOT_TOKEN, **client_kwargs)
+
+
+async def _try(session_name: str, health: dict, client_kwargs: dict):
+    client = _client(session_name, client_kwargs)
+    t0     = time.time()
+    record = health.setdefault(session_name, {})
+    try:
+        await client.start()
+    except asyncio.CancelledError:
+        # Lost the race mid-handshake — drop the half-open connection
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+        raise
+    except FloodWait as e:
+        record.update(flood_until=time.time() + e.value, last_error=f"FloodWait {e.value}s")
+        print(f"[tg-connect] FloodWait {e.value}s on '{session_name}'")
+        raise
+    except Exception as e:
+        record.update(last_error=str(e)[:200])
+        print(f"[tg-connect] Auth error on '{session_name}': {e}")
+        raise
+    record.update(last_ok=time.time(), auth_s=round(time.time() - t0, 2),
+                  flood_until=0.0, last_error=None)
+    return client
+
+
+async def _stop_quietly(client: Client):
+    try:
+        await client.stop()
+    except Exception:
+        pass
+
+
+async def _race(names: list[str], health: dict, client_kwargs: dict):
+    """First client to authenticate among *names*, or None."""
+    tasks  = {asyncio.create_task(_try(n, health, client_kwargs)): n for n in names}
+    winner = None
+    pending = set(tasks)
+    while pending and winner is None:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                if winner is None:
+                    winner = (task.result(), tasks[task])
+                else:
+                    await _stop_quietly(task.result())
+    for task in pending:
+        task.cancel()
+    if pending:
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        for r in results:
+            if isinstance(r, Client):
+                await _stop_quietly(r)
+    return winner
+
+
+async def connect(session_names: list[str], **client_kwargs):
+    """
+    Returns (app, session_name), or (None, None) when nothing authenticates.
+    client_kwargs go to every pyrogram Client (e.g. max_concurrent_transmissions).
+    """
+    health           = load_health()
+    usable, flooded  = _order(session_names, health)
+    width            = max(1, config.TG_CONNECT_RACE)
+    started          = time.time()
+    if flooded:
+        print(f"[tg-connect] Skipping {len(flooded)} session(s) still in FloodWait")
+
+    winner = None
+    try:
+        for i in range(0, len(usable), width):
+            batch  = usable[i:i + width]
+            winner = await _race(batch, health, client_kwargs)
+            if winner:
+                break
+
+        # Everything flooded (now or per the health file) — sleep out the shortest wait
+        if winner is None:
+            now     = time.time()
+            flooded = {n: r["flood_until"] - now for n, r in health.items()
+                       if n in session_names and r.get("flood_until", 0) > now}
+            if not flooded:
+                return None, None
+            best    = min(flooded, key=flooded.get)
+            attempt = 0
+            while winner is None:
+                attempt  += 1
+                wait_secs = max(0, health[best]["flood_until"] - time.time())
+                print(f"[tg-connect] All sessions flooded. Sleeping {wait_secs:.0f}s for '{best}' (attempt {attempt})...")
+                await asyncio.sleep(wait_secs + 5)
+                try:
+                    winner = (await _try(best, health, client_kwargs), best)
+                except FloodWait:
+                    continue
+                except Exception:
+                    return None, None
+    finally:
+        save_health(health)
+
+    app, name = winner
+    print(f"[tg-connect] Auth OK via '{name}' in {time.time() - started:.2f}s "
+          f"({health[name]['auth_s']}s handshake)")
+    return app, name
+
+
+# ---------------------------------------------------------------------------
+# STATUS MESSAGE — one per job, carried across download / encode / upload
+# ---------------------------------------------------------------------------
+def remember_status(chat_id: int, message_id: int):
+    try:
+        with open(STATUS_FILE, "w") as f:
+            json.dump({"chat_id": chat_id, "message_id": message_id}, f)
+    except OSError as e:
+        print(f"[tg-connect] Could not record status message: {e}")
+
+
+def load_status(chat_id: int) -> int | None:
+    """Message id of the status message an earlier phase left in *chat_id*."""
+    try:
+        with open(STATUS_FILE) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data.get("message_id") if data.get("chat_id") == chat_id else None
+
+
+def forget_status():
+    if os.path.exists(STATUS_FILE):
+        os.remove(STATUS_FILE)
+
+
+async def send_status(app, text: str, started: float):
+    """
+    Take over the status message an earlier phase left behind (or send a new
+    one) and log time-to-first-status since *started*.
+    """
+    if getattr(app, "is_gateway", False):
+        # The gateway owns the job's status message
+        status = await app.status(text)
+        print(f"[tg-connect] time-to-first-status {time.time() - started:.2f}s (gateway)")
+        return status
+
+    status     = None
+    carried_id = load_status(config.CHAT_ID)
+    if carried_id:
+        try:
+            status = await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.edit_message_text(config.CHAT_ID, carried_id, text,
+                                              parse_mode=enums.ParseMode.HTML),
+                priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+            )
+        except Exception as e:
+            if "MESSAGE_NOT_MODIFIED" in str(e):
+                status = await app.get_messages(config.CHAT_ID, carried_id)
+            else:
+                print(f"[tg-connect] Could not reuse status message {carried_id}: {e}")
+    if status is None:
+        status = await tg_scheduler.submit(
+            config.CHAT_ID,
+            lambda: app.send_message(config.CHAT_ID, text, parse_mode=enums.ParseMode.HTML),
+            priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+        )
+        remember_status(config.CHAT_ID, status.id)
+    print(f"[tg-connect] time-to-first-status {time.time() - started:.2f}s"
+          f"{' (carried over)' if carried_id and status.id == carried_id else ''}")
+    return status
@@ -0,0 +1,425 @@
+"""
+tg_gateway.py — One Telegram client for the whole job, shared over a Unix socket
+tg_handler.py, main.py, upload.py and tg_rename.py each start their own
+pyrogram Client, authenticate, post a status message and stop again. When
+the workflow starts this gateway first (TG_GATEWAY=true) it authenticates
+once, owns the job's status message, and serves every phase over
+TG_GATEWAY_SOCKET. All calls still go through tg_scheduler here, so pacing
+and FloodWait tracking cover the whole job instead of one phase.
+
+    python3 tg_gateway.py            # serve until "stop"
+    python3 tg_gateway.py stop       # ask a running gateway to shut down
+    python3 tg_gateway.py ping
+
+Protocol: one JSON object per line.
+    → {"id": 7, "op": "edit_text", "args": {...}}
+    ← {"id": 7, "progress": [current, total]}          (uploads / downloads)
+    ← {"id": 7, "ok": true, "result": ...}  |  {"id": 7, "ok": false, "error": "..."}
+
+connect_client() returns a GatewayApp — a stand-in for a started Client with
+the methods the entry points use (send_message, edit_message_text,
+edit_message_caption, delete_messages, send_document, stop) plus status(),
+download() and send_document_group() — or None when no gateway is running,
+in which case callers connect directly as before.
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from pyrogram import enums
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+import config
+import tg_connect
+import tg_scheduler
+
+LINE_LIMIT = 1 << 20      # captions + button rows fit comfortably
+
+
+def _markup(rows):
+    if not rows:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton(b["text"], url=b["url"]) for b in row] for row in rows])
+
+
+def _rows(markup):
+    if not markup:
+        return None
+    return [[{"text": b.text, "url": b.url} for b in row] for row in markup.inline_keyboard]
+
+
+# ---------------------------------------------------------------------------
+# LANE RESOLUTION — identical to main.py
+# ---------------------------------------------------------------------------
+ALL_LANES = [chr(ord("A") + i) for i in range(20)]
+
+def _resolve_session_names() -> list[str]:
+    run_number = int(os.environ.get("GITHUB_RUN_NUMBER", "0"))
+    lane = ALL_LANES[run_number % 20]
+    print(f"Gateway session lane: {lane} (run #{run_number})")
+    other_lanes = [l for l in ALL_LANES if l != lane]
+    sessions = []
+    sessions.append(f"tg_session_dir/enc_session_{lane}")
+    sessions.append(f"tg_session_dir/tg_dl_session_{lane}")
+    for other in other_lanes:
+        sessions.append(f"tg_session_dir/enc_session_{other}")
+        sessions.append(f"tg_session_dir/tg_dl_session_{other}")
+    sessions.append(config.SESSION_NAME)
+    return sessions
+
+
+# ---------------------------------------------------------------------------
+# SERVER
+# ---------------------------------------------------------------------------
+async def _op_status(state, args, emit):
+    app, text = state["app"], args["text"]
+    if state["status_id"]:
+        try:
+            await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.edit_message_text(config.CHAT_ID, state["status_id"], text,
+                                              parse_mode=enums.ParseMode.HTML),
+                priority=tg_scheduler.PRIORITY_CRITICAL, key=("edit", config.CHAT_ID, state["status_id"]),
+                wait=True,
+            )
+            return {"chat_id": config.CHAT_ID, "message_id": state["status_id"]}
+        except Exception as e:
+            if "MESSAGE_NOT_MODIFIED" in str(e):
+                return {"chat_id": config.CHAT_ID, "message_id": state["status_id"]}
+            print(f"[gateway] Status message {state['status_id']} unusable ({e}) — sending a new one")
+    msg = await tg_scheduler.submit(
+        config.CHAT_ID,
+        lambda: app.send_message(config.CHAT_ID, text, parse_mode=enums.ParseMode.HTML),
+        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+    )
+    state["status_id"] = msg.id
+    tg_connect.remember_status(config.CHAT_ID, msg.id)
+    return {"chat_id": config.CHAT_ID, "message_id": msg.id}
+
+
+async def _op_send_message(state, args, emit):
+    app = state["app"]
+    msg = await tg_scheduler.submit(
+        args["chat_id"],
+        lambda: app.send_message(args["chat_id"], args["text"], parse_mode=enums.ParseMode.HTML,
+                                 reply_markup=_markup(args.get("buttons")),
+                                 reply_to_message_id=args.get("reply_to")),
+        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+    )
+    return msg.id
+
+
+async def _op_edit_text(state, args, emit):
+    app = state["app"]
+    await tg_scheduler.submit(
+        args["chat_id"],
+        lambda: app.edit_message_text(args["chat_id"], args["message_id"], args["text"],
+                                      parse_mode=enums.ParseMode.HTML,
+                                      reply_markup=_markup(args.get("buttons"))),
+        priority=args.get("priority", tg_scheduler.PRIORITY_NORMAL),
+        key=("edit", args["chat_id"], args["message_id"]), wait=True,
+    )
+
+
+async def _op_edit_caption(state, args, emit):
+    app = state["app"]
+    await tg_scheduler.submit(
+        args["chat_id"],
+        lambda: app.edit_message_caption(args["chat_id"], args["message_id"], args["caption"],
+                                         parse_mode=enums.ParseMode.HTML,
+                                         reply_markup=_markup(args.get("buttons"))),
+        priority=tg_scheduler.PRIORITY_CRITICAL, key=("caption", args["chat_id"], args["message_id"]),
+        wait=True,
+    )
+
+
+async def _op_delete(state, args, emit):
+    await state["app"].delete_messages(args["chat_id"], args["message_ids"])
+    if state["status_id"] in args["message_ids"]:
+        state["status_id"] = None
+        tg_connect.forget_status()
+
+
+async def _op_send_document(state, args, emit):
+    from tg_upload import send_document_fast
+    msg = await send_document_fast(
+        state["app"], args["chat_id"], args["path"], thumb=args.get("thumb"),
+        caption=args.get("caption", ""), parse_mode=enums.ParseMode.HTML,
+        reply_markup=_markup(args.get("buttons")), progress=emit,
+    )
+    return msg.id if msg else None
+
+
+async def _op_send_document_group(state, args, emit):
+    from tg_upload import send_document_group
+    msgs = await send_document_group(
+        state["app"], args["chat_id"], args["paths"], thumb=args.get("thumb"),
+        caption=args.get("caption", ""), parse_mode=enums.ParseMode.HTML, progress=emit,
+    )
+    return [m.id for m in msgs]
+
+
+async def _op_download(state, args, emit):
+    import tg_handler
+    # quiet: the caller reports progress itself (batch.py's board)
+    status = None if args.get("quiet") else SimpleNamespace(id=state["status_id"])
+    return await tg_handler.fetch_source(
+        state["app"], args["url"], config.CHAT_ID, status,
+        stream_mode=args.get("stream_mode", False), path=args["path"],
+    )
+
+
+async def _op_ping(state, args, emit):
+    return {"session": state["session"], "status_id": state["status_id"],
+            "uptime": round(time.time() - state["started"], 1), "counters": tg_scheduler.stats()}
+
+
+async def _op_shutdown(state, args, emit):
+    state["stop"].set()
+
+
+OPS = {
+    "ping":                _op_ping,
+    "status":              _op_status,
+    "send_message":        _op_send_message,
+    "edit_text":           _op_edit_text,
+    "edit_caption":        _op_edit_caption,
+    "delete":              _op_delete,
+    "send_document":       _op_send_document,
+    "send_document_group": _op_send_document_group,
+    "download":            _op_download,
+    "shutdown":            _op_shutdown,
+}
+
+
+async def _handle(state, reader, writer):
+    lock  = asyncio.Lock()
+    tasks = set()
+
+    async def _send(obj):
+        async with lock:
+            writer.write((json.dumps(obj) + "\n").encode())
+            await writer.drain()
+
+    async def _dispatch(req):
+        rid = req.get("id")
+
+        async def _emit(current, total, *_):
+            await _send({"id": rid, "progress": [current, total]})
+
+        try:
+            result = await OPS[req["op"]](state, req.get("args", {}), _emit)
+            await _send({"id": rid, "ok": True, "result": result})
+        except Exception as e:
+            print(f"[gateway] {req.get('op')} failed: {e}")
+            try:
+                await _send({"id": rid, "ok": False, "error": f"{type(e).__name__}: {e}"})
+            except (ConnectionError, RuntimeError):
+                pass
+
+    try:
+        async for line in reader:
+            try:
+                req = json.loads(line)
+            except ValueError:
+                continue
+            task = asyncio.create_task(_dispatch(req))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve():
+    started = time.time()
+    app, session = await tg_connect.connect(_resolve_session_names(), max_concurrent_transmissions=max(
+        int(os.environ.get("TG_DL_CONNECTIONS", "4") or 4), config.TG_UPLOAD_CONNECTIONS))
+    if app is None:
+        print("[gateway] TG auth failed: no usable session found.")
+        sys.exit(1)
+
+    state = {
+        "app":       app,
+        "session":   session,
+        "started":   started,
+        "status_id": tg_connect.load_status(config.CHAT_ID),
+        "stop":      asyncio.Event(),
+    }
+    if os.path.exists(config.TG_GATEWAY_SOCKET):
+        os.remove(config.TG_GATEWAY_SOCKET)
+    server = await asyncio.start_unix_server(
+        lambda r, w: _handle(state, r, w), path=config.TG_GATEWAY_SOCKET, limit=LINE_LIMIT,
+    )
+    print(f"[gateway] Serving on {config.TG_GATEWAY_SOCKET} via '{session}' "
+          f"({time.time() - started:.2f}s to ready)")
+    try:
+        await state["stop"].wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        if os.path.exists(config.TG_GATEWAY_SOCKET):
+            os.remove(config.TG_GATEWAY_SOCKET)
+        await tg_scheduler.flush()
+        await app.stop()
+        print(f"[gateway] Stopped after {time.time() - started:.0f}s")
+
+
+# ---------------------------------------------------------------------------
+# CLIENT
+# ---------------------------------------------------------------------------
+class GatewayApp:
+    """Stand-in for a started pyrogram Client, backed by a running gateway."""
+    is_gateway = True
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids    = itertools.count(1)
+        self._calls  = {}            # id → (future, progress callback)
+        self._pump   = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for line in self._reader:
+                msg = json.loads(line)
+                fut, on_progress = self._calls.get(msg.get("id"), (None, None))
+                if fut is None:
+                    continue
+                if "progress" in msg:
+                    if on_progress:
+                        await on_progress(*msg["progress"])
+                    continue
+                del self._calls[msg["id"]]
+                if msg.get("ok"):
+                    fut.set_result(msg.get("result"))
+                else:
+                    fut.set_exception(RuntimeError(msg.get("error", "gateway error")))
+        finally:
+            for fut, _ in self._calls.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("gateway connection closed"))
+            self._calls.clear()
+
+    async def _call(self, op, on_progress=None, **args):
+        rid = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[rid] = (fut, on_progress)
+        self._writer.write((json.dumps({"id": rid, "op": op, "args": args}) + "\n").encode())
+        await self._writer.drain()
+        return await fut
+
+    def _message(self, chat_id, message_id):
+        return SimpleNamespace(
+            id=message_id, chat_id=chat_id,
+            delete=lambda: self.delete_messages(chat_id, [message_id]),
+        )
+
+    @staticmethod
+    def _progress(progress, progress_args):
+        if not progress:
+            return None
+        return lambda current, total: progress(current, total, *progress_args)
+
+    async def status(self, text):
+        r = await self._call("status", text=text)
+        return self._message(r["chat_id"], r["message_id"])
+
+    async def download(self, url, stream_mode=False, path="source.mkv", quiet=False):
+        return await self._call("download", url=url, stream_mode=stream_mode,
+                                path=os.path.abspath(path), quiet=quiet)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None,
+                           reply_to_message_id=None):
+        mid = await self._call("send_message", chat_id=chat_id, text=text,
+                               buttons=_rows(reply_markup), reply_to=reply_to_message_id)
+        return self._message(chat_id, mid)
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None, reply_markup=None):
+        await self._call("edit_text", chat_id=chat_id, message_id=message_id, text=text,
+                         buttons=_rows(reply_markup))
+        return self._message(chat_id, message_id)
+
+    async def edit_message_caption(self, chat_id, message_id, caption, parse_mode=None, reply_markup=None):
+        await self._call("edit_caption", chat_id=chat_id, message_id=message_id, caption=caption,
+                         buttons=_rows(reply_markup))
+        return self._message(chat_id, message_id)
+
+    async def delete_messages(self, chat_id, message_ids):
+        await self._call("delete", chat_id=chat_id, message_ids=list(message_ids))
+
+    async def send_document(self, chat_id, document, thumb=None, caption="", parse_mode=None,
+                            reply_markup=None, progress=None, progress_args=()):
+        mid = await self._call(
+            "send_document", self._progress(progress, progress_args),
+            chat_id=chat_id, path=os.path.abspath(document),
+            thumb=os.path.abspath(thumb) if thumb else None,
+            caption=caption, buttons=_rows(reply_markup),
+        )
+        return self._message(chat_id, mid) if mid else None
+
+    async def send_document_group(self, chat_id, paths, thumb=None, caption="", parse_mode=None,
+                                  progress=None, progress_args=()):
+        ids = await self._call(
+            "send_document_group", self._progress(progress, progress_args),
+            chat_id=chat_id, paths=[os.path.abspath(p) for p in paths],
+            thumb=os.path.abspath(thumb) if thumb else None, caption=caption,
+        )
+        return [self._message(chat_id, mid) for mid in ids]
+
+    async def shutdown(self):
+        await self._call("shutdown")
+
+    async def stop(self):
+        """Close this phase's connection; the gateway keeps running."""
+        self._pump.cancel()
+        self._writer.close()
+
+
+async def connect_client(timeout: float = 3.0):
+    """GatewayApp when a gateway answers on TG_GATEWAY_SOCKET, else None."""
+    path = config.TG_GATEWAY_SOCKET
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(path, limit=LINE_LIMIT), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"[gateway] Socket present but unreachable ({e}) — connecting directly")
+        return None
+    gateway = GatewayApp(reader, writer)
+    try:
+        info = await asyncio.wait_for(gateway._call("ping"), timeout)
+    except Exception as e:
+        print(f"[gateway] No answer ({e}) — connecting directly")
+        await gateway.stop()
+        return None
+    print(f"[gateway] Using gateway (session '{info['session']}', up {info['uptime']}s)")
+    return gateway
+
+
+async def _cli(command: str):
+    if command == "serve":
+        await serve()
+        return
+    gateway = await connect_client()
+    if gateway is None:
+        print("[gateway] Not running.")
+        return
+    try:
+        if command == "stop":
+            await gateway.shutdown()
+            print("[gateway] Shutdown requested.")
+        else:
+            print(json.dumps(await gateway._call("ping"), indent=2))
+    finally:
+        await gateway.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli(sys.argv[1] if len(sys.argv) > 1 else "serve"))
@@ -3,15 +3,35 @@ import os
 import sys
 import time
 import traceback
-from pyrogram import Client, enums
+from pyrogram import Client, enums, raw
 from pyrogram.errors import FloodWait
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
 from ui import get_download_ui
+import stream_source
+import tg_scheduler
+import tg_connect
+import tg_gateway
+import tracing
+
+SOURCE_PATH = "./source.mkv"
+
+# Parallel downloader: stream_media() gives no control over connections
+# (newer pyrogram builds multiplex every range over one cached media session
+# per DC, older ones redo the DC handshake per call). parallel_download()
+# opens DL_CONNECTIONS media sessions to the file's DC itself, like
+# tg_upload.py, and gives each worker its own; if they can't be opened it
+# falls back to stream_media() ranges.
+DL_CONNECTIONS  = max(1, int(os.environ.get("TG_DL_CONNECTIONS", "4") or 4))
+DL_CHUNK        = 1024 * 1024          # stream_media() chunk size (fixed by Telegram)
+DL_MIN_SEGMENT  = 32                   # chunks — keeps per-session handshakes amortised
+DL_RETRIES      = 3
 
 async def progress(current, total, app, chat_id, message, start_time):
     if not hasattr(progress, "last_pct"):
         progress.last_pct = -1
 
-    if total <= 0:
+    if total <= 0 or message is None:
         return
 
     percent  = (current / total) * 100
@@ -28,12 +48,310 @@ async def progress(current, total, app, chat_id, message, start_time):
     eta         = (total - current) / speed_bytes if speed_bytes > 0 else 0
 
     ui_text = get_download_ui(percent, speed_mb, size_mb, elapsed, eta)
+    await tg_scheduler.edit_text(app, chat_id, message.id, ui_text,
+                                 priority=tg_scheduler.PRIORITY_PROGRESS)
+
+async def stream_to_file(app, media_ref, total, chat_id, status, start_time, path=SOURCE_PATH):
+    """
+    STREAM_DOWNLOAD mode: write the file sequentially into *path* and
+    keep the stream_source sidecar updated so main.py can start encoding
+    from the growing file. The first chunk decides whether the container
+    can be decoded from the front at all.
+    """
+    written    = 0
+    last_state = 0
+    last_beat  = time.time()
+    streamable = None
+    stream_source.write_state(path, total=total, written=0,
+                              streamable=None, done=False, failed=False)
+    try:
+        with open(path, "wb") as f:
+            async for chunk in app.stream_media(media_ref):
+                f.write(chunk)
+                f.flush()
+                written += len(chunk)
+                if streamable is None:
+                    streamable = stream_source.sniff_streamable(chunk)
+                    print(f"📡 Stream mode: container {'is' if streamable else 'is NOT'} streamable")
+                # Sidecar every 8 MB or 5 s — main.py polls, it doesn't need every chunk,
+                # but a slow download must still show progress to its stall check
+                if written - last_state >= 8 * 1024 * 1024 or time.time() - last_beat >= 5:
+                    stream_source.write_state(path, total=total, written=written,
+                                              streamable=streamable, done=False, failed=False)
+                    last_state, last_beat = written, time.time()
+                await progress(written, total, app, chat_id, status, start_time)
+    except BaseException:
+        # Cancellation and SystemExit too — main.py must never wait on a dead stream
+        stream_source.write_state(path, total=total, written=written,
+                                  streamable=streamable, done=False, failed=True)
+        raise
+    stream_source.write_state(path, total=written, written=written,
+                              streamable=streamable, done=True, failed=False)
+
+
+# ---------------------------------------------------------------------------
+# PEER / MESSAGE RESOLUTION — memoized so retries don't repeat get_chat +
+# get_messages round-trips
+# ---------------------------------------------------------------------------
+_resolved = {}
+
+async def resolve_message(app, target_chat, msg_id, refresh=False):
+    key = (target_chat, msg_id)
+    if key in _resolved and not refresh:
+        return _resolved[key]
+    for attempt in range(DL_RETRIES):
+        try:
+            if not refresh:
+                try:
+                    await app.get_chat(target_chat)
+                except Exception:
+                    pass
+            msg = await app.get_messages(target_chat, msg_id)
+            break
+        except FloodWait as e:
+            print(f"⏳ FloodWait resolving message: waiting {e.value}s")
+            await asyncio.sleep(e.value + 1)
+    else:
+        raise RuntimeError("could not resolve message after FloodWait retries")
+    _resolved[key] = msg
+    return msg
+
+
+# ---------------------------------------------------------------------------
+# PARALLEL DOWNLOAD — byte ranges fetched concurrently, pwrite()n into a
+# preallocated file
+# ---------------------------------------------------------------------------
+async def _open_download_sessions(app, dc_id: int, count: int) -> list:
+    """
+    Up to *count* started media sessions to *dc_id*. A foreign DC gets one
+    new auth key with our authorization imported; the sessions share it.
+    """
+    test_mode  = await app.storage.test_mode()
+    foreign    = dc_id != await app.storage.dc_id()
+    authorized = not foreign
+    sessions   = []
     try:
-        await app.edit_message_text(chat_id, message.id, ui_text, parse_mode=enums.ParseMode.HTML)
-    except FloodWait as e:
-        await asyncio.sleep(e.value + 1)
-    except Exception:
-        pass
+        auth_key = await Auth(app, dc_id, test_mode).create() if foreign else await app.storage.auth_key()
+        for _ in range(count):
+            session = Session(app, dc_id, auth_key, test_mode, is_media=True)
+            await session.start()
+            sessions.append(session)
+            if not authorized:
+                exported = await app.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                await session.invoke(raw.functions.auth.ImportAuthorization(
+                    id=exported.id, bytes=exported.bytes))
+                authorized = True
+    except Exception as e:
+        print(f"📥 Opened {len(sessions)}/{count} media session(s) to DC {dc_id}: {e}")
+        if not authorized:
+            await _close_sessions(sessions)
+            sessions = []
+    return sessions
+
+
+async def _close_sessions(sessions: list):
+    for session in sessions:
+        try:
+            await session.stop()
+        except Exception:
+            pass
+
+
+def _file_location(msg):
+    media = msg.video or msg.document or msg.audio
+    fid   = FileId.decode(media.file_id)
+    return fid.dc_id, raw.types.InputDocumentFileLocation(
+        id=fid.media_id, access_hash=fid.access_hash,
+        file_reference=fid.file_reference, thumb_size=fid.thumbnail_size,
+    )
+
+
+async def parallel_download(app, msg, total, chat_id, status, start_time, refresh=None, path=SOURCE_PATH):
+    """
+    Download *msg*'s media into *path* over DL_CONNECTIONS concurrent
+    ranges, one media session each. Each range retries from where it
+    stopped; *refresh* (optional coroutine) re-fetches the message when a
+    file reference expires.
+    """
+    chunks   = -(-total // DL_CHUNK)
+    seg_len  = max(DL_MIN_SEGMENT, -(-chunks // (DL_CONNECTIONS * 4)))
+    queue    = asyncio.Queue()
+    for first in range(0, chunks, seg_len):
+        queue.put_nowait((first, min(seg_len, chunks - first)))
+    done     = [0]
+    source   = [msg]
+
+    dc_id, location = _file_location(msg)
+    sessions = await _open_download_sessions(app, dc_id, DL_CONNECTIONS)
+    loc      = [location]
+    if not sessions:
+        print("📥 No dedicated media sessions — falling back to stream_media() ranges")
+
+    async def _range(w: int, offset: int, limit: int):
+        """Chunks [offset, offset + limit) over worker *w*'s own session."""
+        if not sessions:
+            async for chunk in app.stream_media(source[0], offset=offset, limit=limit):
+                yield chunk
+            return
+        session = sessions[w % len(sessions)]
+        for i in range(offset, offset + limit):
+            r = await session.invoke(raw.functions.upload.GetFile(
+                location=loc[0], offset=i * DL_CHUNK, limit=DL_CHUNK), sleep_threshold=30)
+            if not isinstance(r, raw.types.upload.File):
+                raise RuntimeError(f"unsupported GetFile reply {type(r).__name__} (CDN redirect?)")
+            if not r.bytes:
+                return
+            yield r.bytes
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, total)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, total)
+
+        async def _worker(w: int):
+            while True:
+                try:
+                    first, count = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                got = 0
+                for attempt in range(DL_RETRIES):
+                    try:
+                        async for chunk in _range(w, first + got, count - got):
+                            os.pwrite(fd, chunk, (first + got) * DL_CHUNK)
+                            got     += 1
+                            done[0] += len(chunk)
+                            await progress(done[0], total, app, chat_id, status, start_time)
+                        if got >= count:
+                            break
+                    except FloodWait as e:
+                        await asyncio.sleep(e.value + 1)
+                    except Exception as e:
+                        print(f"⚠️ Range @{first} chunk {got}/{count} failed: {e} (retry {attempt + 1}/{DL_RETRIES})")
+                        if refresh and "FILE_REFERENCE" in str(e):
+                            source[0] = await refresh()
+                            loc[0]    = _file_location(source[0])[1]
+                if got < count:
+                    raise RuntimeError(f"range @{first} incomplete ({got}/{count} chunks)")
+
+        workers = [asyncio.create_task(_worker(w)) for w in range(DL_CONNECTIONS)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # A failed range must not leave the others writing to fd (or a
+            # reused fd number) once it is closed below
+            for t in workers:
+                t.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        os.close(fd)
+        await _close_sessions(sessions)
+
+    elapsed = time.time() - start_time
+    transport = (f"{len(sessions)} media session(s) on DC {dc_id}" if sessions
+                 else "stream_media()")
+    print(f"📥 Parallel download: {total/(1024**2):.1f} MB in {elapsed:.1f}s "
+          f"({total/(1024**2)/max(elapsed, 1e-6):.2f} MB/s, {DL_CONNECTIONS} ranges over {transport})")
+
+
+async def fetch_source(app, url, chat_id, status, stream_mode=False, path=SOURCE_PATH):
+    """
+    Download the Telegram source named by *url* (t.me link or tg_file:<id>[|name])
+    into *path*, reporting progress on *status* (None = silent). Returns the
+    original file name.
+    Shared by main() below and the tg_gateway.py "download" op.
+    """
+    start_time = time.time()
+    final_name = "video.mkv"
+    progress.last_pct = -1
+
+    if "t.me/" in url:
+        link = url.rstrip("/")
+        parts = link.split("/")
+        
+        try:
+            msg_id = int(parts[-1].split("?")[0])
+        except (ValueError, IndexError):
+            raise RuntimeError("Could not parse Message ID from link.")
+        
+        if len(parts) >= 4 and parts[-3] == "c":
+            target_chat = int(f"-100{parts[-2]}")
+        else:
+            target_chat = parts[-2]
+        
+        msg = await resolve_message(app, target_chat, msg_id)
+        
+        if not msg or not msg.media:
+            if status:
+                await tg_scheduler.edit_text(app, chat_id, status.id, "❌ <b>ERROR: No media found in link.</b>",
+                                             priority=tg_scheduler.PRIORITY_CRITICAL, wait=True)
+            raise RuntimeError("No media found in link.")
+        
+        media = msg.video or msg.document or msg.audio
+        final_name = getattr(media, "file_name", "video.mkv")
+
+        if stream_mode:
+            # Name is known up front — publish it before the body arrives
+            with open("tg_fname.txt", "w", encoding="utf-8") as f:
+                f.write(final_name)
+            await stream_to_file(app, msg, getattr(media, "file_size", 0) or 0,
+                                 chat_id, status, start_time, path=path)
+        else:
+            size = getattr(media, "file_size", 0) or 0
+            try:
+                if size <= 0 or DL_CONNECTIONS == 1:
+                    raise RuntimeError("size unknown or single connection")
+                await parallel_download(
+                    app, msg, size, chat_id, status, start_time,
+                    refresh=lambda: resolve_message(app, target_chat, msg_id, refresh=True),
+                    path=path,
+                )
+            except Exception as e:
+                print(f"📥 Sequential download ({e})")
+                progress.last_pct = -1
+                msg = await resolve_message(app, target_chat, msg_id)
+                await app.download_media(
+                    msg, 
+                    file_name=path,
+                    progress=progress, 
+                    progress_args=(app, chat_id, status, start_time)
+                )
+
+    elif "tg_file:" in url:
+        raw_data = url.replace("tg_file:", "")
+        
+        if "|" in raw_data:
+            file_id, final_name = raw_data.split("|", 1)
+        else:
+            file_id = raw_data
+
+        if stream_mode:
+            with open("tg_fname.txt", "w", encoding="utf-8") as f:
+                f.write(final_name)
+            # Size is not recoverable from a bare file_id; progress stays silent
+            await stream_to_file(app, file_id.strip(), 0, chat_id, status, start_time, path=path)
+        else:
+            await app.download_media(
+                message=file_id.strip(), 
+                file_name=path,
+                progress=progress, 
+                progress_args=(app, chat_id, status, start_time)
+            )
+    
+    else:
+        if status:
+            await tg_scheduler.edit_text(app, chat_id, status.id, "❌ <b>ERROR: Unsupported URL format.</b>",
+                                         priority=tg_scheduler.PRIORITY_CRITICAL, wait=True)
+        raise RuntimeError("Unsupported URL format.")
+
+    return final_name
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else None
+
 
 async def main():
     try:
@@ -42,9 +360,28 @@ async def main():
         bot_token = os.environ.get("TG_BOT_TOKEN", "").strip()
         chat_id = int(os.environ.get("TG_CHAT_ID", "0").strip())
         url = os.environ.get("VIDEO_URL", "").strip()
+        stream_mode = os.environ.get("STREAM_DOWNLOAD", "false").strip().lower() == "true"
     except ValueError as e:
         print(f"CRITICAL: Invalid Environment Variables. {e}")
         sys.exit(1)
+
+    # A running tg_gateway.py already holds an authenticated client — hand it the job
+    gateway = await tg_gateway.connect_client()
+    if gateway:
+        try:
+            await gateway.status("📡 <b>[ SYSTEM.INIT ] Establishing Downlink...</b>")
+            with tracing.span("download", via="gateway", stream=stream_mode) as sp:
+                final_name = await gateway.download(url, stream_mode=stream_mode, path=SOURCE_PATH)
+                sp.set(bytes=_size(SOURCE_PATH))
+            await gateway.status("✅ <b>[ DOWNLOAD.COMPLETE ] Transferring to Encoder...</b>")
+            with open("tg_fname.txt", "w", encoding="utf-8") as f:
+                f.write(final_name)
+        except Exception as e:
+            print(f"FATAL ERROR during download: {e}")
+            sys.exit(1)
+        finally:
+            await gateway.stop()
+        return
     
     session_dir = "tg_session_dir"
     os.makedirs(session_dir, exist_ok=True)
@@ -58,18 +395,20 @@ async def main():
     session_path = os.path.join(session_dir, f"tg_dl_session_{lane}")
 
     try:
-        app = Client(session_path, api_id=api_id, api_hash=api_hash, bot_token=bot_token)
-        for _attempt in range(5):
-            try:
-                await app.start()
-                break
-            except FloodWait as e:
-                wait_secs = e.value + 5
-                print(f"⏳ FloodWait on auth: waiting {wait_secs}s (attempt {_attempt + 1}/5)")
-                await asyncio.sleep(wait_secs)
-        else:
-            print("❌ Could not authorize with Telegram after 5 attempts.")
-            sys.exit(1)
+        app = Client(session_path, api_id=api_id, api_hash=api_hash, bot_token=bot_token,
+                     max_concurrent_transmissions=DL_CONNECTIONS)
+        with tracing.span("tg_auth", session=f"tg_dl_session_{lane}"):
+            for _attempt in range(5):
+                try:
+                    await app.start()
+                    break
+                except FloodWait as e:
+                    wait_secs = e.value + 5
+                    print(f"⏳ FloodWait on auth: waiting {wait_secs}s (attempt {_attempt + 1}/5)")
+                    await asyncio.sleep(wait_secs)
+            else:
+                print("❌ Could not authorize with Telegram after 5 attempts.")
+                sys.exit(1)
 
         try:
             status = await app.send_message(
@@ -77,77 +416,26 @@ async def main():
                 "📡 <b>[ SYSTEM.INIT ] Establishing Downlink...</b>", 
                 parse_mode=enums.ParseMode.HTML
             )
-            
-            start_time = time.time()
-            final_name = "video.mkv"
+            # Later phases edit this message instead of posting their own
+            tg_connect.remember_status(chat_id, status.id)
 
-            if "t.me/" in url:
-                link = url.rstrip("/")
-                parts = link.split("/")
-                
-                try:
-                    msg_id = int(parts[-1].split("?")[0])
-                except (ValueError, IndexError):
-                    print("❌ Could not parse Message ID from link.")
-                    sys.exit(1)
-                
-                if len(parts) >= 4 and parts[-3] == "c":
-                    target_chat = int(f"-100{parts[-2]}")
-                else:
-                    target_chat = parts[-2]
-                
-                try: 
-                    await app.get_chat(target_chat)
-                except Exception: 
-                    pass
-                
-                msg = await app.get_messages(target_chat, msg_id)
-                
-                if not msg or not msg.media:
-                    await app.edit_message_text(chat_id, status.id, "❌ <b>ERROR: No media found in link.</b>", parse_mode=enums.ParseMode.HTML)
-                    sys.exit(1)
-                
-                media = msg.video or msg.document or msg.audio
-                final_name = getattr(media, "file_name", "video.mkv")
-                
-                await app.download_media(
-                    msg, 
-                    file_name="./source.mkv",
-                    progress=progress, 
-                    progress_args=(app, chat_id, status, start_time)
-                )
-
-            elif "tg_file:" in url:
-                raw_data = url.replace("tg_file:", "")
-                
-                if "|" in raw_data:
-                    file_id, final_name = raw_data.split("|", 1)
-                else:
-                    file_id = raw_data
-                
-                await app.download_media(
-                    message=file_id.strip(), 
-                    file_name="./source.mkv",
-                    progress=progress, 
-                    progress_args=(app, chat_id, status, start_time)
-                )
-            
-            else:
-                await app.edit_message_text(chat_id, status.id, "❌ <b>ERROR: Unsupported URL format.</b>", parse_mode=enums.ParseMode.HTML)
-                sys.exit(1)
+            with tracing.span("download", via="direct", stream=stream_mode,
+                              connections=DL_CONNECTIONS) as sp:
+                final_name = await fetch_source(app, url, chat_id, status, stream_mode)
+                sp.set(bytes=_size(SOURCE_PATH))
 
             # Keep phase changes directly in Telegram so you know when it moves to encode
-            await app.edit_message_text(
-                chat_id, 
-                status.id, 
-                "✅ <b>[ DOWNLOAD.COMPLETE ] Transferring to Encoder...</b>", 
-                parse_mode=enums.ParseMode.HTML
+            await tg_scheduler.edit_text(
+                app, chat_id, status.id,
+                "✅ <b>[ DOWNLOAD.COMPLETE ] Transferring to Encoder...</b>",
+                priority=tg_scheduler.PRIORITY_CRITICAL,
             )
             
             with open("tg_fname.txt", "w", encoding="utf-8") as f:
                 f.write(final_name)
 
         finally:
+            await tg_scheduler.flush()
             await app.stop()
 
     except Exception as e:
@@ -156,4 +444,7 @@ async def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        tracing.save("download")
@@ -22,7 +22,6 @@ Environment variables (set by rename.yml):
 """
 
 import asyncio
-import json
 import os
 import subprocess
 import sys
@@ -32,11 +31,16 @@ import traceback
 from pyrogram import Client, enums
 from pyrogram.errors import FloodWait
 
+import probe
+from tg_upload import send_document_fast
+import tg_scheduler
+import tg_gateway
+import tracing
 from rename import (
     get_track_info, detect_audio_type, detect_quality,
     build_output_name, format_track_report
 )
-from ui import get_download_ui, upload_progress, format_time
+from ui import get_download_ui, upload_progress, format_time, with_phase_report
 import ui as _ui
 
 # ── ENV ───────────────────────────────────────────────────────────────────────
@@ -83,15 +87,7 @@ def resolve_lane() -> str:
 # ── TELEGRAM HELPERS ──────────────────────────────────────────────────────────
 
 async def tg_edit(app, chat_id, msg_id, text, reply_markup=None):
-    try:
-        kwargs = dict(parse_mode=enums.ParseMode.HTML)
-        if reply_markup:
-            kwargs["reply_markup"] = reply_markup
-        await app.edit_message_text(chat_id, msg_id, text, **kwargs)
-    except FloodWait as e:
-        await asyncio.sleep(e.value + 1)
-    except Exception:
-        pass
+    await tg_scheduler.edit_text(app, chat_id, msg_id, text, reply_markup=reply_markup)
 
 async def dl_progress(current, total, app, chat_id, status_msg, start_time):
     if total <= 0: return
@@ -153,17 +149,9 @@ def probe_and_build_name() -> tuple[str, str, list, list]:
     else:
         audio_type_label = detect_audio_type(audio_tracks)
 
-    # Quality — read from actual video height via ffprobe
-    cmd = [
-        "ffprobe", "-v", "quiet", "-print_format", "json",
-        "-show_streams", "-select_streams", "v:0",
-        os.path.abspath(SOURCE_FILE)
-    ]
-    import json
+    # Quality — read from actual video height (same cached probe as above)
     try:
-        raw  = subprocess.check_output(cmd, stderr=subprocess.PIPE).decode()
-        data = json.loads(raw)
-        height = int(data["streams"][0].get("height", 1080))
+        height = int(probe.video_stream(SOURCE_FILE).get("height", 1080))
     except subprocess.CalledProcessError as e:
         print(f"[rename] ffprobe failed (rc={e.returncode}): {e.stderr.decode().strip()}")
         height = 1080
@@ -197,12 +185,9 @@ def capture_thumbnail(source: str) -> bool:
     Scales to 1280px wide (keeps AR), saves as JPEG.
     Returns True on success.
     """
-    # Get duration via ffprobe
+    # Get duration via the shared probe cache
     try:
-        cmd = ["ffprobe", "-v", "quiet", "-print_format", "json",
-               "-show_format", os.path.abspath(source)]
-        raw  = subprocess.check_output(cmd, stderr=subprocess.PIPE).decode()
-        duration = float(json.loads(raw)["format"].get("duration", 0))
+        duration = probe.duration(source)
     except Exception as e:
         print(f"[thumb] ffprobe duration failed: {e}")
         duration = 0
@@ -277,25 +262,32 @@ async def main():
 
     start_total = time.time()
 
-    app = Client(session_path, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-    for attempt in range(5):
-        try:
-            await app.start(); break
-        except FloodWait as e:
-            await asyncio.sleep(e.value + 5)
-    else:
-        print("❌ Could not authenticate with Telegram after 5 attempts."); sys.exit(1)
+    # A running tg_gateway.py already holds an authenticated client
+    with tracing.span("tg_connect") as sp:
+        app = await tg_gateway.connect_client()
+        sp.set(via="gateway" if app else "direct")
+        if app is None:
+            app = Client(session_path, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+            for attempt in range(5):
+                try:
+                    await app.start(); break
+                except FloodWait as e:
+                    await asyncio.sleep(e.value + 5)
+            else:
+                print("❌ Could not authenticate with Telegram after 5 attempts."); sys.exit(1)
 
     try:
-        status = await app.send_message(
-            CHAT_ID,
+        banner = (
             "<code>┌─── 🏷️  [ RENAME.MISSION ] ──────────┐\n"
             "│                                    \n"
             "│ 📡 Establishing Telegram downlink...\n"
             "│                                    \n"
-            "└────────────────────────────────────┘</code>",
-            parse_mode=enums.ParseMode.HTML
+            "└────────────────────────────────────┘</code>"
         )
+        if getattr(app, "is_gateway", False):
+            status = await app.status(banner)
+        else:
+            status = await app.send_message(CHAT_ID, banner, parse_mode=enums.ParseMode.HTML)
 
         # ── 1. DOWNLOAD ────────────────────────────────────────────────────
         await tg_edit(app, CHAT_ID, status.id,
@@ -304,7 +296,13 @@ async def main():
             "└────────────────────────────────────┘</code>")
 
         try:
-            orig_name = await download_from_tg(app, status)
+            with tracing.span("download") as sp:
+                if getattr(app, "is_gateway", False):
+                    orig_name = await app.download(VIDEO_URL, path=SOURCE_FILE)
+                else:
+                    orig_name = await download_from_tg(app, status)
+                if os.path.exists(SOURCE_FILE):
+                    sp.set(bytes=os.path.getsize(SOURCE_FILE))
         except Exception as e:
             await tg_edit(app, CHAT_ID, status.id,
                 f"<b>❌ DOWNLOAD FAILED:</b>\n<code>{e}</code>")
@@ -331,7 +329,8 @@ async def main():
                 "<b>⚠️ ANIME_NAME not set — aborting rename.</b>")
             sys.exit(1)
 
-        output_name, audio_type_label, audio_tracks, sub_tracks = probe_and_build_name()
+        with tracing.span("probe"):
+            output_name, audio_type_label, audio_tracks, sub_tracks = probe_and_build_name()
         print(f"[rename] Output filename: {output_name}")
 
         # ── 3. REMUX ───────────────────────────────────────────────────────
@@ -341,7 +340,8 @@ async def main():
             "│ Repackaging streams...             \n"
             "└────────────────────────────────────┘</code>")
 
-        remux(output_name)
+        with tracing.span("remux", file=output_name):
+            remux(output_name)
 
         # ── 4. THUMBNAIL ───────────────────────────────────────────────────
         await tg_edit(app, CHAT_ID, status.id,
@@ -349,7 +349,8 @@ async def main():
             "│ Capturing frame preview...         \n"
             "└────────────────────────────────────┘</code>")
 
-        has_thumb = capture_thumbnail(output_name)
+        with tracing.span("thumbnail"):
+            has_thumb = capture_thumbnail(output_name)
 
         # ── 5. UPLOAD ──────────────────────────────────────────────────────
         final_size = os.path.getsize(output_name) / 1_048_576
@@ -379,15 +380,18 @@ async def main():
 
         _ui.last_up_pct = -1; _ui.last_up_update = 0; _ui.up_start_time = 0
 
-        await app.send_document(
-            chat_id=CHAT_ID,
-            document=output_name,
-            thumb=THUMBNAIL if has_thumb else None,
-            caption=report,
-            parse_mode=enums.ParseMode.HTML,
-            progress=upload_progress,
-            progress_args=(app, CHAT_ID, status, output_name),
-        )
+        # Upload time can't be in its own caption — everything before it is
+        report = with_phase_report(report, tracing.summary())
+        async with tracing.span("tg_upload", bytes=os.path.getsize(output_name)):
+            await send_document_fast(
+                app, CHAT_ID,
+                output_name,
+                thumb=THUMBNAIL if has_thumb else None,
+                caption=report,
+                parse_mode=enums.ParseMode.HTML,
+                progress=upload_progress,
+                progress_args=(app, CHAT_ID, status, output_name),
+            )
 
         try: await status.delete()
         except: pass
@@ -400,14 +404,19 @@ async def main():
 
     except Exception as e:
         traceback.print_exc()
+        print(f"[trace] Phase timings:\n{tracing.format_table()}")
         try:
             await tg_edit(app, CHAT_ID, status.id,
                 f"<b>❌ RENAME MISSION FAILED</b>\n<code>{e}</code>")
         except: pass
         sys.exit(1)
     finally:
+        await tg_scheduler.flush()
         try: await app.stop()
         except: pass
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        tracing.save("rename")
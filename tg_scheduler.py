@@ -0,0 +1,200 @@
+"""
+tg_scheduler.py — One queue for every Telegram API call the pipeline makes
+Status edits, upload progress, Gofile progress and download progress used to
+call edit_message_text straight away and each sleep out its own FloodWait
+inline. Everything now goes through submit():
+
+  * per-chat token bucket (TG_SCHED_RATE calls/s, bursts of TG_SCHED_BURST)
+  * calls sharing a key (e.g. edits of one message) coalesce — only the
+    latest text is sent, every waiter gets that call's result
+  * PRIORITY_CRITICAL (final document, report caption, failure notice) jumps
+    ahead of PRIORITY_NORMAL status edits and PRIORITY_PROGRESS bars
+  * a FloodWait pauses only the chat that raised it; the scheduler retries
+    the call once the wait is over, and other chats keep moving
+
+    await tg_scheduler.edit_text(app, chat_id, msg.id, text)              # fire-and-forget
+    await tg_scheduler.submit(chat_id, lambda: app.send_message(...),
+                              priority=tg_scheduler.PRIORITY_CRITICAL, wait=True)
+    await tg_scheduler.flush()        # before app.stop()
+
+stats() returns the sent / coalesced / flood-delayed counters.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+from pyrogram import enums
+from pyrogram.errors import FloodWait
+
+import config
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL   = 1
+PRIORITY_PROGRESS = 2
+
+_queue    = []                  # heap of (priority, seq, key)
+_pending  = {}                  # key → job dict
+_inflight = set()               # keys currently being sent
+_buckets  = {}                  # chat_id → {"tokens", "stamp", "flood_until"}
+_seq      = itertools.count()
+_wake     = None
+_runner   = None
+_counters = {"sent": 0, "coalesced": 0, "flood_delayed": 0, "failed": 0, "max_flood": 0}
+
+
+def stats() -> dict:
+    return dict(_counters)
+
+
+def _bucket(chat_id) -> dict:
+    if chat_id not in _buckets:
+        _buckets[chat_id] = {"tokens": float(config.TG_SCHED_BURST), "stamp": time.monotonic(),
+                             "flood_until": 0.0}
+    b   = _buckets[chat_id]
+    now = time.monotonic()
+    b["tokens"] = min(float(config.TG_SCHED_BURST), b["tokens"] + (now - b["stamp"]) * config.TG_SCHED_RATE)
+    b["stamp"]  = now
+    return b
+
+
+def _ready_in(chat_id) -> float:
+    """Seconds until *chat_id* may send again (0 = now)."""
+    b   = _bucket(chat_id)
+    now = time.monotonic()
+    if b["flood_until"] > now:
+        return b["flood_until"] - now
+    if b["tokens"] >= 1:
+        return 0.0
+    return (1 - b["tokens"]) / config.TG_SCHED_RATE
+
+
+def _resolve(job, result=None, error=None):
+    for fut in job["futures"]:
+        if fut.done():
+            continue
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+
+async def _send(job):
+    key = job["key"]
+    try:
+        result = await job["call"]()
+    except FloodWait as e:
+        _counters["flood_delayed"] += 1
+        _counters["max_flood"]      = max(_counters["max_flood"], e.value)
+        _bucket(job["chat_id"])["flood_until"] = time.monotonic() + e.value + 1
+        print(f"[tg-sched] FloodWait {e.value}s on chat {job['chat_id']} — deferring")
+        if key in _pending:
+            # A newer call for the same key is already queued; it supersedes this one
+            _pending[key]["futures"].extend(job["futures"])
+        else:
+            _push(job)
+    except Exception as e:
+        _counters["failed"] += 1
+        if "MESSAGE_NOT_MODIFIED" not in str(e):
+            print(f"[tg-sched] {key[0]} failed on chat {job['chat_id']}: {e}")
+        _resolve(job, error=e)
+    else:
+        _counters["sent"] += 1
+        _resolve(job, result=result)
+    finally:
+        _inflight.discard(key)
+        _wake.set()
+
+
+def _push(job):
+    _pending[job["key"]] = job
+    heapq.heappush(_queue, (job["priority"], next(_seq), job["key"]))
+    _wake.set()
+
+
+async def _run():
+    while True:
+        _wake.clear()
+        delay, skipped = None, []
+        while _queue:
+            priority, seq, key = heapq.heappop(_queue)
+            job = _pending.get(key)
+            if job is None or job["priority"] != priority:
+                continue                        # stale heap entry (coalesced / re-prioritised)
+            wait = _ready_in(job["chat_id"])
+            if key in _inflight or wait > 0:
+                skipped.append((priority, seq, key))
+                if key not in _inflight:
+                    delay = wait if delay is None else min(delay, wait)
+                continue
+            del _pending[key]
+            _bucket(job["chat_id"])["tokens"] -= 1
+            _inflight.add(key)
+            asyncio.create_task(_send(job))
+        for entry in skipped:
+            heapq.heappush(_queue, entry)
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _ensure_runner():
+    global _wake, _runner
+    if _runner is None or _runner.done():
+        _wake   = asyncio.Event()
+        _runner = asyncio.create_task(_run())
+
+
+async def submit(chat_id, call, priority: int = PRIORITY_NORMAL, key=None, wait: bool = False):
+    """
+    Queue *call* (a zero-arg coroutine factory) for *chat_id*. Calls with the
+    same *key* coalesce into the newest one. wait=True returns its result
+    (or raises its error); otherwise returns immediately.
+    """
+    _ensure_runner()
+    key  = key if key is not None else ("call", next(_seq))
+    loop = asyncio.get_running_loop()
+    fut  = loop.create_future()
+    if not wait:
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+    job = _pending.get(key)
+    if job:
+        _counters["coalesced"] += 1
+        job["call"] = call
+        job["futures"].append(fut)
+        if priority < job["priority"]:
+            job["priority"] = priority
+            heapq.heappush(_queue, (priority, next(_seq), key))
+        _wake.set()
+    else:
+        _push({"key": key, "chat_id": chat_id, "call": call, "priority": priority, "futures": [fut]})
+    if wait:
+        return await fut
+
+
+async def edit_text(app, chat_id, message_id, text: str, priority: int = PRIORITY_NORMAL,
+                    wait: bool = False, reply_markup=None):
+    """edit_message_text, coalesced per message. Errors are logged by the scheduler, never raised."""
+    kwargs = dict(parse_mode=enums.ParseMode.HTML)
+    if reply_markup:
+        kwargs["reply_markup"] = reply_markup
+    try:
+        return await submit(
+            chat_id, lambda: app.edit_message_text(chat_id, message_id, text, **kwargs),
+            priority=priority, key=("edit", chat_id, message_id), wait=wait,
+        )
+    except Exception:
+        return None
+
+
+async def flush(timeout: float = 30.0):
+    """Wait for queued calls (pending FloodWaits included, up to *timeout*) and log counters."""
+    deadline = time.monotonic() + timeout
+    while (_pending or _inflight) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if _pending:
+        print(f"[tg-sched] {len(_pending)} call(s) dropped at shutdown")
+    c = _counters
+    print(f"[tg-sched] sent {c['sent']} | coalesced {c['coalesced']} | "
+          f"flood-delayed {c['flood_delayed']} (max {c['max_flood']}s) | failed {c['failed']}")
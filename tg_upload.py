@@ -0,0 +1,309 @@
+"""
+tg_upload.py — Multi-connection Telegram document upload
+pyrogram's save_file() pushes every part of a big file through a single
+media session. send_document_fast() opens TG_UPLOAD_CONNECTIONS media
+sessions to the account's DC, spreads upload.SaveBigFilePart calls across
+them, then sends the document with the same caption / thumbnail / buttons /
+progress semantics as app.send_document() and returns the Message.
+
+Part size scales with the file (Telegram caps it at 512 KiB and 4000 parts
+for a 2 GB upload). In-flight parts per connection start low and ramp up
+while throughput keeps improving; a FloodWait or timeout halves them.
+
+Small files, or any failure to open the extra sessions, fall back to
+app.send_document().
+
+send_document_group() does the same for several files (the parts of an
+output split for Telegram's 2 GB cap) and sends them as one album.
+"""
+import asyncio
+import mimetypes
+import os
+import time
+
+from pyrogram import raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+import config
+import tg_scheduler
+
+MAX_PART_SIZE = 512 * 1024
+MAX_PARTS     = 4000
+RAMP_INTERVAL = 2.0      # seconds between concurrency adjustments
+
+
+def part_size_for(file_size: int) -> int:
+    """Smallest power-of-two KiB part (≥ 64 KiB) keeping the count under MAX_PARTS."""
+    size = 64 * 1024
+    while size < MAX_PART_SIZE and -(-file_size // size) > MAX_PARTS:
+        size *= 2
+    return size
+
+
+async def _open_sessions(app, count: int) -> list:
+    sessions = []
+    dc_id     = await app.storage.dc_id()
+    auth_key  = await app.storage.auth_key()
+    test_mode = await app.storage.test_mode()
+    for _ in range(count):
+        session = Session(app, dc_id, auth_key, test_mode, is_media=True)
+        try:
+            await session.start()
+            sessions.append(session)
+        except Exception as e:
+            print(f"[tg-upload] Could not open media session: {e}")
+            break
+    return sessions
+
+
+async def upload_big_file(app, path: str, progress=None, progress_args=()):
+    """
+    Upload *path* as a big file over parallel media sessions.
+    Returns raw.types.InputFileBig for use in SendMedia.
+    """
+    file_size   = os.path.getsize(path)
+    part_size   = part_size_for(file_size)
+    total_parts = -(-file_size // part_size)
+    file_id     = app.rnd_id()
+
+    sessions = await _open_sessions(app, max(1, config.TG_UPLOAD_CONNECTIONS))
+    if not sessions:
+        raise RuntimeError("no media session available")
+
+    max_inflight = max(1, config.TG_UPLOAD_MAX_INFLIGHT)
+    workers_per  = {"limit": min(2, max_inflight)}      # in-flight parts per session, adjusted live
+    queue        = asyncio.Queue()
+    for idx in range(total_parts):
+        queue.put_nowait(idx)
+    sent_bytes   = [0]
+    per_session  = [{"bytes": 0, "parts": 0, "busy": 0.0} for _ in sessions]
+    errors       = [0]
+    started      = time.time()
+
+    async def _worker(s_idx: int, slot: int):
+        session = sessions[s_idx]
+        with open(path, "rb") as f:
+            while True:
+                # Slots above the current limit idle until the ramp lets them in
+                while slot >= workers_per["limit"]:
+                    if queue.empty():
+                        return
+                    await asyncio.sleep(0.2)
+                try:
+                    idx = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                f.seek(idx * part_size)
+                chunk = f.read(part_size)
+                t0 = time.time()
+                try:
+                    await session.invoke(raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=idx,
+                        file_total_parts=total_parts, bytes=chunk,
+                    ))
+                except FloodWait as e:
+                    errors[0] += 1
+                    queue.put_nowait(idx)
+                    await asyncio.sleep(e.value)
+                    continue
+                except (asyncio.TimeoutError, OSError):
+                    errors[0] += 1
+                    queue.put_nowait(idx)
+                    continue
+                stats = per_session[s_idx]
+                stats["bytes"] += len(chunk)
+                stats["parts"] += 1
+                stats["busy"]  += time.time() - t0
+                sent_bytes[0]  += len(chunk)
+                if progress:
+                    await progress(min(sent_bytes[0], file_size), file_size, *progress_args)
+
+    async def _ramp():
+        last_bytes, last_rate, last_errors = 0, 0.0, 0
+        while True:
+            await asyncio.sleep(RAMP_INTERVAL)
+            rate = (sent_bytes[0] - last_bytes) / RAMP_INTERVAL
+            if errors[0] > last_errors:
+                workers_per["limit"] = max(1, workers_per["limit"] // 2)
+            elif rate > last_rate * 1.05 and workers_per["limit"] < max_inflight:
+                workers_per["limit"] += 1
+            last_bytes, last_rate, last_errors = sent_bytes[0], rate, errors[0]
+
+    ramp    = asyncio.create_task(_ramp())
+    workers = [asyncio.create_task(_worker(s, slot))
+               for s in range(len(sessions)) for slot in range(max_inflight)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        # One failed worker must not leave the others invoking on stopped sessions
+        ramp.cancel()
+        for t in workers:
+            t.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception:
+                pass
+
+    if not queue.empty():
+        raise RuntimeError(f"{queue.qsize()} part(s) left unsent")
+
+    elapsed = time.time() - started
+    print(f"[tg-upload] {file_size/(1024**2):.1f} MB in {elapsed:.1f}s "
+          f"({file_size/(1024**2)/max(elapsed, 1e-6):.2f} MB/s) | {len(sessions)} conn x "
+          f"≤{workers_per['limit']} in flight | part {part_size//1024} KiB | {errors[0]} retries")
+    for i, stats in enumerate(per_session):
+        rate = stats["bytes"] / (1024**2) / elapsed if elapsed > 0 else 0
+        print(f"[tg-upload]   conn {i}: {stats['parts']} parts | {rate:.2f} MB/s")
+
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=os.path.basename(path))
+
+
+async def send_document_fast(app, chat_id, document: str, thumb: str | None = None,
+                             caption: str = "", parse_mode=None, reply_markup=None,
+                             progress=None, progress_args=()):
+    """Drop-in for app.send_document() on a local file path. Returns the Message."""
+    if getattr(app, "is_gateway", False):
+        # tg_gateway.py runs this same function on its own client
+        return await app.send_document(
+            chat_id, document, thumb=thumb, caption=caption, parse_mode=parse_mode,
+            reply_markup=reply_markup, progress=progress, progress_args=progress_args,
+        )
+    if os.path.getsize(document) < config.TG_FAST_UPLOAD_MIN_MB * 1024 * 1024:
+        return await app.send_document(
+            chat_id=chat_id, document=document, thumb=thumb, caption=caption,
+            parse_mode=parse_mode, reply_markup=reply_markup,
+            progress=progress, progress_args=progress_args,
+        )
+    try:
+        input_file = await upload_big_file(app, document, progress, progress_args)
+    except Exception as e:
+        print(f"[tg-upload] Parallel upload failed ({e}) — falling back to send_document.")
+        return await app.send_document(
+            chat_id=chat_id, document=document, thumb=thumb, caption=caption,
+            parse_mode=parse_mode, reply_markup=reply_markup,
+            progress=progress, progress_args=progress_args,
+        )
+
+    file_name = os.path.basename(document)
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(file_name)[0] or "video/x-matroska",
+        file=input_file,
+        thumb=await app.save_file(thumb) if thumb else None,
+        attributes=[raw.types.DocumentAttributeFilename(file_name=file_name)],
+    )
+    peer = await app.resolve_peer(chat_id)
+    text   = await utils.parse_text_entities(app, caption, parse_mode, None)
+    markup = await reply_markup.write(app) if reply_markup else None
+    r = await tg_scheduler.submit(
+        chat_id,
+        lambda: app.invoke(raw.functions.messages.SendMedia(
+            peer=peer, media=media, random_id=app.rnd_id(),
+            reply_markup=markup,
+            **text,
+        )),
+        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+    )
+
+    messages = await _parse_sent(app, r)
+    return messages[0] if messages else None
+
+
+async def _parse_sent(app, r) -> list:
+    users = {u.id: u for u in r.users}
+    chats = {c.id: c for c in r.chats}
+    return [
+        await types.Message._parse(app, update.message, users, chats)
+        for update in r.updates
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))
+    ]
+
+
+# ---------------------------------------------------------------------------
+# MEDIA GROUP — split parts of an oversize encode, uploaded concurrently and
+# sent as one ordered album
+# ---------------------------------------------------------------------------
+GROUP_LIMIT = 10     # Telegram's max items per album
+
+
+async def upload_file(app, path: str, progress=None, progress_args=()):
+    """InputFile for *path*: parallel big-file upload, or save_file() for small files / on failure."""
+    if os.path.getsize(path) >= config.TG_FAST_UPLOAD_MIN_MB * 1024 * 1024:
+        try:
+            return await upload_big_file(app, path, progress, progress_args)
+        except Exception as e:
+            print(f"[tg-upload] Parallel upload of {os.path.basename(path)} failed ({e}) — using save_file.")
+    return await app.save_file(path, progress=progress, progress_args=progress_args)
+
+
+async def send_document_group(app, chat_id, paths: list[str], thumb: str | None = None,
+                              caption: str = "", parse_mode=None,
+                              progress=None, progress_args=()) -> list:
+    """
+    Upload every file in *paths* concurrently (TG_SPLIT_PARALLEL at a time)
+    and send them as ordered albums of up to GROUP_LIMIT documents. *caption*
+    goes on the first document. progress() sees combined bytes across parts.
+    Returns the sent Messages in order.
+    """
+    if getattr(app, "is_gateway", False):
+        return await app.send_document_group(
+            chat_id, paths, thumb=thumb, caption=caption, parse_mode=parse_mode,
+            progress=progress, progress_args=progress_args,
+        )
+    total     = sum(os.path.getsize(p) for p in paths)
+    sent      = {}
+    semaphore = asyncio.Semaphore(max(1, config.TG_SPLIT_PARALLEL))
+    peer      = await app.resolve_peer(chat_id)
+    thumb_file = await app.save_file(thumb) if thumb else None
+
+    async def _part_progress(current, _total, path):
+        sent[path] = current
+        if progress:
+            await progress(sum(sent.values()), total, *progress_args)
+
+    async def _upload(path: str):
+        async with semaphore:
+            input_file = await upload_file(app, path, _part_progress, (path,))
+        file_name = os.path.basename(path)
+        media = await tg_scheduler.submit(
+            chat_id,
+            lambda: app.invoke(raw.functions.messages.UploadMedia(
+                peer=peer,
+                media=raw.types.InputMediaUploadedDocument(
+                    mime_type=mimetypes.guess_type(file_name)[0] or "video/x-matroska",
+                    file=input_file,
+                    thumb=thumb_file,
+                    attributes=[raw.types.DocumentAttributeFilename(file_name=file_name)],
+                ),
+            )),
+            priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+        )
+        return raw.types.InputMediaDocument(id=raw.types.InputDocument(
+            id=media.document.id,
+            access_hash=media.document.access_hash,
+            file_reference=media.document.file_reference,
+        ))
+
+    uploaded = await asyncio.gather(*(_upload(p) for p in paths))
+    print(f"[tg-upload] {len(paths)} part(s) uploaded — sending album")
+
+    messages = []
+    for start in range(0, len(uploaded), GROUP_LIMIT):
+        multi_media = []
+        for i, media in enumerate(uploaded[start:start + GROUP_LIMIT], start):
+            text = await utils.parse_text_entities(app, caption if i == 0 else "", parse_mode, None)
+            multi_media.append(raw.types.InputSingleMedia(
+                media=media, random_id=app.rnd_id(),
+                message=text["message"], entities=text["entities"],
+            ))
+        r = await tg_scheduler.submit(
+            chat_id,
+            lambda: app.invoke(raw.functions.messages.SendMultiMedia(
+                peer=peer, multi_media=multi_media,
+            )),
+            priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+        )
+        messages.extend(sorted(await _parse_sent(app, r), key=lambda m: m.id))
+    return messages
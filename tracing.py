@@ -0,0 +1,214 @@
+"""
+tracing.py — Nested timing spans, written as a Chrome trace
+total_mission_time and the [MONITOR] prints don't say where a slow job
+spent its time. Each phase wraps its steps in spans:
+
+    with tracing.span("download", source="t.me") as sp:
+        ...
+        sp.set(bytes=size, mb_s=size / elapsed / 2**20)
+
+    vmaf_task = asyncio.create_task(tracing.traced("vmaf", get_vmaf(...)))
+    sp = tracing.start("encode"); ...; sp.end(frames=n)
+
+Spans nest through a contextvar, so a task created inside a span is its
+child and concurrent tasks keep their own parents. save() merges this
+process's spans into TRACE_FILE in Chrome trace-event format (load it in
+chrome://tracing or Perfetto). Each phase process (tg_handler, main,
+upload, tg_rename) shows up as its own pid on one shared wall-clock axis.
+
+summary() aggregates the top two levels per span name across every process
+in the trace so far. ui.get_phase_report() renders it for the Telegram
+report and format_table() renders it for the failure log.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+import config
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_events  = []                   # finished spans of this process (Chrome "X" events)
+_tids    = {}                   # asyncio task / thread → small lane number
+_lock    = threading.Lock()
+
+
+def _tid() -> int:
+    try:
+        owner = asyncio.current_task()
+    except RuntimeError:
+        owner = None
+    key = id(owner) if owner else threading.get_ident()
+    return _tids.setdefault(key, len(_tids) + 1)
+
+
+class Span:
+    """One timed section. Use as a (sync or async) context manager."""
+
+    def __init__(self, name: str, **attrs):
+        self.name   = name
+        self.attrs  = attrs
+        self.parent = None
+        self.depth  = 0
+        self.start  = 0.0
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.depth  = self.parent.depth + 1 if self.parent else 0
+        self.start  = time.time()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.time()
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            _current.set(self.parent)       # exited from another context (e.g. a callback)
+        args = {k: v for k, v in self.attrs.items() if v is not None}
+        args["depth"] = self.depth
+        if self.parent:
+            args["parent"] = self.parent.name
+        if exc_type is not None:
+            args["error"] = f"{exc_type.__name__}: {exc}"[:200]
+        with _lock:
+            _events.append({
+                "name": self.name, "cat": "phase", "ph": "X",
+                "ts":   int(self.start * 1e6), "dur": int((end - self.start) * 1e6),
+                "pid":  os.getpid(), "tid": _tid(), "args": args,
+            })
+        return False
+
+    def end(self, **attrs):
+        """Close a span opened with start()."""
+        self.set(**attrs)
+        self.__exit__(None, None, None)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def span(name: str, **attrs) -> Span:
+    return Span(name, **attrs)
+
+
+def start(name: str, **attrs) -> Span:
+    """Open a span around a stretch of code too long to indent; close it with .end()."""
+    return Span(name, **attrs).__enter__()
+
+
+async def traced(name: str, coro, **attrs):
+    """Await *coro* inside a span — for work handed to asyncio.create_task()."""
+    with Span(name, **attrs):
+        return await coro
+
+
+def current() -> Span | None:
+    return _current.get()
+
+
+# ---------------------------------------------------------------------------
+# TRACE FILE
+# ---------------------------------------------------------------------------
+def _load() -> list[dict]:
+    if not config.TRACE_FILE:
+        return []
+    try:
+        with open(config.TRACE_FILE) as f:
+            return json.load(f).get("traceEvents", [])
+    except (OSError, ValueError, AttributeError):
+        return []
+
+
+def save(process: str | None = None):
+    """Merge this process's spans into TRACE_FILE (replacing its earlier save)."""
+    if not config.TRACE_FILE:
+        return
+    pid    = os.getpid()
+    label  = process or os.path.basename(sys.argv[0]) or "python"
+    events = [e for e in _load() if e.get("pid") != pid]
+    events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": label}})
+    with _lock:
+        events += _events
+    tmp = config.TRACE_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp, config.TRACE_FILE)
+    except OSError as e:
+        print(f"[trace] Could not write {config.TRACE_FILE}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# SUMMARY
+# ---------------------------------------------------------------------------
+def summary(max_depth: int = 1) -> list[dict]:
+    """
+    [{"name", "depth", "seconds", "count", "attrs"}] per span name, in order
+    of first start, over every process in the trace file plus this one.
+    Concurrent spans of one name add up, so totals can exceed wall time.
+    """
+    pid = os.getpid()
+    with _lock:
+        events = [e for e in _load() if e.get("pid") != pid] + list(_events)
+    rows = {}
+    for e in sorted((e for e in events if e.get("ph") == "X"), key=lambda e: e["ts"]):
+        depth = e["args"].get("depth", 0)
+        if depth > max_depth:
+            continue
+        row = rows.setdefault((e["name"], depth), {"name": e["name"], "depth": depth, "seconds": 0.0,
+                                                    "count": 0, "attrs": {}})
+        row["seconds"] += e["dur"] / 1e6
+        row["count"]   += 1
+        for k, v in e["args"].items():
+            if k in ("depth", "parent"):
+                continue
+            if isinstance(v, (int, float)) and k == "bytes":
+                row["attrs"][k] = row["attrs"].get(k, 0) + v
+            else:
+                row["attrs"][k] = v
+    return list(rows.values())
+
+
+def _fmt_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def describe(row: dict) -> str:
+    """The one attribute worth showing next to a phase's time."""
+    a = row["attrs"]
+    if "error" in a:
+        return "failed"
+    if a.get("fps"):
+        return f"{a['fps']:.1f} fps"
+    if a.get("bytes") and row["seconds"] > 0:
+        return f"{a['bytes'] / 2**20 / row['seconds']:.1f} MB/s"
+    return ""
+
+
+def format_table(rows: list[dict] | None = None) -> str:
+    """Plain-text phase table for logs."""
+    rows = summary() if rows is None else rows
+    if not rows:
+        return ""
+    lines = ["PHASE                    TIME      COUNT  NOTE"]
+    for r in rows:
+        name = ("  " * r["depth"] + r["name"])[:24]
+        lines.append(f"{name:<24} {_fmt_seconds(r['seconds']):>8}  {r['count']:>5}  {describe(r)}")
+    return "\n".join(lines)
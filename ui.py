@@ -1,10 +1,15 @@
 import time
 from datetime import timedelta
+import html
 import os
-from pyrogram import enums
+import re
+
+import tg_scheduler
 
 last_up_update = 0
 
+CAPTION_LIMIT = 1024        # Telegram media captions, counted after HTML parsing
+
 def generate_progress_bar(percentage):
     total_segments = 15
     completed = int((max(0, min(100, percentage)) / 100) * total_segments)
@@ -26,6 +31,61 @@ def get_vmaf_ui(percent, speed, eta):
         f"└────────────────────────────────────┘</code>"
     )
 
+def get_crf_search_report(result):
+    """Report block for a target-VMAF CRF search (see crf_search.py)."""
+    if not result:
+        return ""
+    probes = " | ".join(f"{p['crf']}→{p['vmaf']:.1f}" for p in result["probes"])
+    return (
+        f"🎯 <b>TARGET VMAF:</b> <code>{result['target']}</code> → CRF <code>{result['crf']}</code>"
+        f" (pred. <code>{result['predicted_mb']:.0f} MB</code>)\n"
+        f"└ Probes (CRF→VMAF): <code>{probes}</code>\n"
+    )
+
+def get_vmaf_report(summary):
+    """Report block for the frame-level VMAF summary (see metrics.py)."""
+    if not summary:
+        return ""
+    worst = ", ".join(f"{format_time(w['ts'])} ({w['vmaf']:.1f})" for w in summary["worst"][:3])
+    return (
+        f"📉 <b>VMAF DETAIL:</b> HM <code>{summary['harmonic_mean']:.2f}</code>"
+        f" | 1% <code>{summary['low_1']:.1f}</code> | 5% <code>{summary['low_5']:.1f}</code>"
+        f" | Min <code>{summary['min']:.1f}</code>\n"
+        f"└ Worst: <code>{worst}</code>\n"
+    )
+
+def get_phase_report(rows):
+    """Report block for the per-phase span summary (see tracing.py)."""
+    if not rows:
+        return ""
+    import tracing
+    lines = []
+    for r in rows[:12]:
+        note = tracing.describe(r)
+        name = ("└ " if r["depth"] else "") + r["name"]
+        lines.append(f"{name:<14}{format_time(r['seconds'])}" + (f"  {note}" if note else ""))
+    return "⏱ <b>PHASES:</b>\n<code>" + "\n".join(lines) + "</code>\n"
+
+def caption_length(text):
+    """Length Telegram counts for an HTML caption: tags stripped, UTF-16 code units."""
+    plain = html.unescape(re.sub(r"<[^>]+>", "", text))
+    return len(plain.encode("utf-16-le")) // 2
+
+def with_phase_report(report, rows):
+    """
+    *report* plus as much of the phase table as fits CAPTION_LIMIT: all rows,
+    then top-level rows only, then fewer of those, then none.
+    """
+    top = [r for r in rows if not r["depth"]]
+    for cut in [rows] + [top[:n] for n in range(len(top), 0, -1)]:
+        full = f"{report}\n\n{get_phase_report(cut)}"
+        if caption_length(full) <= CAPTION_LIMIT:
+            if len(cut) < min(len(rows), 12):
+                print(f"[trace] Caption limit: phase table cut to {len(cut)}/{len(rows)} row(s)")
+            return full
+    print("[trace] Caption limit: phase table left out of the report")
+    return report
+
 def get_download_fail_ui(error_msg):
     return (
         f"<code>┌─── ❌ [ DOWNLOAD.MISSION.FAILED ] ───┐\n"
@@ -78,8 +138,9 @@ def get_download_ui(percent, speed, size_mb, elapsed, eta):
         f"└────────────────────────────────────┘</code>"
     )
 
-def get_encode_ui(file_name, speed, fps, elapsed, eta, curr_sec, duration, percent, final_crf, final_preset, res_label, crop_label, hdr_label, grain_label, u_audio, u_bitrate, size, cpu=None, ram=None, demo_label=""):
+def get_encode_ui(file_name, speed, fps, elapsed, eta, curr_sec, duration, percent, final_crf, final_preset, res_label, crop_label, hdr_label, grain_label, u_audio, u_bitrate, size, cpu=None, ram=None, demo_label="", tune_label=""):
     bar = generate_progress_bar(percent)
+    tune_line = f"│ 🧮 THREADS: {tune_label}\n" if tune_label else ""
     sys_line = f"│ 🖥️ SYSTEM: CPU {cpu:.1f}% | RAM {ram:.1f}%\n" if cpu is not None and ram is not None else ""
     demo_line = f"│ ⚡ DEMO MODE:{demo_label}\n" if demo_label else ""
     return (
@@ -95,6 +156,7 @@ def get_encode_ui(file_name, speed, fps, elapsed, eta, curr_sec, duration, perce
         f"│ 🛠️ SETTINGS: CRF {final_crf} | Preset {final_preset}\n"
         f"│ 🎞️ VIDEO: {res_label}{crop_label} | 10-bit | {hdr_label}{grain_label}\n"
         f"│ 🔊 AUDIO: {u_audio.upper()} @ {u_bitrate}\n"
+        f"{tune_line}"
         f"│ 📦 SIZE: {size:.2f} MB\n"
         f"│                                    \n"
         f"{demo_line}"
@@ -106,7 +168,7 @@ async def upload_progress(current, total, app, chat_id, status_msg, file_name):
     global last_up_update
     now = time.time()
     
-    if now - last_up_update < 8:
+    if now - last_up_update < 8 or status_msg is None:
         return
         
     percent = (current / total) * 100
@@ -125,8 +187,6 @@ async def upload_progress(current, total, app, chat_id, status_msg, file_name):
         f"└────────────────────────────────────┘</code>"
     )
     
-    try:
-        await app.edit_message_text(chat_id, status_msg.id, scifi_up_ui, parse_mode=enums.ParseMode.HTML)
-    except Exception:
-        pass
+    await tg_scheduler.edit_text(app, chat_id, status_msg.id, scifi_up_ui,
+                                 priority=tg_scheduler.PRIORITY_PROGRESS)
     last_up_update = now
\ No newline at end of file
@@ -10,15 +10,20 @@ import subprocess
 import time
 import traceback
 
-from pyrogram import Client, enums
-from pyrogram.errors import FloodWait
+from pyrogram import enums
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 import config
-from media import async_generate_grid, get_vmaf, upload_to_cloud
+from media import async_generate_grid, get_vmaf, upload_to_cloud, close_http_session, split_for_telegram
 from rename import format_track_report
-from ui import format_time, upload_progress, get_failure_ui
+from ui import format_time, upload_progress, get_failure_ui, get_crf_search_report, get_vmaf_report, with_phase_report
+import metrics
+import tg_scheduler
+import tg_connect
+import tracing
+import tg_gateway
 import ui as _ui
+from tg_upload import send_document_fast, send_document_group
 
 
 # ---------------------------------------------------------------------------
@@ -48,74 +53,21 @@ def _resolve_session_names() -> list[str]:
 # CONNECT TELEGRAM — identical to main.py
 # ---------------------------------------------------------------------------
 async def connect_telegram(tg_state: dict, tg_ready: asyncio.Event, label: str):
-    session_names = _resolve_session_names()
-    flood_waits: dict[str, int] = {}
-
-    app = None
-    for session_name in session_names:
-        try:
-            candidate = Client(
-                session_name,
-                api_id=config.API_ID,
-                api_hash=config.API_HASH,
-                bot_token=config.BOT_TOKEN,
-            )
-            await candidate.start()
-            app = candidate
-            print(f"TG auth OK with session: {session_name}")
-            break
-        except FloodWait as e:
-            flood_waits[session_name] = e.value
-            print(f"FloodWait {e.value}s on '{session_name}' — trying next...")
-            continue
-        except Exception as e:
-            print(f"TG auth error on '{session_name}': {e} — trying next...")
-            continue
-
-    if app is None and flood_waits:
-        best_session = min(flood_waits, key=flood_waits.get)
-        wait_secs = flood_waits[best_session]
-        attempt = 0
-        while True:
-            attempt += 1
-            print(f"All sessions flooded. Sleeping {wait_secs}s (attempt {attempt})...")
-            await asyncio.sleep(wait_secs + 5)
-            try:
-                candidate = Client(
-                    best_session,
-                    api_id=config.API_ID,
-                    api_hash=config.API_HASH,
-                    bot_token=config.BOT_TOKEN,
-                )
-                await candidate.start()
-                app = candidate
-                print(f"TG auth OK (post-flood attempt {attempt}): {best_session}")
-                break
-            except FloodWait as e:
-                wait_secs = e.value
-                print(f"Another FloodWait: {wait_secs}s — retrying...")
-                continue
-            except Exception as e:
-                print(f"TG auth failed on post-flood attempt {attempt}: {e}")
-                return
-
+    started = time.time()
+    # A running tg_gateway.py already holds an authenticated client
+    async with tracing.span("tg_connect") as sp:
+        app = await tg_gateway.connect_client()
+        sp.set(via="gateway" if app else "direct")
+        if app is None:
+            app, _ = await tg_connect.connect(_resolve_session_names())
     if app is None:
         print("TG auth failed: no usable session found.")
         return
 
-    try:
-        status = await app.send_message(
-            config.CHAT_ID,
-            f"<b>[ UPLINK PHASE ] Preparing: {label}</b>",
-            parse_mode=enums.ParseMode.HTML,
-        )
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        status = await app.send_message(
-            config.CHAT_ID,
-            f"<b>[ UPLINK PHASE ] Preparing: {label}</b>",
-            parse_mode=enums.ParseMode.HTML,
-        )
+    # TG_STATUS_MESSAGE=false (batch.py): deliver without a status message of our own
+    status = None
+    if config.TG_STATUS_MESSAGE:
+        status = await tg_connect.send_status(app, f"<b>[ UPLINK PHASE ] Preparing: {label}</b>", started)
 
     tg_state["app"] = app
     tg_state["status"] = status
@@ -133,15 +85,38 @@ async def tg_edit(tg_state: dict, tg_ready: asyncio.Event, text: str, reply_mark
     status = tg_state.get("status")
     if not app or not status:
         return
+    # Queued and coalesced per message — never blocks the caller on FloodWait
+    await tg_scheduler.edit_text(app, config.CHAT_ID, status.id, text, reply_markup=reply_markup)
+
+
+# ---------------------------------------------------------------------------
+# CAPTION EDIT — identical to main.py
+# ---------------------------------------------------------------------------
+async def tg_edit_caption(app, message, caption: str, reply_markup=None):
     try:
-        kwargs = dict(parse_mode=enums.ParseMode.HTML)
-        if reply_markup:
-            kwargs["reply_markup"] = reply_markup
-        await app.edit_message_text(config.CHAT_ID, status.id, text, **kwargs)
-    except FloodWait as e:
-        await asyncio.sleep(e.value + 1)
-    except Exception:
-        pass
+        await tg_scheduler.submit(
+            config.CHAT_ID,
+            lambda: app.edit_message_caption(
+                config.CHAT_ID, message.id, caption,
+                parse_mode=enums.ParseMode.HTML, reply_markup=reply_markup,
+            ),
+            priority=tg_scheduler.PRIORITY_CRITICAL, key=("caption", config.CHAT_ID, message.id), wait=True,
+        )
+    except Exception as e:
+        # Don't leave the placeholder caption as the only result — post the
+        # report and links as a reply instead
+        print(f"[TG] Could not edit caption ({e}) — sending the report as a reply")
+        try:
+            await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.send_message(
+                    config.CHAT_ID, caption, parse_mode=enums.ParseMode.HTML,
+                    reply_markup=reply_markup, reply_to_message_id=message.id,
+                ),
+                priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+            )
+        except Exception as e:
+            print(f"[TG] Could not send the report: {e}")
 
 
 # ---------------------------------------------------------------------------
@@ -149,25 +124,33 @@ async def tg_edit(tg_state: dict, tg_ready: asyncio.Event, text: str, reply_mark
 # ---------------------------------------------------------------------------
 async def tg_notify_failure(tg_state: dict, tg_ready: asyncio.Event,
                             file_name: str, reason: str):
+    # Phase timings so far go to the console and the end of the log
+    table = tracing.format_table()
+    if table:
+        print(f"[trace] Phase timings:\n{table}")
+        if os.path.exists(config.LOG_FILE):
+            with open(config.LOG_FILE, "a") as f:
+                f.write(f"\n\n=== PHASE TIMINGS ===\n{table}\n")
     app    = tg_state.get("app")
     status = tg_state.get("status")
     if not app or not status:
         print(f"[TG-FAIL] TG unavailable — reason: {reason}")
         return
-    try:
-        await app.edit_message_text(
-            config.CHAT_ID, status.id,
-            get_failure_ui(file_name, reason, phase="UPLOAD"),
-            parse_mode=enums.ParseMode.HTML,
-        )
-    except Exception as e:
-        print(f"[TG-FAIL] Could not edit status: {e}")
+    await tg_scheduler.edit_text(
+        app, config.CHAT_ID, status.id,
+        get_failure_ui(file_name, reason, phase="UPLOAD"),
+        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+    )
     if os.path.exists(config.LOG_FILE):
         try:
-            await app.send_document(
-                config.CHAT_ID, config.LOG_FILE,
-                caption="<b>FULL MISSION LOG</b>",
-                parse_mode=enums.ParseMode.HTML,
+            await tg_scheduler.submit(
+                config.CHAT_ID,
+                lambda: app.send_document(
+                    config.CHAT_ID, config.LOG_FILE,
+                    caption="<b>FULL MISSION LOG</b>",
+                    parse_mode=enums.ParseMode.HTML,
+                ),
+                priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
             )
         except Exception as e:
             print(f"[TG-FAIL] Could not send log: {e}")
@@ -213,6 +196,7 @@ async def main():
     demo_start          = r["demo_start"]
     audio_tracks        = r["audio_tracks"]
     sub_tracks          = r["sub_tracks"]
+    crf_search          = r.get("crf_search")
 
     if not os.path.exists(config.FILE_NAME):
         raise FileNotFoundError(f"Encoded file not found: {config.FILE_NAME}")
@@ -227,8 +211,10 @@ async def main():
     app    = tg_state.get("app")
     status = tg_state.get("status")
 
-    if not app or not status:
+    if not app:
         print("TG unavailable — proceeding headlessly.")
+    elif not status:
+        print("No status message — progress stays off Telegram.")
 
     try:
         # 1. REMUX — copy chapters/attachments from source, stamp encoder title
@@ -236,38 +222,83 @@ async def main():
         fixed_file  = f"FIXED_{config.FILE_NAME}"
         source      = config.SOURCE if os.path.exists(config.SOURCE) else config.FILE_NAME
         title_args  = ["--title", config.ENCODER_TITLE] if config.ENCODER_TITLE.strip() else []
-        subprocess.run(
-            ["mkvmerge", "-o", fixed_file, *title_args,
-             config.FILE_NAME,
-             "--no-video", "--no-audio", "--no-subtitles", "--no-attachments", source],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-        )
+        with tracing.span("remux", file=config.FILE_NAME):
+            subprocess.run(
+                ["mkvmerge", "-o", fixed_file, *title_args,
+                 config.FILE_NAME,
+                 "--no-video", "--no-audio", "--no-subtitles", "--no-attachments", source],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
         if os.path.exists(fixed_file):
             os.remove(config.FILE_NAME)
             os.rename(fixed_file, config.FILE_NAME)
 
-        # 2. GRID + GOFILE concurrently
+        # 2. TG UPLOAD + VMAF + GOFILE concurrently — the document goes out with a
+        # placeholder caption; report and buttons are edited in at the end.
         final_size = os.path.getsize(config.FILE_NAME) / (1024 * 1024)
 
-        grid_task = asyncio.create_task(async_generate_grid(duration, config.FILE_NAME))
-
         if config.RUN_UPLOAD:
             await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.CLOUD ] Uploading to Gofile...</b>")
-            cloud_task = asyncio.create_task(
-                upload_to_cloud(config.FILE_NAME, app, config.CHAT_ID, status)
-            )
+            cloud_task = asyncio.create_task(tracing.traced(
+                "gofile", upload_to_cloud(config.FILE_NAME, app, config.CHAT_ID, status),
+                bytes=os.path.getsize(config.FILE_NAME),
+            ))
         else:
             cloud_task = None
 
         # 3. VMAF
+        vmaf_task = None
         if config.RUN_VMAF:
-            vmaf_val, ssim_val = await get_vmaf(
-                config.FILE_NAME, crop_val, width, height, duration, fps_val
-            )
+            vmaf_task = asyncio.create_task(tracing.traced("vmaf", get_vmaf(
+                config.FILE_NAME, crop_val, width, height, duration, fps_val,
+                ref_offset=r.get("range_from", 0.0),
+            ), mode=config.VMAF_MODE))
+
+        # Thumbnail has to exist before the upload starts (bounded by GRID_TIME_BUDGET)
+        async with tracing.span("thumbnail"):
+            await async_generate_grid(duration, config.FILE_NAME)
+        thumb = config.THUMBNAIL if os.path.exists(config.THUMBNAIL) else None
+
+        # Over Telegram's cap: split into self-contained parts sent as one album
+        split_parts = []
+        if final_size > 2000 and config.TG_SPLIT_MB > 0:
+            async with tracing.span("split"):
+                split_parts = await split_for_telegram(config.FILE_NAME)
+
+        doc_task = None
+        if final_size <= 2000 or split_parts:
+            _ui.last_up_pct = -1; _ui.last_up_update = 0; _ui.up_start_time = 0
+            await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.UPLINK ] Transmitting Final Video...</b>")
+            placeholder = f"📄 <code>{config.FILE_NAME}</code>\n<i>⏳ Quality report and links follow...</i>"
+            if split_parts:
+                doc_task = asyncio.create_task(tracing.traced("tg_upload", send_document_group(
+                    app, config.CHAT_ID, split_parts,
+                    thumb=thumb,
+                    caption=placeholder,
+                    parse_mode=enums.ParseMode.HTML,
+                    progress=upload_progress,
+                    progress_args=(app, config.CHAT_ID, status, config.FILE_NAME),
+                ), bytes=os.path.getsize(config.FILE_NAME), parts=len(split_parts)))
+            else:
+                doc_task = asyncio.create_task(tracing.traced("tg_upload", send_document_fast(
+                    app, config.CHAT_ID,
+                    config.FILE_NAME,
+                    thumb=thumb,
+                    caption=placeholder,
+                    parse_mode=enums.ParseMode.HTML,
+                    progress=upload_progress,
+                    progress_args=(app, config.CHAT_ID, status, config.FILE_NAME),
+                ), bytes=os.path.getsize(config.FILE_NAME)))
+
+        if vmaf_task:
+            vmaf_val, ssim_val, vmaf_summary = await vmaf_task
         else:
-            vmaf_val, ssim_val = "N/A", "N/A"
+            vmaf_val, ssim_val, vmaf_summary = "N/A", "N/A", None
+
+        r.update(vmaf=vmaf_val, ssim=ssim_val, vmaf_report=vmaf_summary)
+        with open("encode_results.json", "w") as f:
+            json.dump(r, f, indent=2)
 
-        await grid_task
         cloud = await cloud_task if cloud_task else {"direct": None, "page": None, "source": "disabled"}
 
         # 4. BUILD BUTTONS
@@ -281,17 +312,23 @@ async def main():
             btn_row.append(InlineKeyboardButton("Litterbox", url=cloud["direct"]))
         buttons = InlineKeyboardMarkup([btn_row]) if btn_row else None
 
-        # 5. SIZE OVERFLOW
-        if final_size > 2000:
-            await tg_edit(
-                tg_state, tg_ready,
-                "<b>[ SIZE OVERFLOW ]</b> File too large for Telegram. Cloud link below.",
-                reply_markup=buttons,
-            )
+        # 5. SIZE OVERFLOW — split disabled or mkvmerge failed
+        if doc_task is None:
+            overflow_text = "<b>[ SIZE OVERFLOW ]</b> File too large for Telegram. Cloud link below."
+            if status:
+                await tg_edit(tg_state, tg_ready, overflow_text, reply_markup=buttons)
+            elif app:
+                await tg_scheduler.submit(
+                    config.CHAT_ID,
+                    lambda: app.send_message(
+                        config.CHAT_ID, f"{overflow_text}\n<code>{config.FILE_NAME}</code>",
+                        parse_mode=enums.ParseMode.HTML, reply_markup=buttons,
+                    ),
+                    priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+                )
             return
 
         # 6. BUILD REPORT
-        thumb             = config.SCREENSHOT if os.path.exists(config.SCREENSHOT) else None
         crop_label_report = " | Cropped" if crop_val else ""
         track_report      = format_track_report(audio_tracks, sub_tracks)
 
@@ -311,6 +348,10 @@ async def main():
             f"⚡ <b>DEMO MODE:</b> <code>{demo_duration}s from {demo_start}</code>\n"
             if demo_mode else ""
         )
+        split_report_line = (
+            f"🧩 <b>PARTS:</b> <code>{len(split_parts)} × ≤{config.TG_SPLIT_MB} MB</code> (play in order)\n"
+            if split_parts else ""
+        )
 
         report = (
             f"✅ <b>MISSION ACCOMPLISHED</b>\n\n"
@@ -318,40 +359,49 @@ async def main():
             f"⏱ <b>TIME:</b> <code>{format_time(total_mission_time)}</code>\n"
             f"⏳<b>DURATION:</b> <code>{format_time(duration)}</code>\n"
             f"📦 <b>SIZE:</b> <code>{final_size:.2f} MB</code>\n"
-            f"📊 <b>QUALITY:</b> VMAF: <code>{vmaf_val}</code> | SSIM: <code>{ssim_val}</code>\n\n"
+            f"{split_report_line}"
+            f"📊 <b>QUALITY:</b> VMAF: <code>{vmaf_val}</code> | SSIM: <code>{ssim_val}</code>\n"
+            f"{get_vmaf_report(vmaf_summary)}\n"
             f"🛠 <b>SPECS:</b>\n"
             f"└ Preset: {final_preset} | CRF: {final_crf}\n"
             f"└ Video: {res_label}{crop_label_report} | {hdr_label}{grain_label}\n"
             f"└ Audio: {audio_mode_line}\n"
             f"{content_line}"
             f"{demo_report_line}"
+            f"{get_crf_search_report(crf_search)}"
             f"\n{track_report}"
             f"{user_track_notes}"
         )
 
-        # 7. TRANSMIT
-        _ui.last_up_pct = -1; _ui.last_up_update = 0; _ui.up_start_time = 0
-
-        await tg_edit(tg_state, tg_ready, "<b>[ SYSTEM.UPLINK ] Transmitting Final Video...</b>")
-
-        await app.send_document(
-            chat_id=config.CHAT_ID,
-            document=config.FILE_NAME,
-            thumb=thumb,
-            caption=report,
-            parse_mode=enums.ParseMode.HTML,
-            reply_markup=buttons,
-            progress=upload_progress,
-            progress_args=(app, config.CHAT_ID, status, config.FILE_NAME),
-        )
+        # 7. TRANSMIT — wait for the upload started in step 2, then fill in the caption
+        document = await doc_task
+        # Upload is done — the phase table now covers download, encode and delivery
+        report = with_phase_report(report, tracing.summary())
+        if split_parts:
+            # Albums can't carry inline buttons — links go in a reply
+            if document:
+                await tg_edit_caption(app, document[0], report)
+                if buttons:
+                    await tg_scheduler.submit(
+                        config.CHAT_ID,
+                        lambda: app.send_message(
+                            config.CHAT_ID, "🔗 <b>Cloud links</b>", parse_mode=enums.ParseMode.HTML,
+                            reply_markup=buttons, reply_to_message_id=document[0].id,
+                        ),
+                        priority=tg_scheduler.PRIORITY_CRITICAL, wait=True,
+                    )
+        else:
+            await tg_edit_caption(app, document, report, reply_markup=buttons)
 
         # 8. CLEANUP
         try: await status.delete()
         except: pass
         for f in [config.SOURCE, config.FILE_NAME, config.LOG_FILE,
-                  config.SCREENSHOT, "encode_results.json", "output_fname.txt"]:
+                  config.SCREENSHOT, config.THUMBNAIL, "encode_results.json", "output_fname.txt",
+                  tg_connect.STATUS_FILE, *split_parts]:
             if os.path.exists(f):
                 os.remove(f)
+        metrics.cleanup_logs()
 
     except Exception as exc:
         tb = traceback.format_exc()
@@ -365,11 +415,16 @@ async def main():
         await tg_notify_failure(tg_state, tg_ready, config.FILE_NAME, reason)
         raise
     finally:
+        await close_http_session()
         app = tg_state.get("app")
         if app:
+            await tg_scheduler.flush()
             try: await app.stop()
             except: pass
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        tracing.save("upload")
@@ -0,0 +1,355 @@
+"""
+worker.py — Local multi-job worker for self-hosted runners
+main.py assumes it owns the machine (fixed file names, every core). The
+worker runs several jobs at once by giving each one:
+
+  * its own working directory under WORKER_DIR, so config.SOURCE,
+    config.LOG_FILE, config.SCREENSHOT and friends never collide
+  * its own slice of the CPU affinity mask (WORKER_SLOTS slices). Every
+    phase is pinned to the slice, and svt_tune.effective_cpus() sizes lp,
+    tiles and chunk workers from it, so SVT_AUTOTUNE is forced on
+
+Jobs run the batch.py stages — download, main.py ENCODE_ONLY, upload.py —
+over one shared tg_gateway.py client. The queue is SQLite (WORKER_DB), and
+the next job is the shortest by estimated media duration, less
+WORKER_AGING per second it has waited.
+
+    python3 worker.py submit VIDEO_URL [KEY=VALUE ...]   # e.g. ANIME_NAME=Foo EPISODE=3
+    python3 worker.py run                                # the daemon
+    python3 worker.py status                             # queue depth, progress, throughput
+    python3 worker.py cancel JOB_ID                      # queued jobs only
+
+The daemon also rewrites WORKER_STATUS (JSON) every few seconds for
+dashboards.
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+import config
+
+POLL_SECONDS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    url           TEXT NOT NULL,
+    env           TEXT NOT NULL,
+    state         TEXT NOT NULL DEFAULT 'queued',   -- queued | running | done | failed | cancelled
+    stage         TEXT,
+    est_seconds   REAL,
+    media_seconds REAL,
+    cpus          TEXT,
+    error         TEXT,
+    submitted     REAL NOT NULL,
+    started       REAL,
+    finished      REAL
+)
+"""
+
+
+def _db() -> sqlite3.Connection:
+    conn = sqlite3.connect(config.WORKER_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(SCHEMA)
+    return conn
+
+
+# ---------------------------------------------------------------------------
+# SUBMIT
+# ---------------------------------------------------------------------------
+def estimate_seconds(url: str, env: dict) -> float | None:
+    """Media duration as the job's cost estimate; None when it can't be probed cheaply."""
+    demo = env.get("DEMO_DURATION", "").strip()
+    if demo.replace(".", "", 1).isdigit():
+        return float(demo)
+    if url.startswith("tg_file:") or "t.me/" in url:
+        return None
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", url],
+            capture_output=True, text=True, timeout=20,
+        ).stdout.strip()
+        return float(out)
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def submit(url: str, env: dict) -> int:
+    est = estimate_seconds(url, env)
+    with _db() as conn:
+        cur = conn.execute(
+            "INSERT INTO jobs (url, env, est_seconds, submitted) VALUES (?, ?, ?, ?)",
+            (url, json.dumps(env), est, time.time()),
+        )
+    print(f"[worker] Queued job #{cur.lastrowid}"
+          + (f" (~{est / 60:.0f} min of media)" if est else " (no estimate)"))
+    return cur.lastrowid
+
+
+def next_job(conn: sqlite3.Connection):
+    """Claim the queued job with the lowest aged estimate, or None."""
+    row = conn.execute(
+        "SELECT * FROM jobs WHERE state = 'queued' "
+        "ORDER BY COALESCE(est_seconds, ?) - (? - submitted) * ?, id LIMIT 1",
+        (config.WORKER_DEFAULT_EST, time.time(), config.WORKER_AGING),
+    ).fetchone()
+    if row is None:
+        return None
+    claimed = conn.execute(
+        "UPDATE jobs SET state = 'running', started = ? WHERE id = ? AND state = 'queued'",
+        (time.time(), row["id"]),
+    ).rowcount
+    return row if claimed else None
+
+
+# ---------------------------------------------------------------------------
+# CPU SLICES
+# ---------------------------------------------------------------------------
+def cpu_slices(slots: int) -> list[list[int]]:
+    """The daemon's affinity mask split into *slots* contiguous slices."""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = list(range(os.cpu_count() or 1))
+    slots = max(1, min(slots, len(cpus)))
+    per   = len(cpus) // slots
+    return [cpus[i * per:(i + 1) * per if i < slots - 1 else len(cpus)] for i in range(slots)]
+
+
+# ---------------------------------------------------------------------------
+# JOB
+# ---------------------------------------------------------------------------
+def job_dir(job_id: int) -> str:
+    return os.path.abspath(os.path.join(config.WORKER_DIR, f"job_{job_id}"))
+
+
+def kill_orphans(workdir: str) -> int:
+    """
+    SIGKILL every process still running inside *workdir* — phases (and
+    their ffmpeg children) left behind by a daemon that died. Linux /proc.
+    """
+    killed = 0
+    for pid in (os.listdir("/proc") if os.path.isdir("/proc") else []):
+        if not pid.isdigit():
+            continue
+        try:
+            cwd = os.readlink(f"/proc/{pid}/cwd")
+        except OSError:
+            continue
+        if cwd == workdir or cwd.startswith(workdir + os.sep):
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+                killed += 1
+            except OSError:
+                pass
+    return killed
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+async def run_job(app, conn: sqlite3.Connection, row, cpus: list[int], live: dict):
+    import batch
+
+    env = json.loads(row["env"])
+    ep  = {
+        "url":         row["url"],
+        "season":      env.get("SEASON", config.SEASON),
+        "episode":     env.get("EPISODE", config.EPISODE),
+        "custom_name": env.get("CUSTOM"),
+        "label":       f"job{row['id']}",
+        "workdir":     job_dir(row["id"]),
+        # lp / tiles / chunk workers follow the pinned slice
+        "env":         {**env, "SVT_AUTOTUNE": "true"},
+    }
+    live[row["id"]] = {"stage": "downloading", "cpus": cpus, "workdir": ep["workdir"],
+                       "started": time.time()}
+    conn.execute("UPDATE jobs SET cpus = ? WHERE id = ?", (",".join(map(str, cpus)), row["id"]))
+    os.makedirs(ep["workdir"], exist_ok=True)
+    print(f"[worker] Job #{row['id']} started on CPUs {cpus[0]}-{cpus[-1]}")
+
+    try:
+        for stage, step in (("downloading", lambda: batch.download(app, ep)),
+                            ("encoding",    lambda: batch.encode(ep, cpus)),
+                            ("delivering",  lambda: batch.deliver(ep, cpus))):
+            live[row["id"]]["stage"] = stage
+            conn.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, row["id"]))
+            await step()
+            if stage == "encoding":
+                # upload.py removes encode_results.json once delivered
+                media = _read_json(os.path.join(ep["workdir"], "encode_results.json")).get("duration")
+                conn.execute("UPDATE jobs SET media_seconds = ? WHERE id = ?", (media, row["id"]))
+    except Exception as e:
+        print(f"[worker] Job #{row['id']} failed: {e} (logs kept in {ep['workdir']})")
+        batch.prune_workdir(ep["workdir"])
+        conn.execute("UPDATE jobs SET state = 'failed', error = ?, finished = ? WHERE id = ?",
+                     (str(e)[:500], time.time(), row["id"]))
+    else:
+        conn.execute("UPDATE jobs SET state = 'done', stage = NULL, finished = ? WHERE id = ?",
+                     (time.time(), row["id"]))
+        shutil.rmtree(ep["workdir"], ignore_errors=True)
+        print(f"[worker] Job #{row['id']} done in {time.time() - live[row['id']]['started']:.0f}s")
+    finally:
+        live.pop(row["id"], None)
+
+
+# ---------------------------------------------------------------------------
+# STATUS
+# ---------------------------------------------------------------------------
+def snapshot(conn: sqlite3.Connection, live: dict) -> dict:
+    now   = time.time()
+    depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+    hour  = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(media_seconds), 0) FROM jobs "
+        "WHERE state = 'done' AND finished > ?", (now - 3600,),
+    ).fetchone()
+    wait  = conn.execute(
+        "SELECT AVG(started - submitted) FROM jobs WHERE started IS NOT NULL AND started > ?",
+        (now - 3600,),
+    ).fetchone()[0]
+    running = []
+    for job_id, job in sorted(live.items()):
+        entry = {"id": job_id, "stage": job["stage"], "cpus": len(job["cpus"]),
+                 "elapsed": round(now - job["started"])}
+        if job["stage"] == "encoding":
+            entry["progress"] = _read_json(os.path.join(job["workdir"], "encode_progress.json"))
+        running.append(entry)
+    return {
+        "updated":     now,
+        "queue_depth": depth,
+        "running":     running,
+        "throughput":  {
+            "jobs_last_hour":      hour[0],
+            "media_hours_per_hour": round(hour[1] / 3600, 2),
+            "avg_queue_wait_s":    round(wait or 0),
+        },
+    }
+
+
+def write_status(status: dict):
+    tmp = config.WORKER_STATUS + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp, config.WORKER_STATUS)
+
+
+def print_status():
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE state IN ('queued', 'running') OR finished > ? ORDER BY id",
+            (time.time() - 86400,),
+        ).fetchall()
+    live = _read_json(config.WORKER_STATUS)
+    progress = {j["id"]: j.get("progress", {}) for j in live.get("running", [])}
+    for r in rows:
+        pct  = progress.get(r["id"], {}).get("percent")
+        est  = f"{r['est_seconds'] / 60:5.0f}m" if r["est_seconds"] else "    ?"
+        line = f"#{r['id']:<4} {r['state']:<9} {r['stage'] or '':<11} est {est}"
+        if pct is not None:
+            line += f"  {pct:5.1f}%  {progress[r['id']].get('fps', 0)} fps"
+        if r["error"]:
+            line += f"  {r['error'][:60]}"
+        print(line)
+    if live:
+        t = live["throughput"]
+        print(f"queue {live['queue_depth']} | running {len(live['running'])} | "
+              f"{t['jobs_last_hour']} job(s)/h | {t['media_hours_per_hour']} media-h/h | "
+              f"avg wait {t['avg_queue_wait_s']}s")
+
+
+# ---------------------------------------------------------------------------
+# DAEMON
+# ---------------------------------------------------------------------------
+async def run():
+    import batch
+
+    config.WORKER_DIR = os.path.abspath(config.WORKER_DIR)
+    conn = _db()
+    # Jobs that were running when the daemon died start over from a clean
+    # workdir, once anything the old daemon left running in it is gone
+    stale = [r["id"] for r in conn.execute("SELECT id FROM jobs WHERE state = 'running'")]
+    for job_id in stale:
+        killed = kill_orphans(job_dir(job_id))
+        if killed:
+            print(f"[worker] Job #{job_id}: killed {killed} orphaned process(es)")
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+        conn.execute("UPDATE jobs SET state = 'queued', stage = NULL WHERE id = ?", (job_id,))
+    if stale:
+        print(f"[worker] Requeued {len(stale)} interrupted job(s)")
+
+    slices = cpu_slices(config.WORKER_SLOTS)
+    free   = list(range(len(slices)))
+    live   = {}
+    tasks  = {}
+    print(f"[worker] {len(slices)} slot(s): " + " | ".join(f"{len(s)} CPU" for s in slices))
+
+    # SIGTERM unwinds like Ctrl-C, so the finally below stops every phase
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    app, server = await batch.ensure_gateway()
+    try:
+        while True:
+            while free:
+                row = next_job(conn)
+                if row is None:
+                    break
+                slot = free.pop(0)
+                task = asyncio.create_task(run_job(app, conn, row, slices[slot], live))
+                tasks[task] = slot
+            done = [t for t in tasks if t.done()]
+            for t in done:
+                free.append(tasks.pop(t))
+                free.sort()
+            write_status(snapshot(conn, live))
+            await asyncio.sleep(POLL_SECONDS)
+    finally:
+        for t in tasks:
+            t.cancel()
+        # run_phase() kills each cancelled job's process group before returning
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if server:
+            await app.shutdown()
+        # Close our connection before waiting: on 3.12+ the gateway's
+        # wait_closed() blocks until every client has hung up
+        await app.stop()
+        if server:
+            await server.wait()
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if cmd == "submit" and len(sys.argv) > 2:
+        env = dict(arg.split("=", 1) for arg in sys.argv[3:] if "=" in arg)
+        submit(sys.argv[2], env)
+    elif cmd == "run":
+        try:
+            asyncio.run(run())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("[worker] Stopped")
+    elif cmd == "cancel" and len(sys.argv) > 2:
+        with _db() as conn:
+            n = conn.execute("UPDATE jobs SET state = 'cancelled' WHERE id = ? AND state = 'queued'",
+                             (int(sys.argv[2]),)).rowcount
+        print(f"[worker] {'Cancelled' if n else 'Not queued:'} job #{sys.argv[2]}")
+    elif cmd == "status":
+        print_status()
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()